@@ -15,7 +15,8 @@ from decision_transformer.models.mlp_bc import MLPBCModel
 from decision_transformer.training.act_trainer import ActTrainer
 from decision_transformer.training.seq_trainer import SequenceTrainer
 
-from evaluate_DT import evaluate_one_episode
+from evaluate_DT import Evaluator
+from Parameters import dt_variant
 
 
 def discount_cumsum(x, gamma):
@@ -26,6 +27,91 @@ def discount_cumsum(x, gamma):
     return discount_cumsum
 
 
+def make_get_batch(trajectories, sorted_inds, p_sample, state_mean, state_std, K, max_ep_len, scale, device,
+                   state_dim=9, act_dim=4, seed=None):
+    '''get_batch of experiment, sampling padded windows of length K from the trajectories in sorted_inds
+
+    the windows come from a generator of its own, seed is an int or a np.random.SeedSequence
+    '''
+    num_trajectories = len(sorted_inds)
+    rng = np.random.default_rng(seed)
+
+    def get_batch(batch_size=256, max_len=K):
+        batch_inds = rng.choice(
+            np.arange(num_trajectories),
+            size=batch_size,
+            replace=True,
+            p=p_sample,  # reweights so we sample according to timesteps
+        )
+
+        s, a, r, d, rtg, timesteps, mask = [], [], [], [], [], [], []
+        for i in range(batch_size):
+            traj = trajectories[int(sorted_inds[batch_inds[i]])]
+            si = rng.integers(traj['rewards'].shape[0])
+            # ic(si)
+            # ic(traj['rewards'].shape[0])
+
+            # get sequences from dataset
+            s.append(traj['observations']
+                     [si:si + max_len].reshape(1, -1, state_dim))
+            a.append(traj['actions'][si:si + max_len].reshape(1, -1, act_dim))
+            r.append(traj['rewards'][si:si + max_len].reshape(1, -1, 1))
+            if 'terminals' in traj:
+                exit(1)
+                d.append(traj['terminals'][si:si + max_len].reshape(1, -1))
+            else:
+                d.append(traj['dones'][si:si + max_len].reshape(1, -1))
+            timesteps.append(np.arange(si, si + s[-1].shape[1]).reshape(1, -1))
+            timesteps[-1][timesteps[-1] >=
+                          max_ep_len] = max_ep_len-1  # padding cutoff
+            rtg.append(discount_cumsum(traj['rewards'][si:], gamma=1.)[
+                       :s[-1].shape[1] + 1].reshape(1, -1, 1))
+            if rtg[-1].shape[1] <= s[-1].shape[1]:
+                rtg[-1] = np.concatenate([rtg[-1],
+                                         np.zeros((1, 1, 1))], axis=1)
+
+            # padding and state + reward normalization
+            tlen = s[-1].shape[1]
+            # ic(tlen)
+            s[-1] = np.concatenate([np.zeros((1, max_len -
+                                   tlen, state_dim)), s[-1]], axis=1)
+            s[-1] = (s[-1] - state_mean) / state_std
+            a[-1] = np.concatenate([np.ones((1, max_len -
+                                   tlen, act_dim)) * 0., a[-1]], axis=1)
+            # a[-1] = np.concatenate([np.ones((1, max_len -
+                                #    tlen, act_dim)) * -10., a[-1]], axis=1)
+            r[-1] = np.concatenate([np.zeros((1, max_len -
+                                   tlen, 1)), r[-1]], axis=1)
+            d[-1] = np.concatenate([np.ones((1, max_len - tlen))
+                                   * 2, d[-1]], axis=1)
+            rtg[-1] = np.concatenate([np.zeros((1, max_len - tlen, 1)),
+                                     rtg[-1]], axis=1) / scale
+            timesteps[-1] = np.concatenate(
+                [np.zeros((1, max_len - tlen)), timesteps[-1]], axis=1)
+            mask.append(np.concatenate(
+                [np.zeros((1, max_len - tlen)), np.ones((1, tlen))], axis=1))
+
+        s = torch.from_numpy(np.concatenate(s, axis=0)).to(
+            dtype=torch.float32, device=device)
+        a = torch.from_numpy(np.concatenate(a, axis=0)).to(
+            dtype=torch.float32, device=device)
+        r = torch.from_numpy(np.concatenate(r, axis=0)).to(
+            dtype=torch.float32, device=device)
+        d = torch.from_numpy(np.concatenate(d, axis=0)).to(
+            dtype=torch.long, device=device)
+        rtg = torch.from_numpy(np.concatenate(rtg, axis=0)).to(
+            dtype=torch.float32, device=device)
+        timesteps = torch.from_numpy(np.concatenate(timesteps, axis=0)).to(
+            dtype=torch.long, device=device)
+        mask = torch.from_numpy(np.concatenate(mask, axis=0)).to(device=device)
+
+        # ic(s, a, r, d, rtg, timesteps, mask)
+        # exit()
+        return s, a, r, d, rtg, timesteps, mask
+
+    return get_batch
+
+
 def experiment(
         exp_prefix,
         variant,
@@ -119,78 +205,8 @@ def experiment(
     p_sample = traj_lens[sorted_inds] / sum(traj_lens[sorted_inds])
     ic(p_sample)
 
-    def get_batch(batch_size=256, max_len=K):
-        batch_inds = np.random.choice(
-            np.arange(num_trajectories),
-            size=batch_size,
-            replace=True,
-            p=p_sample,  # reweights so we sample according to timesteps
-        )
-
-        s, a, r, d, rtg, timesteps, mask = [], [], [], [], [], [], []
-        for i in range(batch_size):
-            traj = trajectories[int(sorted_inds[batch_inds[i]])]
-            si = random.randint(0, traj['rewards'].shape[0] - 1)
-            # ic(si)
-            # ic(traj['rewards'].shape[0])
-
-            # get sequences from dataset
-            s.append(traj['observations']
-                     [si:si + max_len].reshape(1, -1, state_dim))
-            a.append(traj['actions'][si:si + max_len].reshape(1, -1, act_dim))
-            r.append(traj['rewards'][si:si + max_len].reshape(1, -1, 1))
-            if 'terminals' in traj:
-                exit(1)
-                d.append(traj['terminals'][si:si + max_len].reshape(1, -1))
-            else:
-                d.append(traj['dones'][si:si + max_len].reshape(1, -1))
-            timesteps.append(np.arange(si, si + s[-1].shape[1]).reshape(1, -1))
-            timesteps[-1][timesteps[-1] >=
-                          max_ep_len] = max_ep_len-1  # padding cutoff
-            rtg.append(discount_cumsum(traj['rewards'][si:], gamma=1.)[
-                       :s[-1].shape[1] + 1].reshape(1, -1, 1))
-            if rtg[-1].shape[1] <= s[-1].shape[1]:
-                rtg[-1] = np.concatenate([rtg[-1],
-                                         np.zeros((1, 1, 1))], axis=1)
-
-            # padding and state + reward normalization
-            tlen = s[-1].shape[1]
-            # ic(tlen)
-            s[-1] = np.concatenate([np.zeros((1, max_len -
-                                   tlen, state_dim)), s[-1]], axis=1)
-            s[-1] = (s[-1] - state_mean) / state_std
-            a[-1] = np.concatenate([np.ones((1, max_len -
-                                   tlen, act_dim)) * 0., a[-1]], axis=1)
-            # a[-1] = np.concatenate([np.ones((1, max_len -
-                                #    tlen, act_dim)) * -10., a[-1]], axis=1)
-            r[-1] = np.concatenate([np.zeros((1, max_len -
-                                   tlen, 1)), r[-1]], axis=1)
-            d[-1] = np.concatenate([np.ones((1, max_len - tlen))
-                                   * 2, d[-1]], axis=1)
-            rtg[-1] = np.concatenate([np.zeros((1, max_len - tlen, 1)),
-                                     rtg[-1]], axis=1) / scale
-            timesteps[-1] = np.concatenate(
-                [np.zeros((1, max_len - tlen)), timesteps[-1]], axis=1)
-            mask.append(np.concatenate(
-                [np.zeros((1, max_len - tlen)), np.ones((1, tlen))], axis=1))
-
-        s = torch.from_numpy(np.concatenate(s, axis=0)).to(
-            dtype=torch.float32, device=device)
-        a = torch.from_numpy(np.concatenate(a, axis=0)).to(
-            dtype=torch.float32, device=device)
-        r = torch.from_numpy(np.concatenate(r, axis=0)).to(
-            dtype=torch.float32, device=device)
-        d = torch.from_numpy(np.concatenate(d, axis=0)).to(
-            dtype=torch.long, device=device)
-        rtg = torch.from_numpy(np.concatenate(rtg, axis=0)).to(
-            dtype=torch.float32, device=device)
-        timesteps = torch.from_numpy(np.concatenate(timesteps, axis=0)).to(
-            dtype=torch.long, device=device)
-        mask = torch.from_numpy(np.concatenate(mask, axis=0)).to(device=device)
-
-        # ic(s, a, r, d, rtg, timesteps, mask)
-        # exit()
-        return s, a, r, d, rtg, timesteps, mask
+    get_batch = make_get_batch(trajectories, sorted_inds, p_sample, state_mean, state_std,
+                               K, max_ep_len, scale, device, state_dim, act_dim, variant.get('seed'))
 
     def eval_episodes(target_rew):
         def fn(model):
@@ -287,7 +303,7 @@ def experiment(
             scheduler=scheduler,
             loss_fn=lambda s_hat, a_hat, r_hat, s, a, r: torch.mean(
                 (a_hat - a)**2),
-            eval_fns=evaluate_one_episode,
+            eval_fns=Evaluator(device=device),
         )
     elif model_type == 'bc':
         trainer = ActTrainer(
@@ -320,6 +336,8 @@ def experiment(
         # Create folder Results if it does not exist
         if not os.path.exists('Results'):
             os.makedirs('Results')
+        # the model is trained on (s - state_mean) / state_std, the saved models need them to act
+        np.savez('state_stats.npz', state_mean=state_mean, state_std=state_std)
         file_name = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")+".txt"
 
         for iter in range(variant['max_iters']):
@@ -372,15 +390,16 @@ if __name__ == '__main__':
     # normal for standard setting, delayed for sparse
     parser.add_argument('--mode', type=str, default='normal')
     parser.add_argument('--K', type=int, default=24)
+    parser.add_argument('--seed', type=int, default=None, help='seed of the sampled training windows')
     parser.add_argument('--pct_traj', type=float, default=1.)
     parser.add_argument('--batch_size', type=int, default=128)
     # dt for decision transformer, bc for behavior cloning
     parser.add_argument('--model_type', type=str, default='dt')
-    parser.add_argument('--embed_dim', type=int, default=1024)  # 128
-    parser.add_argument('--n_layer', type=int, default=9)  # 3
-    parser.add_argument('--n_head', type=int, default=8)  # 4
-    parser.add_argument('--activation_function', type=str, default='relu')
-    parser.add_argument('--dropout', type=float, default=0.2)
+    parser.add_argument('--embed_dim', type=int, default=dt_variant['embed_dim'])  # 128
+    parser.add_argument('--n_layer', type=int, default=dt_variant['n_layer'])  # 3
+    parser.add_argument('--n_head', type=int, default=dt_variant['n_head'])  # 4
+    parser.add_argument('--activation_function', type=str, default=dt_variant['activation_function'])
+    parser.add_argument('--dropout', type=float, default=dt_variant['dropout'])
     parser.add_argument('--learning_rate', '-lr', type=float, default=1e-3)
     parser.add_argument('--weight_decay', '-wd', type=float, default=1e-4)
     parser.add_argument('--warmup_steps', type=int, default=10000)
@@ -15,10 +15,13 @@ import torch
 import torch.nn as nn
 from tqdm import tqdm
 import concurrent.futures
+import contextlib
 import time
 
 from decision_transformer.models.decision_transformer import DecisionTransformer
-from evaluate_DT import evaluate_one_episode
+from evaluate_DT import Evaluator
+from random_generator_battery import ESSEnv, BatchESSEnv
+from tools import test_episodes_DT_batch
 
 
 # generate a simple NN with 2 hidden layers s input nodes and a single output node
@@ -46,52 +49,31 @@ DECISION_TRANSFORMER = True
 hidden_dim = 64
 population_size = 100
 epochs = 500
-sigma = 0.3
+sigma = 0.2
 lr = 0.01
-number_of_threads = 2
-
-def evaluator(model,DECISION_TRANSFORMER):
-    result = []
-    gen_samples = []
-
-    sigma = 0.2
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-
-    for param in model.parameters():
-        sample = torch.normal(mean=0, std=torch.ones(
-            param.shape, device=device))
-        param.data = param.data + sigma * sample
-        gen_samples.append(sample)
-
-    # thread = Thread(target=evaluate_one_episode, args=(model, True,))
-    result = evaluate_one_episode(model, None, None,  not DECISION_TRANSFORMER, 100, True)
-
-    return result, gen_samples
-
-
-def ES(num_iterations, population_size, sigma, learning_rate, number_of_threads, DECISION_TRANSFORMER):
-
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    # initialize a list of size population size of NNs with random weights
-    population = []
-
-    best_ratio = 1000000
-    state_dim = 9
-    act_dim = 4
-    K = 24
-    max_ep_len = 24
-    variant = {
-        'embed_dim': 128,
-        'n_layer': 4,
-        'n_head': 4,
-        'activation_function': 'relu',
-        'dropout': 0.1,
-    }
-
+number_of_workers = os.cpu_count()
+eval_times = 100
+noise_table_size = 2 ** 25  # 128 MB of float32 noise shared by all workers
+noise_table_seed = 0
+batch_eval = False  # evaluate the population with torch.func.vmap in this process instead of worker processes
+member_chunk = 10  # members evaluated in one batched rollout, bounds the memory of batch_eval
+
+K = 24
+max_ep_len = 24
+variant = {
+    'embed_dim': 128,
+    'n_layer': 4,
+    'n_head': 4,
+    'activation_function': 'relu',
+    'dropout': 0.1,
+}
+
+
+def build_model(DECISION_TRANSFORMER, device):
     if DECISION_TRANSFORMER:
-        base_model = DecisionTransformer(
+        model = DecisionTransformer(
             state_dim=state_dim,
-            act_dim=act_dim,
+            act_dim=action_dim,
             max_length=K,
             max_ep_len=max_ep_len,
             hidden_size=variant['embed_dim'],
@@ -102,83 +84,173 @@ def ES(num_iterations, population_size, sigma, learning_rate, number_of_threads,
             n_positions=1024,
             resid_pdrop=variant['dropout'],
             attn_pdrop=variant['dropout'],
-        ).to(device)
+        )
     else:
-        base_model = NN(state_dim, hidden_dim, action_dim).to(device)
+        model = NN(state_dim, hidden_dim, action_dim)
+    return model.to(device)
+
+
+class NoiseTable:
+    '''one block of Gaussian noise shared by all processes, a population member is identified by its offset'''
+
+    def __init__(self, size=noise_table_size, seed=noise_table_seed):
+        generator = torch.Generator().manual_seed(seed)
+        self.noise = torch.randn(size, generator=generator).share_memory_()
+
+    def sample_offsets(self, rng, num_params, number):
+        # evenly strided offsets, so the noise of all members is one strided view of the table
+        free = self.noise.numel() - num_params
+        if free < number:
+            raise ValueError('noise table is too small for this model and population')
+        max_stride = free // max(number - 1, 1)
+        stride = int(rng.integers(max(max_stride // 2, 1), max_stride + 1))
+        base = int(rng.integers(free - (number - 1) * stride + 1))
+        return base + stride * np.arange(number), stride
+
+    def get(self, offset, num_params):
+        return self.noise[offset:offset + num_params]  # a view, no copy
+
+    def weighted_sum(self, coefficients, offsets, stride, num_params):
+        '''sum_i coefficients[i] * noise of member i, as matrix-vector products over a strided view'''
+        noise_matrix = self.noise.as_strided((len(offsets), num_params), (stride, 1), int(offsets[0]))
+        result = torch.empty(num_params)
+        # column blocks no wider than the row stride are valid BLAS views, so nothing is copied
+        for start in range(0, num_params, stride):
+            result[start:start + stride] = torch.mv(noise_matrix[:, start:start + stride].t(), coefficients)
+        return result
 
-    denominator = 0
-    for i in range(population_size):
-        denominator += math.log(population_size + 0.5) - math.log(i+1)
 
-    zeros = []
-    for param in base_model.parameters():
-        zeros.append(torch.zeros(param.shape, device=device))
+# state of a persistent ES worker process, filled once by init_worker
+worker = {}
 
-    for i in range(population_size):
 
+def init_worker(base_params, noise_table, DECISION_TRANSFORMER, eval_times):
+    torch.set_num_threads(1)
+    model = build_model(DECISION_TRANSFORMER, 'cpu')
+    model.eval()
+    worker.update(model=model, base_params=base_params, noise_table=noise_table,
+                  evaluate=Evaluator(eval_times, simple_model=not DECISION_TRANSFORMER, device='cpu'))
+
+
+def evaluator(offset, sigma):
+    model = worker['model']
+    base_params = worker['base_params']  # shared memory, updated in place by ES
+    noise = worker['noise_table'].get(offset, base_params.numel())
+    torch.nn.utils.vector_to_parameters(base_params + sigma * noise, model.parameters())
+
+    return worker['evaluate'](model)
+
+
+def evaluate_population(model, member_params, best_solutions, eval_times, DECISION_TRANSFORMER, device):
+    '''cost ratio of every row of member_params (members, num_params), all members run as one batched rollout'''
+    num_members = member_params.shape[0]
+    solutions = best_solutions[:eval_times]
+    month = np.tile([solution['month'] for solution in solutions], num_members)
+    day = np.tile([solution['day'] for solution in solutions], num_members)
+    initial_soc = np.tile([solution['initial_soc'] for solution in solutions], num_members)
+    best_cost = np.array([solution['total_operation_cost'] for solution in solutions])
+
+    # the flat rows as stacked parameters (members, *shape) for torch.func.functional_call
+    params, offset = {}, 0
+    for name, param in model.named_parameters():
+        params[name] = member_params[:, offset:offset + param.numel()].view(num_members, *param.shape)
+        offset += param.numel()
+
+    def member_actions(member, *inputs):
         if DECISION_TRANSFORMER:
-            model = DecisionTransformer(
-                state_dim=state_dim,
-                act_dim=act_dim,
-                max_length=K,
-                max_ep_len=max_ep_len,
-                hidden_size=variant['embed_dim'],
-                n_layer=variant['n_layer'],
-                n_head=variant['n_head'],
-                n_inner=4*variant['embed_dim'],
-                activation_function=variant['activation_function'],
-                n_positions=1024,
-                resid_pdrop=variant['dropout'],
-                attn_pdrop=variant['dropout'],
-            ).to(device)
-        else:            
-            model = NN(state_dim, hidden_dim, action_dim).to(device)
-
-        model.load_state_dict(base_model.state_dict())
-        population.append(model)
-
-    for iter in range(num_iterations):
-        results = []
-        samples = []
-
-        for i in tqdm(range(population_size)):
-            for p in population:
-                p.load_state_dict(base_model.state_dict())
-        start = time.time()
-        with concurrent.futures.ThreadPoolExecutor(max_workers=number_of_threads) as executor:
-            pool = {executor.submit(
-                evaluator, model,DECISION_TRANSFORMER): model for model in population}
-            for thread in concurrent.futures.as_completed(pool):
-                samples.append(thread.result()[1])
-                results.append(thread.result()[0]['ratio'])
-
-        # print(results)
-        if best_ratio > np.min(results):
-            best_ratio = np.min(results)
-            print('saving best model')
-            torch.save(base_model.state_dict(), 'best_model.pt')
-
-        print(
-            f'iter {iter} timer {(time.time()-start):.01f} mean {np.mean(results)}, Max: {np.max(results)}, Min: {np.min(results)} \t best: {best_ratio}')
-
-        results = torch.tensor(results, device=device)
-
-        ranking = torch.argsort(results, descending=True)
-        # print(ranking)
-        weights = [0]*population_size
-        for i in range(population_size):
-            weights[ranking[i]] = ((math.log(population_size + 0.5) -
-                                    math.log(population_size - i)))  # / denominator)
-        # print(weights)
-
-        gradients = [z.detach().clone() for z in zeros]
-        for i in range(population_size):
-            for j in range(len(gradients)):
-                gradients[j] += torch.mul(samples[i][j], weights[i])
-
-        for j, param in enumerate(base_model.parameters()):
-            param.data = param.data + learning_rate * gradients[j]
-
-
-ES(num_iterations=epochs, population_size=population_size,
-   sigma=sigma, learning_rate=lr, number_of_threads=number_of_threads, DECISION_TRANSFORMER=DECISION_TRANSFORMER)
+            states, actions, returns_to_go, timesteps, attention_mask = inputs
+            return torch.func.functional_call(model, member, (states, actions, None, returns_to_go, timesteps),
+                                              {'attention_mask': attention_mask})[1][:, -1]
+        return torch.func.functional_call(model, member, inputs)
+
+    batched_actions = torch.func.vmap(member_actions)
+
+    def get_actions(*inputs):  # (members * scenarios, ...) -> (members, scenarios, ...) and back
+        inputs = [x.reshape(num_members, eval_times, *x.shape[1:]) for x in inputs]
+        return batched_actions(params, *inputs).reshape(num_members * eval_times, -1)
+
+    env = BatchESSEnv(num_members * eval_times)
+    record = test_episodes_DT_batch(env, get_actions, month, day, initial_soc, device, simple_model=not DECISION_TRANSFORMER)
+    ratios = np.abs(record['cost'].sum(axis=1).reshape(num_members, eval_times) / best_cost)
+    return ratios.mean(axis=1)
+
+
+def ES(num_iterations, population_size, sigma, learning_rate, number_of_workers, DECISION_TRANSFORMER):
+
+    # the base model lives on the CPU, its flat parameters are shared with the worker processes
+    base_model = build_model(DECISION_TRANSFORMER, 'cpu')
+    base_params = torch.nn.utils.parameters_to_vector(base_model.parameters()).detach().share_memory_()
+    num_params = base_params.numel()
+
+    best_ratio = 1000000
+
+    # mirrored sampling, every offset is evaluated with +sigma and -sigma
+    half_size = population_size // 2
+    population_size = half_size * 2
+    # rank i (0 is the worst ratio) gets log(P + 0.5) - log(P - i)
+    rank_weights = math.log(population_size + 0.5) - \
+        torch.log(population_size - torch.arange(population_size, dtype=torch.float32))
+    denominator = rank_weights.sum()
+
+    noise_table = NoiseTable()
+    offset_generator = np.random.default_rng()
+    if batch_eval:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        batch_model = build_model(DECISION_TRANSFORMER, device)
+        batch_model.eval()
+        with open('eval_solutions.pkl', 'rb') as f:
+            best_solutions = pickle.load(f)
+        executor = None
+    else:
+        # spawn keeps CUDA and OpenMP state of the parent out of the workers
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=number_of_workers, mp_context=torch.multiprocessing.get_context('spawn'),
+            initializer=init_worker, initargs=(base_params, noise_table, DECISION_TRANSFORMER, eval_times))
+    with executor or contextlib.nullcontext():
+        for iter in range(num_iterations):
+            offsets, stride = noise_table.sample_offsets(offset_generator, num_params, half_size)
+            member_offsets = np.concatenate((offsets, offsets))
+            member_sigmas = [sigma] * half_size + [-sigma] * half_size
+
+            start = time.time()
+            if batch_eval:
+                results = []
+                with torch.no_grad():
+                    for i in range(0, population_size, member_chunk):
+                        member_params = torch.stack([base_params + member_sigma * noise_table.get(offset, num_params)
+                                                     for offset, member_sigma in zip(member_offsets[i:i + member_chunk],
+                                                                                     member_sigmas[i:i + member_chunk])])
+                        results.extend(evaluate_population(batch_model, member_params.to(device), best_solutions,
+                                                           eval_times, DECISION_TRANSFORMER, device))
+            else:
+                results = [result['ratio'] for result in executor.map(evaluator, member_offsets, member_sigmas)]
+
+            # print(results)
+            if best_ratio > np.min(results):
+                best_ratio = np.min(results)
+                print('saving best model')
+                torch.nn.utils.vector_to_parameters(base_params, base_model.parameters())
+                torch.save(base_model.state_dict(), 'best_model.pt')
+
+            print(
+                f'iter {iter} timer {(time.time()-start):.01f} mean {np.mean(results)}, Max: {np.max(results)}, Min: {np.min(results)} \t best: {best_ratio}')
+
+            results = torch.tensor(results)
+
+            ranking = torch.argsort(results, descending=True)
+            # print(ranking)
+            weights = torch.empty(population_size)
+            weights[ranking] = rank_weights  # / denominator
+            # print(weights)
+
+            # +sigma and -sigma members share their noise, so one weighted sum covers both
+            gradient = noise_table.weighted_sum(
+                weights[:half_size] - weights[half_size:], offsets, stride, num_params)
+
+            # update in place, the workers read the new parameters from shared memory
+            base_params += learning_rate * gradient
+
+
+if __name__ == '__main__':
+    ES(num_iterations=epochs, population_size=population_size,
+       sigma=sigma, learning_rate=lr, number_of_workers=number_of_workers, DECISION_TRANSFORMER=DECISION_TRANSFORMER)
@@ -29,5 +29,10 @@ dg_parameters={
 ,'d': 0.03,'e':4.2,'f': 0.031,'power_output_max':500,'power_output_min':100,'heat_output_max':None,'heat_output_min':None,\
     'ramping_up':200,'ramping_down':200,'min_up':2,'min_down':1}}
 
-
-
+# the decision transformer of DT.py, its command line defaults
+dt_variant={
+'embed_dim':1024,
+'n_layer':9,
+'n_head':8,
+'activation_function':'relu',
+'dropout':0.2}
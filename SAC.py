@@ -10,8 +10,10 @@ from torch.nn.modules import loss
 from random_generator_battery import ESSEnv
 import pandas as pd 
 
-from tools import Arguments,get_episode_return,test_one_episode,ReplayBuffer,optimization_base_result
+from tools import Arguments,get_episode_return,test_one_episode,ReplayBuffer,optimization_base_result,get_ess_codecs
 from agent import AgentSAC
+from profiling import profiler
+from scenario_sampler import ScenarioSampler
 from random_generator_battery import ESSEnv
 
 def update_buffer(_trajectory):
@@ -20,7 +22,12 @@ def update_buffer(_trajectory):
     ary_other[:, 0] = ary_other[:, 0]   # ten_reward
     ary_other[:, 1] = (1.0 - ary_other[:, 1]) * gamma  # ten_mask = (1.0 - ary_done) * gamma
 
-    buffer.extend_buffer(ten_state, ary_other)
+    if buffer.if_store_next_state:
+        ten_next_state = torch.as_tensor(
+            np.array([item[2] for item in _trajectory]), dtype=torch.float32)
+        buffer.extend_buffer(ten_state, ary_other, ten_next_state)
+    else:
+        buffer.extend_buffer(ten_state, ary_other)
 
     _steps = ten_state.shape[0]
     _r_exp = ary_other[:, 0].mean()  # other = (reward, mask, action)
@@ -28,23 +35,33 @@ def update_buffer(_trajectory):
 
 if __name__=='__main__':
     args=Arguments()
+    profile_record = []  # profiler.summary() of every episode when args.if_profile
     reward_record={'episode':[],'steps':[],'mean_episode_reward':[],'unbalance':[]}
     loss_record={'episode':[],'steps':[],'critic_loss':[],'actor_loss':[],'entropy_loss':[]}
     args.visible_gpu='0'
+    # args.if_store_next_state=True  # faster sampling, 96 instead of 60 bytes per transition
     for seed in args.random_seed_list:
         args.random_seed = seed
+        # independent random streams of the env, the replay buffer and the exploration noise
+        env_seed, buffer_seed, agent_seed = args.seed_sequences(3)
         args.agent=AgentSAC()
         agent_name=f'{args.agent.__class__.__name__}'
         args.agent.cri_target=True
-        args.env=ESSEnv()
+        args.agent.critic_ensemble_num = args.critic_ensemble_num
+        args.agent.seed = agent_seed
+        args.env=ESSEnv(seed=env_seed, scenario_sampler=ScenarioSampler(seed) if args.if_scenario_sampler else None)
         args.init_before_training(if_main=True)
+        if args.if_profile:
+            profiler.enable(trace_path=f'{args.cwd}/trace.json' if args.if_profile_trace else None)
         '''init agent and environment'''
         agent=args.agent
         env=args.env
         agent.init(args.net_dim,env.state_space.shape[0],env.action_space.shape[0],args.learning_rate,args.if_per_or_gae)
         '''init replay buffer'''
         buffer = ReplayBuffer(max_len=args.max_memo, state_dim=env.state_space.shape[0],
-                              action_dim= env.action_space.shape[0])
+                              action_dim= env.action_space.shape[0],
+                              if_store_next_state=args.if_store_next_state, seed=buffer_seed,
+                              codecs=get_ess_codecs(env.action_space.shape[0], args.gamma) if args.if_compact_buffer else None)
         '''start training'''
         cwd=args.cwd
         gamma=args.gamma
@@ -88,6 +105,9 @@ if __name__=='__main__':
                     reward_record['mean_episode_reward'].append(episode_reward)
                     reward_record['unbalance'].append(episode_unbalance)
                 print(f'curren epsiode is {i_episode}, reward:{episode_reward},unbalance:{episode_unbalance},buffer_length: {buffer.now_len}')
+                if args.if_profile:
+                    profile_record.append(profiler.summary())
+                    print(profiler.format(profile_record[-1]))
                 if i_episode % 10==0:
                 # target_step
                     with torch.no_grad():
@@ -100,6 +120,11 @@ if __name__=='__main__':
         pickle.dump(loss_record,tf)
     with open (reward_record_path,'wb') as tf:
         pickle.dump(reward_record,tf)
+    if args.if_profile:
+        with open(f'{args.cwd}/profile_data.pkl', 'wb') as tf:
+            pickle.dump(profile_record, tf)
+        if args.if_profile_trace:
+            profiler.export_chrome_trace()
 
 
 
@@ -2,11 +2,15 @@ from net import *
 import os
 import numpy.random as rd
 from copy import deepcopy
+from functools import partial
+
+from profiling import profiler
 
 
 class AgentBase:
     def __init__(self):
         self.state = None
+        self.states = None  # the observations of every env of a vector env
         self.device = None
         self.action_dim = None
         self.if_off_policy = None
@@ -16,12 +20,23 @@ class AgentBase:
         self.criterion = torch.nn.SmoothL1Loss()
         self.cri = self.cri_target = self.if_use_cri_target = self.cri_optim = self.ClassCri = None
         self.act = self.act_target = self.if_use_act_target = self.act_optim = self.ClassAct = None
+        self.if_fused_update = True  # flat parameter buffers, soft_update becomes one lerp_ per net
+        self.if_compile = False  # torch.compile the networks in place (torch >= 2.2)
+        self.critic_ensemble_num = 0  # >0: use a CriticEnsemble with this many Q heads (REDQ-style)
+        self.seed = None  # int or np.random.SeedSequence of the exploration noise, None: the global torch generator
+        self.generator = None
 
     def init(self, net_dim, state_dim, action_dim, learning_rate=1e-4, _if_per_or_gae=False, gpu_id=0):
         # explict call self.init() for multiprocessing
         self.device = torch.device(f"cuda:{gpu_id}" if (
             torch.cuda.is_available() and (gpu_id >= 0)) else "cpu")
         self.action_dim = action_dim
+        if self.seed is not None:
+            seed = self.seed if isinstance(self.seed, np.random.SeedSequence) else np.random.SeedSequence(self.seed)
+            self.generator = torch.Generator(device=self.device)
+            self.generator.manual_seed(int(seed.generate_state(1, np.uint64)[0]))
+        if self.critic_ensemble_num and self.ClassCri is not CriticAdv:
+            self.ClassCri = partial(CriticEnsemble, num_heads=self.critic_ensemble_num)
 
         self.cri = self.ClassCri(
             net_dim, state_dim, action_dim).to(self.device)
@@ -32,6 +47,15 @@ class AgentBase:
         self.act_target = deepcopy(
             self.act) if self.if_use_act_target else self.act
 
+        nets = [self.cri, self.act, self.cri_target, self.act_target]
+        nets = [net for i, net in enumerate(nets) if net not in nets[:i]]
+        if self.if_fused_update:
+            for net in nets:
+                flatten_parameters(net)
+        if self.if_compile:
+            for net in nets:
+                net.compile()
+
         self.cri_optim = torch.optim.Adam(self.cri.parameters(), learning_rate)
         self.act_optim = torch.optim.Adam(
             self.act.parameters(), learning_rate) if self.ClassAct else self.cri
@@ -45,7 +69,7 @@ class AgentBase:
         # action = self.act(states)[0]
         # action = (action + torch.randn_like(action) * self.explore_noise).clamp(-1, 1)
         # action = torch.rand(4, dtype=torch.float32, device=self.device)
-        action = torch.FloatTensor(4).uniform_(-1, 1)
+        action = torch.empty(self.action_dim, device=self.device).uniform_(-1, 1, generator=self.generator)
         # print(action)
         return action.detach().cpu().numpy()
 
@@ -54,18 +78,45 @@ class AgentBase:
 
         state = self.state
         for _ in range(target_step):
-            action = self.select_action(state)
+            with profiler.section('actor_forward'):
+                action = self.select_action(state)
             # print(f'Action: {action}')
 
-            state, next_state, reward, done, = env.step(action)
+            with profiler.section('env_step'):
+                state, next_state, reward, done, = env.step(action)
 
             # print(f'State: {state}, reward: {reward}, done: {done}')
 
-            trajectory.append((state, (reward, done, *action)))
+            trajectory.append((state, (reward, done, *action), next_state))
             state = env.reset() if done else next_state
         self.state = state
         return trajectory
 
+    def select_actions(self, states) -> np.ndarray:
+        # one action per env of a vector env, uniform random like select_action
+        actions = torch.empty(len(states), self.action_dim, device=self.device)
+        return actions.uniform_(-1, 1, generator=self.generator).cpu().numpy()
+
+    def explore_vec_env(self, vec_env, target_step):
+        '''target_step steps of every env of a vec_env.AsyncVectorESSEnv, in the trajectory format of explore_env'''
+        trajectory = list()
+
+        states = self.states if self.states is not None else vec_env.reset()[0]
+        for _ in range(target_step):
+            with profiler.section('actor_forward'):
+                actions = self.select_actions(states)
+
+            with profiler.section('env_step'):
+                next_states, rewards, dones, _, infos = vec_env.step(actions)
+
+            # a done env is already reset, its transition ends in the final observation of the episode
+            last_states = np.where(dones[:, None], infos['final_observation'], next_states)
+            for i in range(vec_env.num_envs):
+                trajectory.append((states[i], (rewards[i], dones[i], *actions[i]), last_states[i]))
+            states = next_states
+        self.states = states
+        return trajectory
+
     def explore_env_opt_actions(self, env, target_step, opt_actions, day, month, initial_soc):
 
         trajectory = list()
@@ -78,21 +129,35 @@ class AgentBase:
 
             # print(f'State: {state}, reward: {reward}, done: {done}')
 
-            trajectory.append((state, (reward, done, *action)))
+            trajectory.append((state, (reward, done, *action), next_state))
             state = env.reset() if done else next_state
         self.state = state
         return trajectory
 
-    @staticmethod
-    def optim_update(optimizer, objective):
-        optimizer.zero_grad()
-        objective.backward()
-        optimizer.step()
+    def optim_update(self, optimizer, objective):
+        name = 'critic_update' if optimizer is self.cri_optim else 'actor_update' if optimizer is self.act_optim \
+            else 'alpha_update'
+        with profiler.section(name):
+            optimizer.zero_grad()
+            objective.backward()
+            optimizer.step()
 
     @staticmethod
     def soft_update(target_net, current_net, tau):
-        for tar, cur in zip(target_net.parameters(), current_net.parameters()):
-            tar.data.copy_(cur.data * tau + tar.data * (1.0 - tau))
+        if target_net is current_net:
+            return
+        with profiler.section('soft_update'):
+            if hasattr(target_net, 'flat_params') and hasattr(current_net, 'flat_params'):
+                # tar = tar + tau * (cur - tar) on the flattened parameters
+                target_net.flat_params.lerp_(current_net.flat_params, tau)
+                return
+            tar_list = [tar.data for tar in target_net.parameters()]
+            cur_list = [cur.data for cur in current_net.parameters()]
+            if hasattr(torch, '_foreach_lerp_'):
+                torch._foreach_lerp_(tar_list, cur_list, tau)
+            else:
+                torch._foreach_mul_(tar_list, 1.0 - tau)
+                torch._foreach_add_(tar_list, cur_list, alpha=tau)
 
     def save_or_load_agent(self, cwd, if_save):
         def load_torch_file(model_or_optim, _path):
@@ -143,10 +208,10 @@ class AgentDDPG(AgentBase):
         with torch.no_grad():
             reward, mask, action, state, next_s = buffer.sample_batch(
                 batch_size)
-            next_q = self.cri_target(next_s, self.act_target(next_s))
+            next_q = self.cri_target.get_q_min(next_s, self.act_target(next_s), self.generator)
             q_label = reward + mask * next_q
-        q_value = self.cri(state, action)
-        obj_critic = self.criterion(q_value, q_label)
+        q_values = self.cri.get_q_values(state, action)  # (num_heads, batch_size, 1)
+        obj_critic = self.criterion(q_values, q_label.expand_as(q_values)) * q_values.shape[0]
         return obj_critic, state
 
 
@@ -174,21 +239,19 @@ class AgentTD3(AgentBase):
             if update_c % self.update_freq == 0:  # delay update
                 self.soft_update(self.cri_target, self.cri, soft_update_tau)
                 self.soft_update(self.act_target, self.act, soft_update_tau)
-        return obj_critic.item() / 2, obj_actor.item()
+        return obj_critic.item() / self.cri.num_heads, obj_actor.item()
 
     def get_obj_critic(self, buffer, batch_size) -> (torch.Tensor, torch.Tensor):
         with torch.no_grad():
             reward, mask, action, state, next_s = buffer.sample_batch(
                 batch_size)
             next_a = self.act_target.get_action(
-                next_s, self.policy_noise)  # policy noise
-            next_q = torch.min(
-                *self.cri_target.get_q1_q2(next_s, next_a))  # twin critics
+                next_s, self.policy_noise, self.generator)  # policy noise
+            next_q = self.cri_target.get_q_min(next_s, next_a, self.generator)  # twin critics
             q_label = reward + mask * next_q
 
-        q1, q2 = self.cri.get_q1_q2(state, action)
-        obj_critic = self.criterion(q1, q_label) + \
-            self.criterion(q2, q_label)  # twin critics
+        q_values = self.cri.get_q_values(state, action)  # twin critics, (num_heads, batch_size, 1)
+        obj_critic = self.criterion(q_values, q_label.expand_as(q_values)) * q_values.shape[0]
         return obj_critic, state
 
 
@@ -216,19 +279,25 @@ class AgentSAC(AgentBase):
     def select_action(self, state):
         states = torch.as_tensor(
             (state,), dtype=torch.float32, device=self.device)
-        actions = self.act.get_action(states)
+        actions = self.act.get_action(states, self.generator)
         return actions.detach().cpu().numpy()[0]
 
+    def select_actions(self, states):
+        states = torch.as_tensor(states, dtype=torch.float32, device=self.device)
+        return self.act.get_action(states, self.generator).detach().cpu().numpy()
+
     def explore_env(self, env, target_step):
         trajectory = list()
 
         state = self.state
         for _ in range(target_step):
-            action = self.select_action(state)
+            with profiler.section('actor_forward'):
+                action = self.select_action(state)
 
-            state, next_state, reward, done, = env.step(action)
+            with profiler.section('env_step'):
+                state, next_state, reward, done, = env.step(action)
 
-            trajectory.append((state, (reward, done, *action)))
+            trajectory.append((state, (reward, done, *action), next_state))
             state = env.reset() if done else next_state
         self.state = state
         return trajectory
@@ -244,18 +313,18 @@ class AgentSAC(AgentBase):
                 reward, mask, action, state, next_s = buffer.sample_batch(
                     batch_size)
                 next_a, next_log_prob = self.act_target.get_action_logprob(
-                    next_s)
-                next_q = torch.min(*self.cri_target.get_q1_q2(next_s, next_a))
+                    next_s, self.generator)
+                next_q = self.cri_target.get_q_min(next_s, next_a, self.generator)
                 q_label = reward + mask * (next_q + next_log_prob * alpha)
-            q1, q2 = self.cri.get_q1_q2(state, action)
+            q_values = self.cri.get_q_values(state, action)  # (num_heads, batch_size, 1)
             obj_critic = self.criterion(
-                q1, q_label) + self.criterion(q2, q_label)
+                q_values, q_label.expand_as(q_values)) * q_values.shape[0]
             self.optim_update(self.cri_optim, obj_critic)
             self.soft_update(self.cri_target, self.cri, soft_update_tau)
 
             '''objective of alpha (temperature parameter automatic adjustment)'''
             action_pg, log_prob = self.act.get_action_logprob(
-                state)  # policy gradient
+                state, self.generator)  # policy gradient
             obj_alpha = (self.alpha_log * (log_prob -
                          self.target_entropy).detach()).mean()
             self.optim_update(self.alpha_optim, obj_alpha)
@@ -264,8 +333,8 @@ class AgentSAC(AgentBase):
             alpha = self.alpha_log.exp().detach()
             with torch.no_grad():
                 self.alpha_log[:] = self.alpha_log.clamp(-20, 2)
-            obj_actor = -(torch.min(*self.cri_target.get_q1_q2(state,
-                          action_pg)) + log_prob * alpha).mean()
+            obj_actor = -(self.cri_target.get_q_min(state,
+                          action_pg, self.generator) + log_prob * alpha).mean()
             self.optim_update(self.act_optim, obj_actor)
 
             self.soft_update(self.act_target, self.act, soft_update_tau)
@@ -290,12 +359,13 @@ class AgentPPO(AgentBase):
     def init(self, net_dim, state_dim, action_dim, learning_rate=1e-4, if_use_gae=False, gpu_id=0, env_num=1):
         super().init(net_dim, state_dim, action_dim, learning_rate, if_use_gae, gpu_id)
         self.trajectory_list = list()
+        self.trajectory_lists = None  # the unfinished episode of every env of explore_vec_env
         self.get_reward_sum = self.get_reward_sum_gae if if_use_gae else self.get_reward_sum_raw
 
     def select_action(self, state):
         states = torch.as_tensor(
             (state,), dtype=torch.float32, device=self.device)
-        actions, noises = self.act.get_action(states)
+        actions, noises = self.act.get_action(states, self.generator)
         return actions[0].detach().cpu().numpy(), noises[0].detach().cpu().numpy()
 
     def explore_env(self, env, target_step):
@@ -304,8 +374,10 @@ class AgentPPO(AgentBase):
         trajectory_temp = list()
         last_done = 0
         for i in range(target_step):
-            action, noise = self.select_action(state)
-            next_state, reward, done, _ = env.step(np.tanh(action))
+            with profiler.section('actor_forward'):
+                action, noise = self.select_action(state)
+            with profiler.section('env_step'):
+                state, next_state, reward, done, = env.step(np.tanh(action))
             trajectory_temp.append((state, reward, done, action, noise))
             if done:
                 state = env.reset()
@@ -320,6 +392,44 @@ class AgentPPO(AgentBase):
         self.trajectory_list = trajectory_temp[last_done:]
         return trajectory_list
 
+    def select_actions(self, states):
+        states = torch.as_tensor(states, dtype=torch.float32, device=self.device)
+        actions, noises = self.act.get_action(states, self.generator)
+        return actions.detach().cpu().numpy(), noises.detach().cpu().numpy()
+
+    def explore_vec_env(self, vec_env, target_step):
+        '''target_step steps of every env of a vec_env.AsyncVectorESSEnv, spliced per env like explore_env
+
+        the GAE in update_net needs the steps of one episode in order, so every env keeps its unfinished episode in
+        self.trajectory_lists and only the episodes that ended are returned, env after env
+        '''
+        states = self.states if self.states is not None else vec_env.reset()[0]
+        if self.trajectory_lists is None:
+            self.trajectory_lists = [list() for _ in range(vec_env.num_envs)]
+
+        trajectory_temps = [list() for _ in range(vec_env.num_envs)]
+        last_dones = [-1] * vec_env.num_envs  # -1: no episode of the env ended in these steps
+        for i in range(target_step):
+            with profiler.section('actor_forward'):
+                actions, noises = self.select_actions(states)
+            with profiler.section('env_step'):
+                next_states, rewards, dones, _, _ = vec_env.step(np.tanh(actions))
+            for j in range(vec_env.num_envs):
+                trajectory_temps[j].append((states[j], rewards[j], dones[j], actions[j], noises[j]))
+                if dones[j]:
+                    last_dones[j] = i
+            states = next_states  # a done env is already reset
+        self.states = states
+
+        '''splice list'''
+        trajectory_list = list()
+        for j, last_done in enumerate(last_dones):
+            trajectory_temp = self.trajectory_lists[j] + trajectory_temps[j]
+            cut = len(self.trajectory_lists[j]) + last_done + 1 if last_done >= 0 else 0  # after the last done
+            trajectory_list += trajectory_temp[:cut]
+            self.trajectory_lists[j] = trajectory_temp[cut:]
+        return trajectory_list
+
     def update_net(self, buffer, batch_size, repeat_times, soft_update_tau):
         with torch.no_grad():
             buf_len = buffer[0].shape[0]
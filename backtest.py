@@ -0,0 +1,113 @@
+'''backtest a policy over every day of the year for a grid of battery and DG configurations, as one batched rollout'''
+import copy
+import time
+import argparse
+import itertools
+import torch
+import numpy as np
+import pandas as pd
+
+from Parameters import battery_parameters, dg_parameters
+from random_generator_battery import BatchESSEnv, Constant
+from evaluate_year import ACTORS, load_policy, scenario_grid
+
+
+def parameter_grid(base, values):
+    '''every combination of values, keys are paths into base like 'capacity' or 'gen_1/power_output_max' '''
+    grid = []
+    for combination in itertools.product(*values.values()):
+        parameters = copy.deepcopy(base)
+        for path, value in zip(values, combination):
+            *parents, key = path.split('/')
+            node = parameters
+            for parent in parents:
+                node = node[parent]
+            node[key] = value
+        grid.append(parameters)
+    return grid
+
+
+def actor_policy(model, device):
+    '''an RL actor as a policy callable, (envs, 9) observations -> (envs, 4) actions'''
+    def policy(obs):
+        with torch.no_grad():
+            return model(torch.as_tensor(obs, device=device)).cpu().numpy()
+    return policy
+
+
+def backtest(policy, battery_grid, dg_grid, initial_soc=0.5, if_continuous=False):
+    '''cost, unbalance and shedding of every configuration (battery_grid x dg_grid) and day, arrays (configs, 365)
+
+    unbalance is excess plus shedding, the penalized part beyond the grid exchange, summed like get_episode_return
+
+    by default every day is a separate episode starting at initial_soc like ESSEnv.reset(month, day, initial_soc),
+    with if_continuous each configuration runs the year as one episode with soc and DG outputs carried over
+    '''
+    configs = list(itertools.product(battery_grid, dg_grid))
+    num_configs, num_days = len(configs), sum(Constant.MONTHS_LEN)
+    if if_continuous:
+        env = BatchESSEnv(num_configs, episode_length=num_days * 24, if_continuous=True)
+        month, day = np.ones(num_configs, dtype=int), np.ones(num_configs, dtype=int)
+        env_configs = configs
+    else:  # env i runs day i % 365 of configuration i // 365
+        env = BatchESSEnv(num_configs * num_days)
+        month, day, _ = scenario_grid([initial_soc])
+        month, day = np.tile(month, num_configs), np.tile(day, num_configs)
+        env_configs = [config for config in configs for _ in range(num_days)]
+    env.set_parameters([battery for battery, _ in env_configs], [dgs for _, dgs in env_configs])
+
+    state = env.reset(day=day, month=month, initial_soc=np.full(len(month), initial_soc))
+    costs = np.empty((env.episode_length, env.num_envs))
+    unbalances = np.empty((env.episode_length, env.num_envs))
+    sheddings = np.empty((env.episode_length, env.num_envs))
+    for i in range(env.episode_length):
+        action = np.asarray(policy(state), dtype=np.float32)
+        _, state, _, costs[i], _, _ = env.step(action)
+        # the penalized unbalance beyond the grid exchange, real_unbalance of get_episode_return
+        unbalances[i] = env.real_unbalance
+        sheddings[i] = env.shedding
+    # (hours, envs) -> (configs, days), the hours of a day are consecutive in both layouts
+    per_day = lambda x: x.T.reshape(num_configs, num_days, 24).sum(axis=2)
+    return {'battery_parameters': [battery for battery, _ in configs], 'dg_parameters': [dgs for _, dgs in configs],
+            'cost': per_day(costs), 'unbalance': per_day(unbalances), 'shedding': per_day(sheddings)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', type=str, required=True, help='actor.pth of an RL agent')
+    parser.add_argument('--agent', type=str, default='TD3', choices=list(ACTORS))
+    parser.add_argument('--capacity', type=float, nargs='+', default=[battery_parameters['capacity']])
+    parser.add_argument('--max_charge', type=float, nargs='+', default=[battery_parameters['max_charge']])
+    parser.add_argument('--dg_scale', type=float, nargs='+', default=[1.], help='factors of power_output_max of every DG')
+    parser.add_argument('--initial_soc', type=float, default=0.5)
+    parser.add_argument('--continuous', action='store_true', help='the year as one episode per configuration')
+    parser.add_argument('--output', type=str, default='backtest_results.csv')
+    args = parser.parse_args()
+
+    device = torch.device('cpu')
+    policy = actor_policy(load_policy(args.model, args.agent, device), device)
+    battery_grid = parameter_grid(battery_parameters, {'capacity': args.capacity, 'max_charge': args.max_charge})
+    dg_grid = []
+    for scale in args.dg_scale:  # the same factor for all three DGs
+        dgs = copy.deepcopy(dg_parameters)
+        for dg in dgs.values():
+            dg['power_output_max'] *= scale
+        dg_grid.append(dgs)
+
+    start = time.time()
+    results = backtest(policy, battery_grid, dg_grid, args.initial_soc, args.continuous)
+    num_configs, num_days = results['cost'].shape
+    print(f'{num_configs} configurations x {num_days} days simulated in {time.time() - start:.1f}s')
+
+    month, day, _ = scenario_grid([args.initial_soc])
+    table = pd.DataFrame({
+        'capacity': np.repeat([battery['capacity'] for battery in results['battery_parameters']], num_days),
+        'max_charge': np.repeat([battery['max_charge'] for battery in results['battery_parameters']], num_days),
+        'dg_scale': np.repeat([dgs['gen_1']['power_output_max'] / dg_parameters['gen_1']['power_output_max']
+                               for dgs in results['dg_parameters']], num_days),
+        'month': np.tile(month, num_configs), 'day': np.tile(day, num_configs),
+        'cost': results['cost'].reshape(-1), 'unbalance': results['unbalance'].reshape(-1),
+        'shedding': results['shedding'].reshape(-1)})
+    table.to_csv(args.output, index=False, float_format='%.6g')
+    print(table.groupby(['capacity', 'max_charge', 'dg_scale'])[['cost', 'unbalance', 'shedding']].sum())
+    print(f'saved in {args.output}')
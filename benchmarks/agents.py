@@ -0,0 +1,60 @@
+'''update_net throughput of every agent, run from the repository root: python -m benchmarks.agents'''
+import argparse
+
+import torch
+
+from agent import AgentDDPG, AgentTD3, AgentSAC, AgentPPO
+from tools import Arguments, ReplayBuffer
+from benchmarks.common import set_seed, measure, save_results
+from benchmarks.replay_buffer import fill_buffer
+
+AGENTS = {'DDPG': AgentDDPG, 'TD3': AgentTD3, 'SAC': AgentSAC, 'PPO': AgentPPO}
+
+
+def bench_update_net(agent_name, buffer_len, batch_size, updates, calls, state_dim=9, action_dim=4, gpu_id=0):
+    args = Arguments()
+    agent = AGENTS[agent_name]()
+    agent.init(args.net_dim, state_dim, action_dim, args.learning_rate, args.if_per_or_gae, gpu_id)
+    # update_net runs int(buffer_len / batch_size * repeat_times) updates
+    repeat_times = updates * batch_size / buffer_len
+
+    if agent_name == 'PPO':  # on-policy, update_net consumes the trajectory list of explore_env
+        trajectory = [torch.rand((buffer_len, state_dim)), torch.rand((buffer_len, action_dim)),
+                      torch.randn((buffer_len, action_dim)), torch.rand(buffer_len), torch.full((buffer_len,), args.gamma)]
+        update = lambda: agent.update_net(list(trajectory), batch_size, repeat_times, args.soft_update_tau)
+    else:
+        buffer = ReplayBuffer(max_len=buffer_len, state_dim=state_dim, action_dim=action_dim, gpu_id=gpu_id,
+                              if_store_next_state=args.if_store_next_state)
+        fill_buffer(buffer, buffer_len, state_dim, action_dim)
+        update = lambda: agent.update_net(buffer, batch_size, repeat_times, args.soft_update_tau)
+
+    result = measure(update, calls, warmup=1, device=agent.device)
+    result['updates_per_s'] = result['calls_per_s'] * updates
+    return result
+
+
+def run(agents=tuple(AGENTS), buffer_len=2 ** 16, batch_size=4096, updates=32, calls=5, gpu_id=0, seed=0):
+    results = {}
+    for agent_name in agents:
+        set_seed(seed)
+        results[agent_name] = bench_update_net(agent_name, buffer_len, batch_size, updates, calls, gpu_id=gpu_id)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--agents', type=str, nargs='+', default=list(AGENTS), choices=list(AGENTS))
+    parser.add_argument('--buffer_len', type=int, default=2 ** 16)
+    parser.add_argument('--batch_size', type=int, default=4096)
+    parser.add_argument('--updates', type=int, default=32, help='gradient updates per update_net call')
+    parser.add_argument('--calls', type=int, default=5)
+    parser.add_argument('--gpu_id', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', type=str, default=None, help='append the results to this JSON file')
+    args = parser.parse_args()
+
+    results = run(args.agents, args.buffer_len, args.batch_size, args.updates, args.calls, args.gpu_id, args.seed)
+    for agent_name, result in results.items():
+        print(f"{agent_name}.update_net, batch_size={args.batch_size}: {result['updates_per_s']:.1f} updates/s")
+    if args.json:
+        save_results(args.json, 'agents', results, args)
@@ -0,0 +1,63 @@
+'''seeding, timing and the JSON results format shared by the benchmarks'''
+import os
+import json
+import time
+import random
+import platform
+import subprocess
+
+import numpy as np
+import torch
+
+
+def set_seed(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def synchronize(device):
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize()
+
+
+def measure(fn, iterations, warmup=3, device='cpu'):
+    '''time iterations calls of fn, returns the total time and the latency percentiles of single calls'''
+    for _ in range(warmup):
+        fn()
+    synchronize(device)
+    latencies = np.empty(iterations)
+    start = time.perf_counter()
+    for i in range(iterations):
+        call_start = time.perf_counter()
+        fn()
+        synchronize(device)
+        latencies[i] = time.perf_counter() - call_start
+    total = time.perf_counter() - start
+    return {'iterations': iterations, 'total_s': total, 'calls_per_s': iterations / total,
+            'latency_ms_p50': float(np.percentile(latencies, 50) * 1e3),
+            'latency_ms_p90': float(np.percentile(latencies, 90) * 1e3)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def save_results(path, benchmark, results, args=None):
+    '''append one record to the JSON list in path, so that runs of different commits can be compared'''
+    record = {'benchmark': benchmark, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'git_commit': git_commit(),
+              'python': platform.python_version(), 'torch': torch.__version__, 'numpy': np.__version__,
+              'cpu_count': os.cpu_count(), 'cuda': torch.cuda.get_device_name() if torch.cuda.is_available() else None,
+              'args': {} if args is None else vars(args), 'results': results}
+    records = []
+    if os.path.exists(path):
+        with open(path) as f:
+            records = json.load(f)
+    records.append(record)
+    with open(path, 'w') as f:
+        json.dump(records, f, indent=2)
+    return record
@@ -0,0 +1,85 @@
+'''DT get_batch and train_step throughput and get_action latency, run from the repository root:
+python -m benchmarks.decision_transformer'''
+import argparse
+
+import numpy as np
+import torch
+
+from DT import make_get_batch
+from Parameters import dt_variant as variant
+from decision_transformer.models.decision_transformer import DecisionTransformer
+from decision_transformer.training.seq_trainer import SequenceTrainer
+from net import Actor
+from tools import Arguments
+from benchmarks.common import set_seed, measure, save_results
+
+state_dim = 9
+act_dim = 4
+max_ep_len = 24
+
+
+def random_trajectories(number):
+    # the layout of optimal_trajectories_new.pkl, one day per trajectory
+    return [{'observations': np.random.rand(max_ep_len, state_dim).astype(np.float32),
+             'actions': np.random.rand(max_ep_len, act_dim).astype(np.float32),
+             'rewards': -np.random.rand(max_ep_len).astype(np.float32) * 1000,
+             'dones': np.eye(max_ep_len, dtype=bool)[-1]} for _ in range(number)]
+
+
+def build_dt(K, device):
+    return DecisionTransformer(state_dim=state_dim, act_dim=act_dim, max_length=K, max_ep_len=max_ep_len,
+                               hidden_size=variant['embed_dim'], n_layer=variant['n_layer'], n_head=variant['n_head'],
+                               n_inner=4 * variant['embed_dim'], activation_function=variant['activation_function'],
+                               n_positions=1024, resid_pdrop=variant['dropout'], attn_pdrop=variant['dropout']).to(device)
+
+
+def run(num_trajectories=10000, batch_size=128, K=24, iterations=50, device='cpu', seed=0):
+    set_seed(seed)
+    device = torch.device(device if torch.cuda.is_available() or device == 'cpu' else 'cpu')
+    trajectories = random_trajectories(num_trajectories)
+    states = np.concatenate([path['observations'] for path in trajectories], axis=0)
+    state_mean, state_std = np.mean(states, axis=0), np.std(states, axis=0) + 1e-6
+    get_batch = make_get_batch(trajectories, np.arange(num_trajectories), np.full(num_trajectories, 1 / num_trajectories),
+                               state_mean, state_std, K, max_ep_len, 1., device, state_dim, act_dim, seed)
+
+    model = build_dt(K, device)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4, weight_decay=1e-4)
+    trainer = SequenceTrainer(model=model, optimizer=optimizer, batch_size=batch_size, get_batch=get_batch,
+                              loss_fn=lambda s_hat, a_hat, r_hat, s, a, r: torch.mean((a_hat - a) ** 2))
+    results = {'get_batch': measure(lambda: get_batch(batch_size), iterations, device=device)}
+    model.train()
+    results['train_step'] = measure(trainer.train_step, iterations, device=device)
+    for key in ['get_batch', 'train_step']:
+        results[key]['samples_per_s'] = results[key]['calls_per_s'] * batch_size
+
+    # get_action with a full day of history, the case of the last hour in test_one_episode_DT
+    model.eval()
+    history = (torch.rand((max_ep_len, state_dim), device=device), torch.rand((max_ep_len, act_dim), device=device),
+               torch.zeros(max_ep_len, device=device), torch.rand((1, max_ep_len), device=device),
+               torch.arange(max_ep_len, device=device).reshape(1, -1))
+    with torch.no_grad():
+        results['dt_get_action'] = measure(lambda: model.get_action(*history), iterations * 4, device=device)
+        actor = Actor(Arguments().net_dim, state_dim, act_dim).to(device)
+        state = torch.rand((1, state_dim), device=device)
+        results['actor_get_action'] = measure(lambda: actor(state), iterations * 4, device=device)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_trajectories', type=int, default=10000)
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--K', type=int, default=24)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--device', type=str, default='cuda')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', type=str, default=None, help='append the results to this JSON file')
+    args = parser.parse_args()
+
+    results = run(args.num_trajectories, args.batch_size, args.K, args.iterations, args.device, args.seed)
+    print(f"get_batch: {results['get_batch']['samples_per_s']:.0f} samples/s")
+    print(f"train_step: {results['train_step']['samples_per_s']:.0f} samples/s")
+    for key in ['dt_get_action', 'actor_get_action']:
+        print(f"{key}: p50 {results[key]['latency_ms_p50']:.3f} ms, p90 {results[key]['latency_ms_p90']:.3f} ms")
+    if args.json:
+        save_results(args.json, 'decision_transformer', results, args)
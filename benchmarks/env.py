@@ -0,0 +1,130 @@
+'''ESSEnv startup and step throughput, run from the repository root: python -m benchmarks.env'''
+import argparse
+import time
+
+import numpy as np
+
+from random_generator_battery import ESSEnv, BatchESSEnv, MicrogridEnv, DataManager
+from Parameters import battery_parameters, dg_parameters
+from vec_env import AsyncVectorESSEnv
+from benchmarks.common import set_seed, measure, save_results
+
+
+def bench_load_year_data(iterations):
+    env = ESSEnv()
+
+    def load():
+        env.data_manager = DataManager()
+        env._load_year_data()
+    return measure(load, iterations, warmup=1)
+
+
+def bench_step(steps, if_obs_view=False):
+    env = ESSEnv(if_obs_view=if_obs_view)
+    env.reset()
+    actions = np.random.uniform(-1, 1, (steps, 4)).astype(np.float32)
+    start = time.perf_counter()
+    for i in range(steps):
+        env.step(actions[i])
+    used_time = time.perf_counter() - start
+    return {'steps': steps, 'total_s': used_time, 'steps_per_s': steps / used_time}
+
+
+def bench_microgrid_step(steps, num_batteries, num_dgs):
+    '''MicrogridEnv.step with num_batteries copies of the battery and num_dgs of the three DGs of Parameters.py'''
+    dgs = {f'gen_{i}': dg_parameters[f'gen_{i % 3 + 1}'] for i in range(1, num_dgs + 1)}
+    env = MicrogridEnv(battery_parameters=[battery_parameters] * num_batteries, dg_parameters=dgs)
+    env.reset()
+    actions = np.random.uniform(-1, 1, (steps, num_batteries + num_dgs)).astype(np.float32)
+    start = time.perf_counter()
+    for i in range(steps):
+        env.step(actions[i])
+    used_time = time.perf_counter() - start
+    return {'steps': steps, 'num_batteries': num_batteries, 'num_dgs': num_dgs, 'total_s': used_time,
+            'steps_per_s': steps / used_time}
+
+
+def bench_batch_step(num_envs, episodes):
+    env = BatchESSEnv(num_envs)
+    actions = np.random.uniform(-1, 1, (env.episode_length, num_envs, 4)).astype(np.float32)
+    start = time.perf_counter()
+    for _ in range(episodes):
+        env.reset()
+        for i in range(env.episode_length):
+            env.step(actions[i])
+    used_time = time.perf_counter() - start
+    steps = num_envs * episodes * env.episode_length
+    return {'num_envs': num_envs, 'steps': steps, 'total_s': used_time, 'steps_per_s': steps / used_time}
+
+
+def bench_year(num_envs, hours=8760):
+    '''one continuous rollout from 1.1 over hours steps, for ESSEnv and for num_envs envs of BatchESSEnv'''
+    actions = np.random.uniform(-1, 1, (hours, 4)).astype(np.float32)
+    env = ESSEnv(episode_length=hours, if_continuous=True)
+    env.reset(day=1, month=1, initial_soc=0.5)
+    start = time.perf_counter()
+    for i in range(hours):
+        env.step(actions[i])
+    single_time = time.perf_counter() - start
+
+    env = BatchESSEnv(num_envs, episode_length=hours, if_continuous=True)
+    env.reset(day=np.ones(num_envs, dtype=int), month=np.ones(num_envs, dtype=int), initial_soc=np.full(num_envs, 0.5))
+    batch_actions = np.broadcast_to(actions[:, None], (hours, num_envs, 4))
+    start = time.perf_counter()
+    for i in range(hours):
+        env.step(batch_actions[i])
+    batch_time = time.perf_counter() - start
+    return {'hours': hours, 'single_s': single_time, 'single_steps_per_s': hours / single_time,
+            'num_envs': num_envs, 'batch_s': batch_time, 'batch_steps_per_s': num_envs * hours / batch_time}
+
+
+def bench_vec_env(num_envs, num_workers, steps):
+    '''AsyncVectorESSEnv.step of num_envs envs in num_workers processes, steps are vector steps'''
+    with AsyncVectorESSEnv(num_envs, num_workers, seed=0) as env:
+        env.reset()
+        actions = np.random.uniform(-1, 1, (steps, num_envs, 4)).astype(np.float32)
+        start = time.perf_counter()
+        for i in range(steps):
+            env.step(actions[i])
+        used_time = time.perf_counter() - start
+    return {'num_envs': num_envs, 'num_workers': num_workers, 'steps': num_envs * steps, 'total_s': used_time,
+            'steps_per_s': num_envs * steps / used_time}
+
+
+def run(load_iterations=5, steps=20000, num_envs=1000, episodes=20, seed=0, vec_envs=32, num_workers=4):
+    set_seed(seed)
+    return {'load_year_data': bench_load_year_data(load_iterations),
+            'step': bench_step(steps),
+            'step_view': bench_step(steps, if_obs_view=True),
+            'microgrid_step': bench_microgrid_step(steps, num_batteries=4, num_dgs=20),
+            'batch_step': bench_batch_step(num_envs, episodes),
+            'year': bench_year(num_envs),
+            'vec_env': bench_vec_env(vec_envs, num_workers, steps // vec_envs)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--load_iterations', type=int, default=5)
+    parser.add_argument('--steps', type=int, default=20000)
+    parser.add_argument('--num_envs', type=int, default=1000)
+    parser.add_argument('--episodes', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--vec_envs', type=int, default=32)
+    parser.add_argument('--num_workers', type=int, default=4)
+    parser.add_argument('--json', type=str, default=None, help='append the results to this JSON file')
+    args = parser.parse_args()
+
+    results = run(args.load_iterations, args.steps, args.num_envs, args.episodes, args.seed, args.vec_envs,
+                  args.num_workers)
+    print(f"_load_year_data: {results['load_year_data']['latency_ms_p50']:.1f} ms")
+    print(f"ESSEnv.step: {results['step']['steps_per_s']:.0f} steps/s, "
+          f"with if_obs_view {results['step_view']['steps_per_s']:.0f} steps/s")
+    print(f"MicrogridEnv.step (4 batteries, 20 DGs): {results['microgrid_step']['steps_per_s']:.0f} steps/s")
+    print(f"BatchESSEnv.step ({args.num_envs} envs): {results['batch_step']['steps_per_s']:.0f} env steps/s")
+    print(f"continuous year: ESSEnv {results['year']['single_s']:.2f} s, "
+          f"BatchESSEnv ({args.num_envs} envs) {results['year']['batch_s']:.2f} s, "
+          f"{results['year']['batch_steps_per_s']:.0f} env steps/s")
+    print(f"AsyncVectorESSEnv.step ({args.vec_envs} envs, {args.num_workers} workers): "
+          f"{results['vec_env']['steps_per_s']:.0f} env steps/s")
+    if args.json:
+        save_results(args.json, 'env', results, args)
@@ -0,0 +1,78 @@
+'''single decision CPU latency of the eager policies against their TorchScript, int8 and ONNX exports, run from the
+repository root: python -m benchmarks.export'''
+import os
+import json
+import argparse
+import tempfile
+
+import numpy as np
+import torch
+
+from export_policy import export_policy, example_inputs, exportable
+from evaluate_year import ACTORS, load_policy, load_state_stats
+from tools import Arguments
+from benchmarks.common import set_seed, measure, save_results
+from benchmarks.decision_transformer import build_dt
+
+
+def bench_agent(agent_name, directory, iterations, K=24):
+    # a random policy saved the way the training scripts save it
+    model_path = os.path.join(directory, f'{agent_name}.pt')
+    if agent_name == 'DT':
+        torch.save(build_dt(K, 'cpu'), model_path)
+        np.savez(os.path.join(directory, 'state_stats.npz'), state_mean=np.zeros(9), state_std=np.ones(9))
+    else:
+        torch.save(ACTORS[agent_name](Arguments().net_dim, 9, 4).state_dict(), model_path)
+    output = os.path.join(directory, agent_name)
+    paths = export_policy(model_path, agent_name, output)
+    export_policy(model_path, agent_name, f'{output}_int8', formats=['torchscript'], if_quantize=True)
+
+    state_stats = load_state_stats(model_path, torch.device('cpu')) if agent_name == 'DT' else (None, None)
+    eager = exportable(load_policy(model_path, agent_name, torch.device('cpu')), agent_name, *state_stats)
+    with open(paths['contract']) as f:
+        inputs = example_inputs(json.load(f))
+    policies = {'eager': eager, 'torchscript': torch.jit.load(paths['torchscript']),
+                'torchscript_int8': torch.jit.load(f'{output}_int8.ts')}
+    results = {}
+    with torch.no_grad():
+        expected = eager(*inputs)
+        for key, policy in policies.items():
+            results[key] = measure(lambda: policy(*inputs), iterations)
+            results[key]['max_abs_diff'] = float((policy(*inputs) - expected).abs().max())
+    try:
+        import onnxruntime
+    except ImportError:
+        return results
+    session = onnxruntime.InferenceSession(paths['onnx'], providers=['CPUExecutionProvider'])
+    feed = {node.name: x.numpy() for node, x in zip(session.get_inputs(), inputs)}
+    results['onnxruntime'] = measure(lambda: session.run(None, feed), iterations)
+    results['onnxruntime']['max_abs_diff'] = float(np.abs(session.run(None, feed)[0] - expected.numpy()).max())
+    return results
+
+
+def run(agents=('TD3', 'SAC', 'PPO', 'DT'), iterations=500, num_threads=1, seed=0):
+    set_seed(seed)
+    torch.set_num_threads(num_threads)  # one decision at a time, as in the dispatch loop
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for agent_name in agents:
+            results[agent_name] = bench_agent(agent_name, directory, iterations)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--agents', type=str, nargs='+', default=['TD3', 'SAC', 'PPO', 'DT'], choices=['DT'] + list(ACTORS))
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--num_threads', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', type=str, default=None, help='append the results to this JSON file')
+    args = parser.parse_args()
+
+    results = run(args.agents, args.iterations, args.num_threads, args.seed)
+    for agent_name, agent_results in results.items():
+        for key, result in agent_results.items():
+            print(f"{agent_name} {key}: p50 {result['latency_ms_p50']:.3f} ms, p90 {result['latency_ms_p90']:.3f} ms, "
+                  f"max abs diff {result['max_abs_diff']:.2e}")
+    if args.json:
+        save_results(args.json, 'export', results, args)
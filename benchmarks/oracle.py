@@ -0,0 +1,33 @@
+'''solve latency of the pyomo/gurobi optimum, run from the repository root: python -m benchmarks.oracle'''
+import argparse
+
+import numpy as np
+
+from random_generator_battery import ESSEnv, Constant
+from tools import optimization_base_result
+from benchmarks.common import set_seed, measure, save_results
+
+
+def run(iterations=20, seed=0):
+    set_seed(seed)
+    env = ESSEnv()
+    month = np.random.randint(1, 13, iterations + 1)
+    day = [np.random.randint(1, Constant.MONTHS_LEN[m - 1] - 1) for m in month]
+    initial_soc = np.round(np.random.uniform(0.2, 0.8, iterations + 1), 2)
+    scenarios = iter(zip(month, day, initial_soc))  # a new scenario for every call, one for the warm up
+    return {'optimization_base_result': measure(lambda: optimization_base_result(env, *next(scenarios)),
+                                                iterations, warmup=1)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', type=str, default=None, help='append the results to this JSON file')
+    args = parser.parse_args()
+
+    results = run(args.iterations, args.seed)
+    result = results['optimization_base_result']
+    print(f"optimization_base_result: p50 {result['latency_ms_p50']:.1f} ms, p90 {result['latency_ms_p90']:.1f} ms")
+    if args.json:
+        save_results(args.json, 'oracle', results, args)
@@ -0,0 +1,80 @@
+'''sampling throughput of ReplayBuffer, run from the repository root: python -m benchmarks.replay_buffer'''
+import argparse
+import time
+
+import torch
+
+from tools import ReplayBuffer, get_ess_codecs
+from benchmarks.common import set_seed, save_results
+
+
+def fill_buffer(buffer, max_len, state_dim, action_dim, chunk=24):
+    # write full episodes the same way update_buffer does in DDPG.py / TD3.py / SAC.py
+    for _ in range(0, max_len, chunk):
+        state = torch.rand((chunk, state_dim))
+        next_state = torch.rand((chunk, state_dim))
+        other = torch.rand((chunk, 2 + action_dim))
+        buffer.extend_buffer(state, other, next_state)
+    buffer.update_now_len()
+
+
+def buffer_nbytes(buffer):
+    if buffer.codecs is not None or buffer.if_store_next_state:
+        tensors = [buffer.buf_trans]
+    else:
+        tensors = [buffer.buf_state, buffer.buf_other]
+    return sum(ten.element_size() * ten.nelement() for ten in tensors)
+
+
+def bench_sample_batch(buffer, batch_size, iterations):
+    for _ in range(10):  # warm up
+        buffer.sample_batch(batch_size)
+    if buffer.device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        buffer.sample_batch(batch_size)
+    if buffer.device.type == 'cuda':
+        torch.cuda.synchronize()
+    return time.perf_counter() - start
+
+
+def run(max_memo=500000, batch_size=4096, iterations=1000, state_dim=9, action_dim=4, gpu_id=0, seed=0):
+    layouts = {'legacy': dict(),
+               'next_state': dict(if_store_next_state=True),
+               'compact': dict(codecs=get_ess_codecs(action_dim, 0.995))}
+    results = {}
+    for name, kwargs in layouts.items():
+        if name == 'compact' and state_dim != 9:
+            continue  # the ESSEnv codecs describe the 9-dim state
+        set_seed(seed)
+        buffer = ReplayBuffer(max_len=max_memo, state_dim=state_dim, action_dim=action_dim,
+                              gpu_id=gpu_id, seed=seed, **kwargs)
+        fill_buffer(buffer, max_memo, state_dim, action_dim)
+        used_time = bench_sample_batch(buffer, batch_size, iterations)
+        results[name] = {'bytes_per_transition': buffer_nbytes(buffer) / max_memo,
+                         'batches_per_s': iterations / used_time,
+                         'transitions_per_s': iterations * batch_size / used_time}
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max_memo', type=int, default=500000)
+    parser.add_argument('--batch_size', type=int, default=4096)
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--state_dim', type=int, default=9)
+    parser.add_argument('--action_dim', type=int, default=4)
+    parser.add_argument('--gpu_id', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', type=str, default=None, help='append the results to this JSON file')
+    args = parser.parse_args()
+
+    results = run(args.max_memo, args.batch_size, args.iterations, args.state_dim, args.action_dim, args.gpu_id, args.seed)
+    for name, result in results.items():
+        print(f'{name}, max_memo={args.max_memo}, batch_size={args.batch_size}: '
+              f"{result['bytes_per_transition']:.0f} bytes/transition, "
+              f"{result['batches_per_s']:.1f} batches/s, "
+              f"{result['transitions_per_s'] / 1e6:.2f} M transitions/s")
+    if args.json:
+        save_results(args.json, 'replay_buffer', results, args)
@@ -0,0 +1,27 @@
+'''run every benchmark with its default settings and append one record per benchmark to a JSON file:
+python -m benchmarks.run_all --json benchmarks.json'''
+import argparse
+
+from benchmarks import env, oracle, replay_buffer, agents, decision_transformer, export
+from benchmarks.common import save_results
+
+BENCHMARKS = {'env': env, 'oracle': oracle, 'replay_buffer': replay_buffer,
+              'agents': agents, 'decision_transformer': decision_transformer, 'export': export}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--json', type=str, default='benchmarks.json')
+    parser.add_argument('--skip', type=str, nargs='*', default=[], choices=list(BENCHMARKS),
+                        help='e.g. oracle without a gurobi license')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for name, module in BENCHMARKS.items():
+        if name in args.skip:
+            continue
+        print(f'running {name}')
+        results = module.run(seed=args.seed)
+        save_results(args.json, name, results, args)
+        print(results)
+    print(f'results appended to {args.json}')
@@ -2,12 +2,14 @@ import numpy as np
 import torch
 
 from decision_transformer.training.trainer import Trainer
+from profiling import profiler
 
 
 class ActTrainer(Trainer):
 
     def train_step(self):
-        states, actions, rewards, dones, rtg, _, attention_mask = self.get_batch(self.batch_size)
+        with profiler.section('get_batch'):
+            states, actions, rewards, dones, rtg, _, attention_mask = self.get_batch(self.batch_size)
         state_target, action_target, reward_target = torch.clone(states), torch.clone(actions), torch.clone(rewards)
 
         state_preds, action_preds, reward_preds = self.model.forward(
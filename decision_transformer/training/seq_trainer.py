@@ -3,13 +3,15 @@ import torch
 from icecream import ic
 
 from decision_transformer.training.trainer import Trainer
+from profiling import profiler
 
 
 class SequenceTrainer(Trainer):
 
     def train_step(self):
-        states, actions, rewards, dones, rtg, timesteps, attention_mask = self.get_batch(
-            self.batch_size)
+        with profiler.section('get_batch'):
+            states, actions, rewards, dones, rtg, timesteps, attention_mask = self.get_batch(
+                self.batch_size)
         action_target = torch.clone(actions)
         reward_target = torch.clone(rewards)
 
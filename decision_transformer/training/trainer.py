@@ -6,6 +6,8 @@ from tqdm import tqdm
 
 import time
 
+from profiling import profiler
+
 
 class Trainer:
 
@@ -31,7 +33,8 @@ class Trainer:
 
         self.model.train()
         for _ in tqdm(range(num_steps)):            
-            train_loss = self.train_step()
+            with profiler.section('train_step'):
+                train_loss = self.train_step()
             train_losses.append(train_loss)
             if self.scheduler is not None:
                 self.scheduler.step()
@@ -42,7 +45,8 @@ class Trainer:
 
         self.model.eval()
         
-        outputs = self.eval_fns(self.model,state_mean, state_std)
+        with profiler.section('evaluation'):
+            outputs = self.eval_fns(self.model,state_mean, state_std)
         for k, v in outputs.items():
             logs[f'evaluation/{k}'] = v
         
@@ -55,6 +59,9 @@ class Trainer:
         for k in self.diagnostics:
             logs[k] = self.diagnostics[k]
 
+        if profiler.enabled:  # per-iteration statistics of every timed section
+            logs.update(profiler.summary())
+
         if print_logs:
             print('=' * 80)
             print(f'Iteration {iter_num}')
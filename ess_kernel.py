@@ -0,0 +1,110 @@
+'''the physics and reward of one ESSEnv step as compiled kernels on preallocated arrays
+
+with numba the kernels are compiled with njit, without it the same functions run as plain Python on the arrays.
+Units are arrays, so the kernels serve ESSEnv (one battery, three DGs) and MicrogridEnv (any number of both), and
+batch_step_kernel runs step_kernel for every env of BatchESSEnv.
+battery_params rows: capacity, max_charge, min_soc, max_soc, degradation, one column per battery
+dg_params rows: a, b, c, power_output_max, power_output_min, ramping_up, one column per DG
+grid_params: exchange_ability, penalty_coefficient, sell_coefficient
+hour_data rows: price, netload of every hour of the year
+diagnostics: operation_cost, unbalance, excess, shedding
+'''
+import numpy as np
+
+try:
+    from numba import njit
+    if_numba = True
+except ImportError:
+    if_numba = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+
+@njit(cache=True)
+def step_kernel(action, soc, dg_output, energy_change, battery_params, dg_params, grid_params, hour_data, index,
+                diagnostics):
+    '''updates soc, dg_output, energy_change and diagnostics in place, returns the reward of hour index'''
+    price = hour_data[index, 0]
+    netload = hour_data[index, 1]
+    num_batteries = soc.shape[0]
+    num_dgs = dg_output.shape[0]
+    production = 0.
+    battery_cost = 0.
+    for b in range(num_batteries):  # the same clipping as Battery.step
+        capacity = battery_params[0, b]
+        updated_soc = (soc[b]*capacity+action[b]*battery_params[1, b])/capacity
+        updated_soc = min(max(updated_soc, battery_params[2, b]), battery_params[3, b])
+        # if charge, positive, if discharge, negative
+        energy_change[b] = (updated_soc-soc[b])*capacity
+        soc[b] = updated_soc
+        production -= energy_change[b]
+        battery_cost += energy_change[b]**2*battery_params[4, b]
+    dg_cost = 0.
+    for g in range(num_dgs):  # the same ramping and output limits as DG.step
+        output = dg_output[g]+action[num_batteries+g]*dg_params[5, g]
+        if output > 0:
+            output = min(max(output, dg_params[4, g]), dg_params[3, g])
+            dg_cost += dg_params[0, g]*output**2+dg_params[1, g]*output+dg_params[2, g]
+        else:
+            output = 0.
+        dg_output[g] = output
+        production += output
+
+    unbalance = production-netload
+    exchange_ability, penalty_coefficient, sell_coefficient = grid_params[0], grid_params[1], grid_params[2]
+    exchange = min(abs(unbalance), exchange_ability)
+    excess = 0.
+    shedding = 0.
+    if unbalance >= 0:  # excess is sold to the grid
+        grid_cost = -price*exchange*sell_coefficient
+        excess = unbalance-exchange
+    else:  # deficiency is bought from the grid
+        grid_cost = price*exchange
+        shedding = -unbalance-exchange
+    # beyond exchange_ability the unbalance is penalized
+    operation_cost = battery_cost+dg_cost+grid_cost+(excess+shedding)*penalty_coefficient
+    diagnostics[0] = operation_cost
+    diagnostics[1] = unbalance
+    diagnostics[2] = excess
+    diagnostics[3] = shedding
+    return -operation_cost
+
+
+@njit(cache=True)
+def batch_step_kernel(action, soc, dg_output, energy_change, battery_params, dg_params, grid_params, hour_data, index,
+                      diagnostics, rewards):
+    '''step_kernel for every env, the arrays have one row per env (battery_params and dg_params one matrix per env),
+    index holds the hour of every env, the rewards are written into rewards'''
+    for e in range(action.shape[0]):
+        rewards[e] = step_kernel(action[e], soc[e], dg_output[e], energy_change[e], battery_params[e], dg_params[e],
+                                 grid_params, hour_data, index[e], diagnostics[e])
+
+
+@njit(cache=True)
+def state_kernel(obs, current_time, hour_data, index, soc, dg_output):
+    '''fills the hourly fields of obs: time, price, soc of every battery, netload and output of every DG
+
+    hour_data rows are (price, netload) of every hour of the year, month and day are written by the env only when
+    they change
+    '''
+    num_batteries = soc.shape[0]
+    obs[0] = current_time
+    obs[1] = hour_data[index, 0]
+    for b in range(num_batteries):
+        obs[2+b] = soc[b]
+    obs[2+num_batteries] = hour_data[index, 1]
+    for g in range(dg_output.shape[0]):
+        obs[3+num_batteries+g] = dg_output[g]
+
+
+def battery_param_array(parameters):
+    return np.array([[battery[key] for battery in parameters]
+                     for key in ['capacity', 'max_charge', 'min_soc', 'max_soc', 'degradation']], dtype=float)
+
+
+def dg_param_array(parameters):
+    return np.array([[dg[key] for dg in parameters]
+                     for key in ['a', 'b', 'c', 'power_output_max', 'power_output_min', 'ramping_up']], dtype=float)
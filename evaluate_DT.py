@@ -1,6 +1,8 @@
 import os
 import pickle
 import time
+import concurrent.futures
+import multiprocessing as mp
 import torch
 import torch.nn as nn
 import numpy as np
@@ -11,9 +13,10 @@ import pandas as pd
 from tqdm import tqdm
 import math
 
-from tools import Arguments, test_one_episode_DT, ReplayBuffer, optimization_base_result
+from tools import Arguments, test_one_episode_DT, test_episodes_DT_batch, ReplayBuffer, optimization_base_result
 from agent import AgentDDPG
-from random_generator_battery import ESSEnv
+from random_generator_battery import ESSEnv, BatchESSEnv
+from scenario_sampler import ScenarioSampler
 
 
 def update_buffer(_trajectory):
@@ -31,31 +34,15 @@ def update_buffer(_trajectory):
     return _steps, _r_exp
 
 
-def generate_best_solutions():
-    MONTHS_LEN = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+def generate_solutions(env, solutions_number, progress=True, seed=0, worker_id=0, num_workers=1):
+    '''the first solutions_number scenarios of ScenarioSampler(seed), or the worker_id shard of them, with the cost and
+    unbalance of the pyomo optimum, the format of eval_solutions.pkl'''
+    months, days, initial_socs = ScenarioSampler(seed).scenarios(solutions_number, worker_id, num_workers)
 
     solutions_list = []
-    solutions_number = 10000
-
-    file_name = 'eval_solutions.pkl'
+    for counter in tqdm(range(len(months)), disable=not progress):
 
-    args = Arguments()
-    args.agent = AgentDDPG()
-    args.env = ESSEnv()
-
-    args.init_before_training(if_main=True)
-    '''init agent and environment'''
-    agent = args.agent
-    env = args.env
-    agent.init(
-        args.net_dim, env.state_space.shape[0], env.action_space.shape[0], args.learning_rate, args.if_per_or_gae)
-    agent.state = env.reset()
-
-    for counter in tqdm(range(solutions_number)):
-
-        month = np.random.randint(1, 13)
-        day = np.random.randint(1, MONTHS_LEN[month-1]-1)
-        initial_soc = round(np.random.uniform(0.2, 0.8), 2)
+        month, day, initial_soc = int(months[counter]), int(days[counter]), float(initial_socs[counter])
         # print(f'month:{month}, day:{day}, initial_soc:{initial_soc}')
 
         base_result = optimization_base_result(
@@ -72,6 +59,27 @@ def generate_best_solutions():
                     'total_unbalance': total_unbalance, 'total_operation_cost': total_cost}
         solutions_list.append(solution)
 
+    return solutions_list
+
+
+def solve_shard(solutions_number, seed, worker_id, num_workers):
+    return generate_solutions(ESSEnv(), solutions_number, worker_id == 0, seed, worker_id, num_workers)
+
+
+def generate_best_solutions(solutions_number=10000, seed=0, num_workers=None):
+    '''eval_solutions.pkl, the scenarios are split between num_workers processes without overlap'''
+    file_name = 'eval_solutions.pkl'
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+
+    # spawn, so that no CUDA or OpenMP state is inherited from the parent process
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context('spawn')) as executor:
+        shards = list(executor.map(solve_shard, *zip(*[
+            (solutions_number, seed, worker_id, num_workers) for worker_id in range(num_workers)])))
+    # worker w solved the scenarios w, w + num_workers, ... of the table
+    solutions_list = [None] * solutions_number
+    for worker_id, shard in enumerate(shards):
+        solutions_list[worker_id::num_workers] = shard
+
     f = open(file_name, 'wb')
     pickle.dump(solutions_list, f)
     f.close()
@@ -79,33 +87,85 @@ def generate_best_solutions():
     print(solutions_list)
 
 
-def evaluate_one_episode(model=None, state_mean=None,
-                         state_std=None, simple_model=False, eval_times=100, use_best_solutions=True, results_in = None):
+def ratio_results(ratios_cost, ratios_unbalance):
+    return {"ratio": ratios_cost.mean(), "ratio_cost_std": ratios_cost.std(), "ratio_cost_median": np.median(ratios_cost),
+            "ratio_unbalance": ratios_unbalance.mean(), "ratio_unbalance_std": ratios_unbalance.std(), "ratio_unbalance_median": np.median(ratios_unbalance),
+            "ratio_unbalance_max": ratios_unbalance.max(), "ratio_unbalance_min": ratios_unbalance.min(),
+            "ratio_cost_max": ratios_cost.max(), "ratio_cost_min": ratios_cost.min()}
 
-    ratios_cost = []
-    ratios_unbalance = []
 
-    if use_best_solutions:
+class Evaluator:
+    '''scenarios, env and device are set up once, a call only runs the rollouts of all scenarios as one batch'''
+
+    def __init__(self, eval_times=100, simple_model=False, use_best_solutions=True, best_solutions=None, device=None):
+        if best_solutions is None:
+            if use_best_solutions:
+                with open('eval_solutions.pkl', 'rb') as f:
+                    best_solutions = pickle.load(f)
+            else:  # draw the scenarios once and solve them with pyomo once
+                best_solutions = generate_solutions(ESSEnv(), eval_times, progress=False)
+        scenarios = best_solutions[:eval_times]
+        self.month = np.array([scenario['month'] for scenario in scenarios])
+        self.day = np.array([scenario['day'] for scenario in scenarios])
+        self.initial_soc = np.array([scenario['initial_soc'] for scenario in scenarios])
+        self.best_cost = np.array([scenario['total_operation_cost'] for scenario in scenarios])
+        self.best_unbalance = np.array([scenario['total_unbalance'] for scenario in scenarios])
+
+        self.simple_model = simple_model
+        self.env = BatchESSEnv(len(scenarios))
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu') if device is None else device
+
+    def get_actions(self, model):
+        if self.simple_model:
+            return lambda state: model(state)
+        return lambda states, actions, returns_to_go, timesteps, attention_mask: model(
+            states, actions, None, returns_to_go, timesteps, attention_mask=attention_mask)[1][:, -1]
+
+    def __call__(self, model, state_mean=None, state_std=None):
+        with torch.no_grad():
+            record = test_episodes_DT_batch(self.env, self.get_actions(model), self.month, self.day, self.initial_soc,
+                                            self.device, simple_model=self.simple_model, state_mean=state_mean,
+                                            state_std=state_std)
+        ratios_cost = np.abs(record['cost'].sum(axis=1) / self.best_cost)
+        ratios_unbalance = np.abs(record['unbalance'].sum(axis=1) / self.best_unbalance)
+        return ratio_results(ratios_cost, ratios_unbalance)
+
+
+def evaluate_one_episode(model=None, state_mean=None,
+                         state_std=None, simple_model=False, eval_times=100, use_best_solutions=True, results_in = None,
+                         env=None, best_solutions=None):
+    '''env and best_solutions can be passed in by callers that evaluate many times, e.g. the ES workers'''
+
+    if use_best_solutions and best_solutions is None:
         dataset_path = f'eval_solutions.pkl'
         with open(dataset_path, 'rb') as f:
             best_solutions = pickle.load(f)
 
     args = Arguments()
     agent_name = "DT"
-    args.env = ESSEnv()
+    args.env = ESSEnv() if env is None else env
     args.cwd = agent_name
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    # per step operation cost and unbalance of every scenario, the ratios are computed in one pass at the end
+    costs = np.empty((eval_times, 24))
+    unbalances = np.empty((eval_times, 24))
+    base_costs = np.empty(eval_times)
+    base_unbalances = np.empty(eval_times)
     # for i in tqdm(range(eval_times)):
     for i in range(eval_times):
         # for i in tqdm(range(1000)):
+        if use_best_solutions:
+            month, day, initial_soc = best_solutions[i]['month'], best_solutions[i]['day'], best_solutions[i]['initial_soc']
+        else:
+            month, day, initial_soc = None, None, None  # a random scenario
 
         record = test_one_episode_DT(
-            args.env, device=device, model_init=model, simple_model=simple_model, month=best_solutions[i]['month'], day=best_solutions[i]['day'], initial_soc=best_solutions[i]['initial_soc'], state_mean=state_mean,
+            args.env, device=device, model_init=model, simple_model=simple_model, month=month, day=day, initial_soc=initial_soc, state_mean=state_mean,
             state_std=state_std)
         # exit()
-        eval_data = pd.DataFrame(record['information'])
-        eval_data.columns = ['time_step', 'price', 'netload', 'action', 'real_action',
-                             'soc', 'battery', 'gen1', 'gen2', 'gen3', 'unbalance', 'operation_cost']
+        costs[i] = record['cost']
+        unbalances[i] = record['unbalance']
         '''compare with pyomo data and results'''
         if not use_best_solutions:
             month = record['init_info'][0][0]
@@ -115,36 +175,24 @@ def evaluate_one_episode(model=None, state_mean=None,
             base_result = optimization_base_result(
                 args.env, month, day, initial_soc)
             # print(base_result)
-            ratio = sum(eval_data['operation_cost']) / \
-                sum(base_result['step_cost'])
-            ratio_unbalance = sum(
-                eval_data['unbalance']) / abs(base_result['netload'].sum()-base_result['load'].sum())
+            base_costs[i] = base_result['step_cost'].sum()
+            base_unbalances[i] = abs(base_result['netload'].sum()-base_result['load'].sum())
         else:
-            # print(f"total_operation_cost: {best_solutions[i]['total_operation_cost']} ")
-            # print(f"total_unbalance: {best_solutions[i]['total_unbalance']} ")
-            # print(f"sum(eval_data['operation_cost']): {sum(eval_data['operation_cost'])} ")
-            # print(f"sum(eval_data['unbalance']): {sum(eval_data['unbalance'])} ")
+            base_costs[i] = best_solutions[i]['total_operation_cost']
+            base_unbalances[i] = best_solutions[i]['total_unbalance']
 
-            ratio = abs(sum(eval_data['operation_cost']) /
-                        best_solutions[i]['total_operation_cost'])
-            ratio_unbalance = abs(sum(
-                eval_data['unbalance']) / best_solutions[i]['total_unbalance'])
-
-        ratios_cost.append(ratio)
-        ratios_unbalance.append(ratio_unbalance)
-
-    ratios_cost = np.array(ratios_cost)
-    ratios_unbalance = np.array(ratios_unbalance)
+    ratios_cost = costs.sum(axis=1) / base_costs
+    ratios_unbalance = unbalances.sum(axis=1) / base_unbalances
+    if use_best_solutions:
+        ratios_cost = np.abs(ratios_cost)
+        ratios_unbalance = np.abs(ratios_unbalance)
 
     # print(
     #     f"index: {ratios_cost.argmin()}, max: {ratios_cost.max()}, min: {ratios_cost.min()}")
 
 
-    results = {"ratio": ratios_cost.mean(), "ratio_cost_std": ratios_cost.std(), "ratio_cost_median": np.median(ratios_cost),
-            "ratio_unbalance": ratios_unbalance.mean(), "ratio_unbalance_std": ratios_unbalance.std(), "ratio_unbalance_median": np.median(ratios_unbalance),
-            "ratio_unbalance_max": ratios_unbalance.max(), "ratio_unbalance_min": ratios_unbalance.min(),
-            "ratio_cost_max": ratios_cost.max(), "ratio_cost_min": ratios_cost.min()}
-    
+    results = ratio_results(ratios_cost, ratios_unbalance)
+
     if results_in is not None:
         results_in.append(results['ratio'])
         # print(results_in)
@@ -154,7 +202,8 @@ def evaluate_one_episode(model=None, state_mean=None,
 if __name__ == '__main__':
 
     # generate_best_solutions()
-    results = evaluate_one_episode(eval_times=1000, use_best_solutions=True)
+    evaluator = Evaluator(eval_times=1000, use_best_solutions=True)
+    results = evaluator(torch.load("model_ratio.pt", map_location=evaluator.device))
 
     print(results)
 
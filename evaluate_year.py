@@ -0,0 +1,115 @@
+'''evaluate a trained actor.pth or model_ratio.pt on every day of the year and a grid of initial soc, sharded over processes'''
+import os
+import time
+import argparse
+import concurrent.futures
+import multiprocessing as mp
+import torch
+import numpy as np
+import pandas as pd
+
+from net import Actor, ActorSAC, ActorPPO
+from tools import Arguments, test_episodes_DT_batch, optimization_base_result
+from random_generator_battery import BatchESSEnv, Constant
+from evaluate_DT import ratio_results
+
+ACTORS = {'DDPG': Actor, 'TD3': Actor, 'SAC': ActorSAC, 'PPO': ActorPPO}
+TORCH_VERSION = tuple(int(x) for x in torch.__version__.split('+')[0].split('.')[:2])
+
+
+def scenario_grid(soc_bins):
+    '''every (month, day) of the year times every initial soc'''
+    month = np.repeat(np.arange(1, 13), Constant.MONTHS_LEN)
+    day = np.concatenate([np.arange(1, days + 1) for days in Constant.MONTHS_LEN])
+    return (np.repeat(month, len(soc_bins)), np.repeat(day, len(soc_bins)),
+            np.tile(np.asarray(soc_bins, dtype=float), len(month)))
+
+
+def load_model(model_path, device):
+    '''a whole pickled model, torch 2.6 loads only weights by default and weights_only exists since torch 1.13'''
+    if TORCH_VERSION >= (1, 13):
+        return torch.load(model_path, map_location=device, weights_only=False)
+    return torch.load(model_path, map_location=device)
+
+
+def load_policy(model_path, agent_name, device):
+    if agent_name == 'DT':  # DT.py saves the whole model
+        model = load_model(model_path, device)
+    else:
+        model = ACTORS[agent_name](Arguments().net_dim, 9, 4)
+        model.load_state_dict(torch.load(model_path, map_location=device))
+    return model.to(device).eval()
+
+
+def load_state_stats(model_path, device):
+    '''state_mean and state_std of the DT input normalization, saved by DT.py next to its models'''
+    stats = np.load(os.path.join(os.path.dirname(model_path), 'state_stats.npz'))
+    return (torch.as_tensor(stats['state_mean'], dtype=torch.float32, device=device),
+            torch.as_tensor(stats['state_std'], dtype=torch.float32, device=device))
+
+
+def evaluate_shard(model_path, agent_name, month, day, initial_soc, if_oracle):
+    '''one batched rollout over the scenarios of this shard, then the pyomo optimum of each scenario'''
+    torch.set_num_threads(1)
+    device = torch.device('cpu')
+    model = load_policy(model_path, agent_name, device)
+    env = BatchESSEnv(len(month))
+    state_mean, state_std = None, None
+    if agent_name == 'DT':
+        state_mean, state_std = load_state_stats(model_path, device)
+        get_actions = lambda states, actions, returns_to_go, timesteps, attention_mask: model(
+            states, actions, None, returns_to_go, timesteps, attention_mask=attention_mask)[1][:, -1]
+    else:
+        get_actions = model
+    with torch.no_grad():
+        record = test_episodes_DT_batch(env, get_actions, month, day, initial_soc, device,
+                                        simple_model=agent_name != 'DT', state_mean=state_mean, state_std=state_std)
+
+    base_cost = np.full(len(month), np.nan)
+    base_unbalance = np.full(len(month), np.nan)
+    if if_oracle:
+        for i in range(len(month)):
+            base_result = optimization_base_result(env, month[i], day[i], initial_soc[i])
+            base_cost[i] = base_result['step_cost'].sum()
+            base_unbalance[i] = abs(base_result['load'].sum() - base_result['netload'].sum())
+    return {'month': month, 'day': day, 'initial_soc': initial_soc,
+            'cost': record['cost'].sum(axis=1), 'unbalance': record['unbalance'].sum(axis=1),
+            'base_cost': base_cost, 'base_unbalance': base_unbalance}
+
+
+def evaluate_year(model_path, agent_name, soc_bins, num_workers=None, if_oracle=True):
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+    month, day, initial_soc = scenario_grid(soc_bins)
+    # more shards than workers, so that the slow oracle shards are balanced between the processes
+    shards = np.array_split(np.arange(len(month)), num_workers * 4)
+    shards = [shard for shard in shards if len(shard)]
+
+    # spawn, so that no CUDA or OpenMP state is inherited from the parent process
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context('spawn')) as executor:
+        results = list(executor.map(evaluate_shard, *zip(*[
+            (model_path, agent_name, month[shard], day[shard], initial_soc[shard], if_oracle) for shard in shards])))
+
+    table = pd.DataFrame({key: np.concatenate([result[key] for result in results]) for key in results[0]})
+    if not if_oracle:
+        return table.drop(columns=['base_cost', 'base_unbalance'])
+    table['ratio_cost'] = np.abs(table['cost'] / table['base_cost'])
+    table['ratio_unbalance'] = np.abs(table['unbalance'] / table['base_unbalance'])
+    return table
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', type=str, default='model_ratio.pt', help='actor.pth of an RL agent or model_ratio.pt of DT.py')
+    parser.add_argument('--agent', type=str, default='DT', choices=['DT'] + list(ACTORS))
+    parser.add_argument('--soc_bins', type=float, nargs='+', default=[0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8])
+    parser.add_argument('--num_workers', type=int, default=None)
+    parser.add_argument('--no_oracle', action='store_true', help='skip the pyomo optimum, only costs and unbalances')
+    parser.add_argument('--output', type=str, default='year_results.csv')
+    args = parser.parse_args()
+
+    start = time.time()
+    table = evaluate_year(args.model, args.agent, args.soc_bins, args.num_workers, not args.no_oracle)
+    table.to_csv(args.output, index=False, float_format='%.6g')
+    print(f'{len(table)} scenarios evaluated in {time.time() - start:.1f}s, saved in {args.output}')
+    if not args.no_oracle:
+        print(ratio_results(table['ratio_cost'].to_numpy(), table['ratio_unbalance'].to_numpy()))
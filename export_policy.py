@@ -0,0 +1,130 @@
+'''export a trained actor.pth or model_ratio.pt to TorchScript and ONNX, so that dispatch runs without the training code
+
+The shape contract of the exported graphs, batch is the only dynamic dimension:
+RL actors  state (batch, 9) float32 -> action (batch, 4) float32
+DT         states (batch, K, 9), actions (batch, K, 4), returns_to_go (batch, K, 1) float32,
+           timesteps (batch, K), attention_mask (batch, K) int64 -> action (batch, 4) float32
+DT windows are left padded like DecisionTransformer.get_action and hold raw env states, the state_mean/state_std
+normalization of DT.py is part of the graph. The contract is saved next to the exports as json.
+'''
+import json
+import argparse
+
+import torch
+import torch.nn as nn
+
+from evaluate_year import ACTORS, TORCH_VERSION, load_policy, load_state_stats
+from quantize_DT import conv1d_to_linear
+
+state_dim = 9
+act_dim = 4
+
+
+class DTActionHead(nn.Module):
+    '''DecisionTransformer with raw states in and the action of the latest step out, traceable'''
+
+    def __init__(self, model, state_mean, state_std):
+        super().__init__()
+        self.model = model
+        self.register_buffer('state_mean', state_mean)  # the input normalization of DT.py training
+        self.register_buffer('state_std', state_std)
+
+    def forward(self, states, actions, returns_to_go, timesteps, attention_mask):
+        # the padding in front of the window stays zero, as in DecisionTransformer.get_action
+        states = (states - self.state_mean) / self.state_std * attention_mask[:, :, None]
+        return self.model(states, actions, None, returns_to_go, timesteps, attention_mask=attention_mask)[1][:, -1]
+
+
+def shape_contract(agent_name, max_length=None):
+    if agent_name == 'DT':
+        inputs = {'states': ['batch', max_length, state_dim, 'float32'],
+                  'actions': ['batch', max_length, act_dim, 'float32'],
+                  'returns_to_go': ['batch', max_length, 1, 'float32'],
+                  'timesteps': ['batch', max_length, 'int64'],
+                  'attention_mask': ['batch', max_length, 'int64']}
+    else:
+        inputs = {'state': ['batch', state_dim, 'float32']}
+    contract = {'agent': agent_name, 'inputs': inputs, 'outputs': {'action': ['batch', act_dim, 'float32']}}
+    if agent_name == 'DT':
+        contract['state_normalization'] = 'in graph'  # states are raw env states
+    return contract
+
+
+def example_inputs(contract, batch_size=1):
+    '''zeros in the shapes of the contract, the DT window is fully attended'''
+    inputs = []
+    for name, spec in contract['inputs'].items():
+        shape = [batch_size] + spec[1:-1]
+        if spec[-1] == 'int64':
+            inputs.append(torch.ones(shape, dtype=torch.long) if name == 'attention_mask' else torch.zeros(shape, dtype=torch.long))
+        else:
+            inputs.append(torch.zeros(shape))
+    return tuple(inputs)
+
+
+def exportable(model, agent_name, state_mean=None, state_std=None):
+    '''the deterministic forward of the policy, in eval mode on the CPU, a DT with its state normalization'''
+    model = model.cpu().eval()
+    return DTActionHead(model, state_mean, state_std).eval() if agent_name == 'DT' else model
+
+
+def quantize(model):
+    '''dynamic int8 quantization of the nn.Linear (and GPT2 Conv1D) layers, the activations stay float32'''
+    return torch.ao.quantization.quantize_dynamic(conv1d_to_linear(model), {nn.Linear}, dtype=torch.qint8)
+
+
+def export_torchscript(model, inputs, path):
+    with torch.no_grad():
+        traced = torch.jit.trace(model, inputs)
+    traced = torch.jit.freeze(traced.eval())
+    traced.save(path)
+    return traced
+
+
+def export_onnx(model, inputs, contract, path, opset_version=17):
+    input_names = list(contract['inputs'])
+    dynamic_axes = {name: {0: 'batch'} for name in input_names + ['action']}
+    # the TorchScript based exporter, the dynamo one needs onnxscript, torch before 2.5 has no dynamo argument
+    kwargs = {'dynamo': False} if TORCH_VERSION >= (2, 5) else {}
+    with torch.no_grad():
+        torch.onnx.export(model, inputs, path, input_names=input_names, output_names=['action'],
+                          dynamic_axes=dynamic_axes, opset_version=opset_version, **kwargs)
+    return path
+
+
+def export_policy(model_path, agent_name, output, formats=('torchscript', 'onnx'), if_quantize=False):
+    '''writes output.ts, output.onnx and output.json, returns the paths'''
+    model = load_policy(model_path, agent_name, torch.device('cpu'))
+    contract = shape_contract(agent_name, getattr(model, 'max_length', None))
+    state_stats = load_state_stats(model_path, torch.device('cpu')) if agent_name == 'DT' else (None, None)
+    model = exportable(model, agent_name, *state_stats)
+    inputs = example_inputs(contract)
+    contract['quantized'] = False
+    paths = {}
+    if 'onnx' in formats:  # quantized Linear layers have no ONNX export, so ONNX gets the float model
+        paths['onnx'] = export_onnx(model, inputs, contract, f'{output}.onnx')
+    if if_quantize:
+        model = quantize(model)
+        contract['quantized'] = True
+    if 'torchscript' in formats:
+        export_torchscript(model, inputs, f'{output}.ts')
+        paths['torchscript'] = f'{output}.ts'
+    paths['contract'] = f'{output}.json'
+    with open(paths['contract'], 'w') as f:
+        json.dump(contract, f, indent=2)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', type=str, default='model_ratio.pt', help='actor.pth of an RL agent or model_ratio.pt of DT.py')
+    parser.add_argument('--agent', type=str, default='DT', choices=['DT'] + list(ACTORS))
+    parser.add_argument('--output', type=str, default=None, help='path without extension, the model path by default')
+    parser.add_argument('--formats', type=str, nargs='+', default=['torchscript', 'onnx'], choices=['torchscript', 'onnx'])
+    parser.add_argument('--quantize', action='store_true', help='dynamic int8 nn.Linear layers in the TorchScript export')
+    args = parser.parse_args()
+
+    output = args.output or args.model.rsplit('.', 1)[0]
+    paths = export_policy(args.model, args.agent, output, args.formats, args.quantize)
+    for key, path in paths.items():
+        print(f'{key}: {path}')
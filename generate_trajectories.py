@@ -5,6 +5,7 @@ import numpy as np
 import numpy.random as rd
 from torch.nn.modules import loss
 from random_generator_battery import ESSEnv
+from scenario_sampler import ScenarioSampler
 from tqdm import tqdm
 
 from tools import Arguments, optimization_base_result
@@ -36,15 +37,14 @@ env = args.env
 agent.init(
     args.net_dim, env.state_space.shape[0], env.action_space.shape[0], args.learning_rate, args.if_per_or_gae)
 agent.state = env.reset()
+scenarios = ScenarioSampler(args.random_seed)
 
 for counter in tqdm(range(trajectories_number)):    
     with torch.no_grad():
         if generate_optimal_trajectories:
 
-            month = np.random.randint(1, 13)  # here we choose 12 month
-            day = np.random.randint(1, MONTHS_LEN[month-1]-1)
-
-            initial_soc = round(np.random.uniform(0.2, 0.8), 2)
+            # the scenario table of eval_solutions.pkl, every day and soc bin before any repeat
+            month, day, initial_soc = next(scenarios)
             # print(f'month:{month}, day:{day}, initial_soc:{initial_soc}')
 
             # print(initial_soc)
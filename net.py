@@ -3,6 +3,17 @@ import torch.nn as nn
 import numpy as np 
 
 
+def flatten_parameters(net):
+    '''make all parameters of net views into one flat tensor, so that soft update is a single lerp_'''
+    params = list(net.parameters())
+    flat = torch.cat([param.data.reshape(-1) for param in params])
+    offset = 0
+    for param in params:
+        param.data = flat[offset:offset + param.numel()].view_as(param)
+        offset += param.numel()
+    net.flat_params = flat
+    return flat
+
 
 class Actor(nn.Module):
     def __init__(self, mid_dim, state_dim, action_dim):
@@ -15,9 +26,9 @@ class Actor(nn.Module):
     def forward(self, state):
         return self.net(state).tanh()  # action.tanh()
 
-    def get_action(self, state, action_std):
+    def get_action(self, state, action_std, generator=None):
         action = self.net(state).tanh()
-        noise = (torch.randn_like(action) * action_std).clamp(-0.5, 0.5)
+        noise = (torch.randn(action.shape, generator=generator, device=action.device) * action_std).clamp(-0.5, 0.5)
         return (action + noise).clamp(-1.0, 1.0)
 
 
@@ -36,19 +47,19 @@ class ActorSAC(nn.Module):
         tmp = self.net_state(state)
         return self.net_a_avg(tmp).tanh()  # action
 
-    def get_action(self, state):
+    def get_action(self, state, generator=None):
         t_tmp = self.net_state(state)
         a_avg = self.net_a_avg(t_tmp)  # NOTICE! it is a_avg without .tanh()
         a_std = self.net_a_std(t_tmp).clamp(-20, 2).exp()
-        return torch.normal(a_avg, a_std).tanh()  # re-parameterize
+        return torch.normal(a_avg, a_std, generator=generator).tanh()  # re-parameterize
 
-    def get_action_logprob(self, state):
+    def get_action_logprob(self, state, generator=None):
         t_tmp = self.net_state(state)
         a_avg = self.net_a_avg(t_tmp)  # NOTICE! it needs a_avg.tanh()
         a_std_log = self.net_a_std(t_tmp).clamp(-20, 2)
         a_std = a_std_log.exp()
 
-        noise = torch.randn_like(a_avg, requires_grad=True)
+        noise = torch.randn(a_avg.shape, generator=generator, device=a_avg.device, requires_grad=True)
         a_tan = (a_avg + a_std * noise).tanh()  # action.tanh()
 
         log_prob = a_std_log + self.log_sqrt_2pi + noise.pow(2).__mul__(0.5)  # noise.pow(2) * 0.5
@@ -71,13 +82,13 @@ class ActorPPO(nn.Module):
     def forward(self, state):
         return self.net(state).tanh()  # action.tanh()# in this way limit the data output of action
 
-    def get_action(self, state):
+    def get_action(self, state, generator=None):
         #mean
         a_avg = self.net(state)
         #standard deviation 
         a_std = self.a_std_log.exp()
 
-        noise = torch.randn_like(a_avg)
+        noise = torch.randn(a_avg.shape, generator=generator, device=a_avg.device)
         action = a_avg + noise * a_std
         return action, noise
 
@@ -103,10 +114,17 @@ class Critic(nn.Module):
                                  nn.Linear(mid_dim, mid_dim), nn.ReLU(),
                                  nn.Linear(mid_dim, mid_dim), nn.Hardswish(),
                                  nn.Linear(mid_dim, 1))
+        self.num_heads = 1
 
     def forward(self, state, action):
         return self.net(torch.cat((state, action), dim=1))  # q value
 
+    def get_q_values(self, state, action):
+        return self.forward(state, action)[None]  # (1, batch_size, 1)
+
+    def get_q_min(self, state, action, generator=None):
+        return self.forward(state, action)
+
 
 class CriticAdv(nn.Module):
     def __init__(self, mid_dim, state_dim, _action_dim):
@@ -129,6 +147,7 @@ class CriticTwin(nn.Module):  # shared parameter
                                     nn.Linear(mid_dim, 1))  # q1 value
         self.net_q2 = nn.Sequential(nn.Linear(mid_dim, mid_dim), nn.Hardswish(),
                                     nn.Linear(mid_dim, 1))  # q2 value
+        self.num_heads = 2
 
     def forward(self, state, action):
         tmp = self.net_sa(torch.cat((state, action), dim=1))
@@ -137,3 +156,48 @@ class CriticTwin(nn.Module):  # shared parameter
     def get_q1_q2(self, state, action):
         tmp = self.net_sa(torch.cat((state, action), dim=1))
         return self.net_q1(tmp), self.net_q2(tmp)  # two Q values
+
+    def get_q_values(self, state, action):
+        return torch.stack(self.get_q1_q2(state, action))  # (2, batch_size, 1)
+
+    def get_q_min(self, state, action, generator=None):
+        return torch.min(*self.get_q1_q2(state, action))
+
+
+class CriticEnsemble(nn.Module):  # shared parameter, num_heads Q heads evaluated in one batched matmul
+    def __init__(self, mid_dim, state_dim, action_dim, num_heads=2, num_min=2):
+        super().__init__()
+        self.num_heads = num_heads
+        self.num_min = min(num_min, num_heads)  # size of the random subset used by get_q_min (REDQ)
+        self.net_sa = nn.Sequential(nn.Linear(state_dim + action_dim, mid_dim), nn.ReLU(),
+                                    nn.Linear(mid_dim, mid_dim), nn.ReLU())  # concat(state, action)
+        heads = [nn.Sequential(nn.Linear(mid_dim, mid_dim), nn.Hardswish(),
+                               nn.Linear(mid_dim, 1)) for _ in range(num_heads)]
+        # the same heads as CriticTwin, weights stacked as (num_heads, in_dim, out_dim) for torch.baddbmm
+        self.head_w1 = nn.Parameter(torch.stack([head[0].weight.data.t() for head in heads]))
+        self.head_b1 = nn.Parameter(torch.stack([head[0].bias.data[None] for head in heads]))
+        self.head_w2 = nn.Parameter(torch.stack([head[2].weight.data.t() for head in heads]))
+        self.head_b2 = nn.Parameter(torch.stack([head[2].bias.data[None] for head in heads]))
+
+    def forward(self, state, action):
+        return self.get_q_values(state, action).mean(dim=0)  # average Q value
+
+    def get_q_values(self, state, action, heads=None):
+        tmp = self.net_sa(torch.cat((state, action), dim=1))
+        w1, b1, w2, b2 = self.head_w1, self.head_b1, self.head_w2, self.head_b2
+        if heads is not None:
+            w1, b1, w2, b2 = w1[heads], b1[heads], w2[heads], b2[heads]
+        tmp = tmp.expand(w1.shape[0], *tmp.shape)
+        tmp = nn.functional.hardswish(torch.baddbmm(b1, tmp, w1))
+        return torch.baddbmm(b2, tmp, w2)  # (num_heads, batch_size, 1)
+
+    def get_q1_q2(self, state, action):
+        q_values = self.get_q_values(state, action, heads=torch.arange(2, device=state.device))
+        return q_values[0], q_values[1]
+
+    def get_q_min(self, state, action, generator=None):
+        '''the minimum over a random subset of num_min heads, drawn with the generator of the agent'''
+        if self.num_min == self.num_heads:
+            return self.get_q_values(state, action).min(dim=0)[0]
+        heads = torch.randperm(self.num_heads, generator=generator, device=state.device)[:self.num_min]
+        return self.get_q_values(state, action, heads=heads).min(dim=0)[0]
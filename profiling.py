@@ -0,0 +1,102 @@
+'''opt-in timers and counters for the hot paths of training and evaluation, off by default'''
+import os
+import json
+import time
+import threading
+import contextlib
+from collections import defaultdict
+
+import numpy as np
+import torch
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.trace_path = None  # Chrome trace (chrome://tracing, perfetto) of all sections
+        self.sync_cuda = False  # synchronize before a section ends, so that GPU time is attributed to it
+        self.if_record_function = False  # also mark the sections in a running torch.profiler trace
+        self.times = defaultdict(list)
+        self.counters = defaultdict(int)
+        self.events = []
+
+    def enable(self, trace_path=None, sync_cuda=False):
+        self.enabled = True
+        self.trace_path = trace_path
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+
+    def disable(self):
+        self.enabled = False
+
+    @contextlib.contextmanager
+    def _timed_section(self, name):
+        marker = torch.profiler.record_function(name) if self.if_record_function else contextlib.nullcontext()
+        start = time.perf_counter()
+        with marker:
+            try:
+                yield
+            finally:
+                if self.sync_cuda:
+                    torch.cuda.synchronize()
+                end = time.perf_counter()
+                self.times[name].append(end - start)
+                if self.trace_path is not None:
+                    self.events.append({'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': (end - start) * 1e6,
+                                        'pid': os.getpid(), 'tid': threading.get_ident()})
+
+    def section(self, name):
+        '''time the with block under name, a no-op when the profiler is disabled'''
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timed_section(name)
+
+    def count(self, name, number=1):
+        if self.enabled:
+            self.counters[name] += number
+
+    def summary(self, prefix='profile/', reset=True):
+        '''count, total and latency percentiles (ms) of every section since the last summary, flat for a logs dict'''
+        logs = {}
+        for name, times in self.times.items():
+            times = np.array(times) * 1e3
+            logs[f'{prefix}{name}/count'] = len(times)
+            logs[f'{prefix}{name}/total_ms'] = float(times.sum())
+            logs[f'{prefix}{name}/mean_ms'] = float(times.mean())
+            for q, value in zip([50, 90, 99], np.percentile(times, [50, 90, 99])):
+                logs[f'{prefix}{name}/p{q}_ms'] = float(value)
+            logs[f'{prefix}{name}/max_ms'] = float(times.max())
+        for name, number in self.counters.items():
+            logs[f'{prefix}{name}/count'] = number
+        if reset:
+            self.times.clear()
+            self.counters.clear()
+        return logs
+
+    @staticmethod
+    def format(summary, prefix='profile/'):
+        '''one console line with the total time of every section in a summary'''
+        totals = {key[len(prefix):-len('/total_ms')]: value for key, value in summary.items() if key.endswith('/total_ms')}
+        return ', '.join(f'{name}: {total:.1f}ms' for name, total in sorted(totals.items(), key=lambda item: -item[1]))
+
+    def export_chrome_trace(self, path=None):
+        path = self.trace_path if path is None else path
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+        return path
+
+    @contextlib.contextmanager
+    def torch_trace(self, path, **kwargs):
+        '''run the with block under torch.profiler, with the sections marked, and save its Chrome trace to path'''
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.if_record_function = True
+        try:
+            with torch.profiler.profile(activities=activities, **kwargs) as prof:
+                yield prof
+        finally:
+            self.if_record_function = False
+        prof.export_chrome_trace(path)
+
+
+profiler = Profiler()  # the instance shared by agent.py, tools.py and the trainers
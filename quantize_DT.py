@@ -0,0 +1,136 @@
+'''post-training dynamic int8 quantization of a trained DecisionTransformer for CPU inference
+
+the GPT2 Conv1D layers become nn.Linear, a calibration run over eval_solutions.pkl scenarios records the inputs of
+every Linear layer and the layers whose int8 output error on them is above tolerance stay float32
+'''
+import io
+import os
+import copy
+import shutil
+import time
+import pickle
+import argparse
+
+import torch
+import torch.nn as nn
+from transformers.modeling_utils import Conv1D
+
+from evaluate_DT import Evaluator
+from evaluate_year import load_model, load_state_stats
+from benchmarks.common import measure
+
+
+def conv1d_to_linear(model):
+    '''replace the GPT2 Conv1D (x @ weight + bias) layers with the equivalent nn.Linear, in place'''
+    for name, module in list(model.named_modules()):
+        for child_name, child in list(module.named_children()):
+            if isinstance(child, Conv1D):
+                linear = nn.Linear(child.weight.shape[0], child.nf)
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data
+                setattr(module, child_name, linear)
+    return model
+
+
+def calibrate(model, evaluator, state_mean=None, state_std=None, max_rows=4096):
+    '''run the calibration scenarios and keep up to max_rows inputs of every Linear layer'''
+    activations = {}
+
+    def record(name):
+        def hook(module, inputs, output):
+            x = inputs[0].detach().reshape(-1, inputs[0].shape[-1])
+            activations[name] = torch.cat([activations[name], x])[:max_rows] if name in activations else x[:max_rows]
+        return hook
+
+    handles = [module.register_forward_hook(record(name)) for name, module in model.named_modules()
+               if isinstance(module, nn.Linear)]
+    try:
+        results = evaluator(model, state_mean, state_std)
+    finally:
+        for handle in handles:
+            handle.remove()
+    return activations, results
+
+
+def layer_errors(model, activations):
+    '''relative error of the int8 output of every Linear layer on its calibration inputs'''
+    errors = {}
+    modules = dict(model.named_modules())
+    with torch.no_grad():
+        for name, x in activations.items():
+            layer = modules[name]
+            quantized = torch.ao.quantization.quantize_dynamic(nn.Sequential(copy.deepcopy(layer)), {nn.Linear}, dtype=torch.qint8)
+            expected = layer(x)
+            errors[name] = float((quantized(x) - expected).norm() / (expected.norm() + 1e-12))
+    return errors
+
+
+def quantize_dt(model, activations=None, tolerance=0.05):
+    '''a quantized copy of model, without calibration inputs every Linear and Conv1D layer is quantized'''
+    model = conv1d_to_linear(copy.deepcopy(model).cpu().eval())
+    layers = {name for name, module in model.named_modules() if isinstance(module, nn.Linear)}
+    if activations is not None:
+        errors = layer_errors(model, activations)
+        layers = {name for name in layers if errors.get(name, 0.) <= tolerance}
+    return torch.ao.quantization.quantize_dynamic(model, layers, dtype=torch.qint8)
+
+
+def model_size(model):
+    '''bytes of the saved state_dict'''
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+
+def decision_latency(model, iterations=200):
+    '''single decision latency with a full day of history, as in the last hour of test_one_episode_DT'''
+    K = model.max_length
+    inputs = (torch.rand((1, K, model.state_dim)), torch.rand((1, K, model.act_dim)), None,
+              torch.rand((1, K, 1)), torch.arange(K).reshape(1, -1))
+    with torch.no_grad():
+        return measure(lambda: model(*inputs, attention_mask=torch.ones((1, K), dtype=torch.long)), iterations)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', type=str, default='model_ratio.pt')
+    parser.add_argument('--output', type=str, default='model_ratio_int8.pt')
+    parser.add_argument('--eval_times', type=int, default=100, help='scenarios of the fp32 vs int8 comparison')
+    parser.add_argument('--calibration_times', type=int, default=100, help='scenarios after the evaluation ones')
+    parser.add_argument('--tolerance', type=float, default=0.05, help='largest relative output error of an int8 layer')
+    parser.add_argument('--num_threads', type=int, default=1)
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.num_threads)
+    device = torch.device('cpu')  # quantized Linear layers only run on the CPU
+    model = load_model(args.model, device).eval()
+    state_mean, state_std = load_state_stats(args.model, device)  # the input normalization of DT.py training
+    with open('eval_solutions.pkl', 'rb') as f:
+        best_solutions = pickle.load(f)
+    # separate scenarios, so that the reported degradation is not measured on the calibration data
+    calibration = Evaluator(args.calibration_times, best_solutions=best_solutions[args.eval_times:], device=device)
+    evaluator = Evaluator(args.eval_times, best_solutions=best_solutions, device=device)
+
+    start = time.time()
+    activations, _ = calibrate(conv1d_to_linear(copy.deepcopy(model)), calibration, state_mean, state_std)
+    quantized = quantize_dt(model, activations, args.tolerance)
+    num_layers = len(activations)
+    num_quantized = sum(isinstance(module, torch.ao.nn.quantized.dynamic.Linear) for module in quantized.modules())
+    print(f'{num_quantized}/{num_layers} Linear layers quantized in {time.time() - start:.1f}s')
+
+    ratios = {}
+    for key, policy in [('fp32', model), ('int8', quantized)]:
+        results = evaluator(policy, state_mean, state_std)
+        latency = decision_latency(policy)
+        ratios[key] = results['ratio']
+        print(f"{key}: ratio {results['ratio']:.4f} (median {results['ratio_cost_median']:.4f}), "
+              f"ratio_unbalance {results['ratio_unbalance']:.4f}, size {model_size(policy) / 2 ** 20:.1f} MB, "
+              f"latency p50 {latency['latency_ms_p50']:.2f} ms")
+    print(f"cost ratio degradation: {ratios['int8'] - ratios['fp32']:+.4f} ({(ratios['int8'] / ratios['fp32'] - 1) * 100:+.2f}%)")
+    torch.save(quantized, args.output)
+    # the quantized model needs the same state normalization wherever it is loaded
+    stats_path, output_stats_path = [os.path.join(os.path.dirname(path), 'state_stats.npz')
+                                     for path in (args.model, args.output)]
+    if os.path.abspath(stats_path) != os.path.abspath(output_stats_path):
+        shutil.copyfile(stats_path, output_stats_path)
+    print(f'saved in {args.output}')
@@ -6,10 +6,12 @@ import gym
 from gym import spaces
 
 from Parameters import battery_parameters, dg_parameters
+from ess_kernel import step_kernel, batch_step_kernel, state_kernel, battery_param_array, dg_param_array
 
 
 class Constant:
     MONTHS_LEN = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+    MONTHS_START = [0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334]  # day of the year each month starts at
     MAX_STEP_HOURS = 24 * 30
 
 
@@ -111,11 +113,12 @@ class Battery():
     def SOC(self):
         return self.current_capacity
 
-    def reset(self, initial_capacity=None):
-        if initial_capacity:
+    def reset(self, initial_capacity=None, rng=None):
+        '''rng is the np.random.Generator of the env, the global np.random stream without one'''
+        if initial_capacity is not None:
             self.current_capacity = initial_capacity
         else:
-            self.current_capacity = np.random.uniform(0.2, 0.8)
+            self.current_capacity = (np.random if rng is None else rng).uniform(0.2, 0.8)
 
 
 class Grid():
@@ -144,6 +147,59 @@ class Grid():
         return result
 
 
+class DGArray():
+    '''any number of diesel generators as arrays with one entry per generator, the same model as DG'''
+
+    def __init__(self, parameters):
+        self.name = [dg.keys() for dg in parameters]
+        self.a_factor, self.b_factor, self.c_factor, self.power_output_max, self.power_output_min, \
+            self.ramping_up, self.ramping_down = (np.array([dg[key] for dg in parameters], dtype=float) for key in [
+                'a', 'b', 'c', 'power_output_max', 'power_output_min', 'ramping_up', 'ramping_down'])
+        self.current_output = np.zeros(len(parameters))
+
+    def step(self, action_gen):
+        output = self.current_output+action_gen*self.ramping_up
+        self.current_output[:] = np.where(output > 0, np.clip(
+            output, self.power_output_min, self.power_output_max), 0)
+
+    def _get_cost(self, output):
+        return np.where(output > 0, self.a_factor*output**2+self.b_factor*output+self.c_factor, 0)
+
+    def reset(self):
+        self.current_output[:] = 0
+
+
+class BatteryArray():
+    '''any number of batteries as arrays with one entry per battery, the same model as Battery'''
+
+    def __init__(self, parameters):
+        self.capacity, self.max_soc, self.initial_capacity, self.min_soc, self.degradation, self.max_charge, \
+            self.max_discharge, self.efficiency = (np.array([battery[key] for battery in parameters], dtype=float) for key in [
+                'capacity', 'max_soc', 'initial_capacity', 'min_soc', 'degradation', 'max_charge', 'max_discharge', 'efficiency'])
+        self.current_capacity = np.zeros(len(parameters))
+        self.energy_change = np.zeros(len(parameters))
+
+    def step(self, action_battery):
+        energy = action_battery*self.max_charge
+        updated_capacity = np.clip((self.current_capacity*self.capacity+energy)/self.capacity, self.min_soc, self.max_soc)
+        # if charge, positive, if discharge, negative, both arrays are updated in place
+        self.energy_change[:] = (updated_capacity-self.current_capacity)*self.capacity
+        self.current_capacity[:] = updated_capacity
+
+    def _get_cost(self, energy):
+        return energy**2*self.degradation
+
+    def SOC(self):
+        return self.current_capacity
+
+    def reset(self, initial_capacity=None, rng=None):
+        if initial_capacity is None:
+            self.current_capacity[:] = (np.random if rng is None else rng).uniform(0.2, 0.8, len(self.capacity))
+        else:
+            self.current_capacity[:] = initial_capacity
+        self.energy_change[:] = 0
+
+
 class ESSEnv(gym.Env):
     def __init__(self, **kwargs):
         super(ESSEnv, self).__init__()
@@ -151,6 +207,14 @@ class ESSEnv(gym.Env):
         self.data_manager = DataManager()
         self._load_year_data()
         self.episode_length = kwargs.get('episode_length', 24)
+        # consecutive days within one episode, soc and DG outputs are carried over the midnight of every day
+        self.if_continuous = kwargs.get('if_continuous', False)
+        # False: the last step returns the observation after the episode instead of the one of a new random day
+        self.if_auto_reset = kwargs.get('if_auto_reset', True)
+        # a scenario_sampler.ScenarioSampler, random resets take its next scenario instead of drawing one
+        self.scenario_sampler = kwargs.get('scenario_sampler')
+        # the random days and socs of this env, seed is an int or a np.random.SeedSequence
+        self.rng = np.random.default_rng(kwargs.get('seed'))
         self.month = None
         self.day = None
         self.TRAIN = True
@@ -162,16 +226,37 @@ class ESSEnv(gym.Env):
         self.sell_coefficient = 0.5  # control sell benefits
 
         self.grid = Grid()
-        self.battery = Battery(self.battery_parameters)
-        self.dg1 = DG(self.dg_parameters['gen_1'])
-        self.dg2 = DG(self.dg_parameters['gen_2'])
-        self.dg3 = DG(self.dg_parameters['gen_3'])
+        self._init_units()
+        self.diagnostics = np.zeros(4)  # operation_cost, unbalance, excess, shedding of the last step
+        # float64 copy of the action for ess_kernel
+        self.action = np.zeros(self.num_batteries+self.num_dgs)
 
+        # the action is one value per battery followed by one per DG
         self.action_space = spaces.Box(
-            low=-1, high=1, shape=(4,), dtype=np.float32)
+            low=-1, high=1, shape=(self.num_batteries+self.num_dgs,), dtype=np.float32)
 
         self.state_space = spaces.Box(
-            low=0, high=1, shape=(7,), dtype=np.float32)
+            low=0, high=1, shape=(5+self.num_batteries+self.num_dgs,), dtype=np.float32)
+        # False: every observation is a new array, True: observations are views of two buffers used in turns,
+        # valid until the next step returns, for collectors that copy them into buffers of their own
+        self.if_obs_view = kwargs.get('if_obs_view', False)
+        self.obs_buffers = np.zeros((2,)+self.state_space.shape, dtype=np.float32)
+        self.obs_slot = 0
+        # month and day are rewritten into a buffer only when they changed since it was last built
+        self.calendar_version = 0
+        self.obs_calendar = [-1, -1]
+
+    def _init_units(self):
+        '''the units and the arrays of their state that ess_kernel steps, one battery and dg1..dg3 here'''
+        self.num_batteries = 1
+        self.num_dgs = 3
+        self.units = [Battery(self.battery_parameters)]+[DG(self.dg_parameters[f'gen_{i}']) for i in range(1, 4)]
+        # battery and dg1..dg3 read the state of the arrays when they are accessed
+        self.soc = np.zeros(1)
+        self.energy_change = np.zeros(1)
+        self.dg_output = np.zeros(3)
+        self.battery_params = battery_param_array([self.battery_parameters])
+        self.dg_params = dg_param_array([self.dg_parameters[f'gen_{i}'] for i in range(1, 4)])
 
     @property
     def netload(self):
@@ -179,123 +264,119 @@ class ESSEnv(gym.Env):
         return self.demand-self.grid.wp_gen-self.grid.pv_gen
 
     def reset(self, day=None, month=None, initial_soc=None):
+        if self.scenario_sampler is not None and day is None and month is None and initial_soc is None:
+            month, day, initial_soc = next(self.scenario_sampler)
 
         if month is not None:
             self.month = month
         else:
-            self.month = np.random.randint(1, 13)  # here we choose 12 month
+            self.month = self.rng.integers(1, 13)  # here we choose 12 month
 
         if day is not None:
             self.day = day
         else:
-            self.day = np.random.randint(
+            self.day = self.rng.integers(
                 3, Constant.MONTHS_LEN[self.month-1]-1)
 
         self.current_time = 0
-        self.battery.reset(initial_soc)
-        self.dg1.reset()
-        self.dg2.reset()
-        self.dg3.reset()
+        self.episode_step = 0
+        self.hour_of_year = (Constant.MONTHS_START[self.month-1]+self.day-1)*24
+        # the coefficients may have been changed since the last episode
+        self.grid_params = np.array([self.grid.exchange_ability, self.penalty_coefficient, self.sell_coefficient], dtype=float)
+        self._reset_units(initial_soc)
+        self._write_calendar()
         return self._build_state()
 
+    def _reset_units(self, initial_soc):
+        if initial_soc is None:
+            initial_soc = self.rng.uniform(0.2, 0.8)
+        self.soc[0] = initial_soc
+        self.energy_change[0] = 0
+        self.dg_output[:] = 0
+
+    # battery and dg1..dg3 take the state of the ess_kernel arrays when they are read, not after every step
+    @property
+    def battery(self):
+        battery = self.units[0]
+        battery.current_capacity = float(self.soc[0])
+        battery.energy_change = float(self.energy_change[0])
+        return battery
+
+    def _dg(self, g):
+        dg = self.units[1+g]
+        dg.current_output = float(self.dg_output[g])
+        return dg
+
+    dg1 = property(lambda self: self._dg(0))
+    dg2 = property(lambda self: self._dg(1))
+    dg3 = property(lambda self: self._dg(2))
+
+    # the diagnostics of the last step
+    operation_cost = property(lambda self: float(self.diagnostics[0]))
+    unbalance = property(lambda self: float(self.diagnostics[1]))
+    excess = property(lambda self: float(self.diagnostics[2]))
+    shedding = property(lambda self: float(self.diagnostics[3]))
+    real_unbalance = property(lambda self: float(self.diagnostics[2]+self.diagnostics[3]))
+
+    @property
+    def current_output(self):
+        # truely corresonding to the result, DG outputs then battery outputs
+        return np.concatenate((self.dg_output, -self.energy_change))
+
+    def _write_calendar(self):
+        '''month and day changed at a reset or at midnight, every buffer takes them at its next _build_state'''
+        self.calendar_version += 1
+
     def _build_state(self):
-        soc = self.battery.SOC()
-        dg1_output = self.dg1.current_output
-        dg2_output = self.dg2.current_output
-        dg3_output = self.dg3.current_output
-        time_step = self.current_time
-        electricity_demand = self.data_manager.get_electricity_cons_data(
-            self.month, self.day, self.current_time)
-        pv_generation = self.data_manager.get_pv_data(
-            self.month, self.day, self.current_time)
-        price = self.data_manager.get_price_data(
-            self.month, self.day, self.current_time)
-        net_load = electricity_demand-pv_generation
-
-        state_dim = 9
-        if state_dim == 7:
-            obs = np.concatenate((np.float32(time_step), np.float32(price), np.float32(soc), np.float32(
-                net_load), np.float32(dg1_output), np.float32(dg2_output), np.float32(dg3_output)), axis=None)
-        elif state_dim == 9:
-            obs = np.concatenate((np.float32(time_step), np.float32(price), np.float32(soc), np.float32(
-                net_load), np.float32(dg1_output), np.float32(dg2_output), np.float32(dg3_output), np.float32(self.month), np.float32(self.day)), axis=None)
+        # only the hourly fields are written, into the buffer the last observation is not in
+        obs = self.obs_buffers[self.obs_slot]
+        if self.obs_calendar[self.obs_slot] != self.calendar_version:
+            obs[..., -2] = self.month
+            obs[..., -1] = self.day
+            self.obs_calendar[self.obs_slot] = self.calendar_version
+        state_kernel(obs, self.current_time, self.hour_data, self.hour_of_year+self.current_time, self.soc,
+                     self.dg_output)
+        if self.if_obs_view:
+            self.obs_slot ^= 1
+        else:
+            obs = obs.copy()
+        self.state = obs
         return obs
 
     def step(self, action):  # state transition here current_obs--take_action--get reward-- get_finish--next_obs
-        # here we want to put take action into each components
-        current_obs = self._build_state()
-        # here execute the state-transition part, battery.current_capacity also changed
-        self.battery.step(action[0])
-        self.dg1.step(action[1])
-        self.dg2.step(action[2])
-        self.dg3.step(action[3])
-        current_output = np.array((self.dg1.current_output, self.dg2.current_output,
-                                  self.dg3.current_output, -self.battery.energy_change))  # truely corresonding to the result
-        self.current_output = current_output
-        actual_production = sum(current_output)
-        netload = current_obs[3]
-        price = current_obs[1]
-
-        unbalance = actual_production-netload
-
-        reward = 0
-        excess_penalty = 0
-        deficient_penalty = 0
-        sell_benefit = 0
-        buy_cost = 0
-        self.excess = 0
-        self.shedding = 0
-        if unbalance >= 0:  # it is now in excess condition
-            if unbalance <= self.grid.exchange_ability:
-                # sell money to grid is little [0.029,0.1]
-                sell_benefit = self.grid._get_cost(
-                    price, unbalance)*self.sell_coefficient
-            else:
-                sell_benefit = self.grid._get_cost(
-                    price, self.grid.exchange_ability)*self.sell_coefficient
-                # real unbalance that even grid could not meet
-                self.excess = unbalance-self.grid.exchange_ability
-                excess_penalty = self.excess*self.penalty_coefficient
-        else:  # unbalance <0, its load shedding model, in this case, deficient penalty is used
-            if abs(unbalance) <= self.grid.exchange_ability:
-                buy_cost = self.grid._get_cost(price, abs(unbalance))
-            else:
-                buy_cost = self.grid._get_cost(
-                    price, self.grid.exchange_ability)
-                self.shedding = abs(unbalance)-self.grid.exchange_ability
-                deficient_penalty = self.shedding*self.penalty_coefficient
-        battery_cost = self.battery._get_cost(
-            self.battery.energy_change)  # we set it as 0 this time
-        dg1_cost = self.dg1._get_cost(self.dg1.current_output)
-        dg2_cost = self.dg2._get_cost(self.dg2.current_output)
-        dg3_cost = self.dg3._get_cost(self.dg3.current_output)
-
-        reward -= (battery_cost+dg1_cost+dg2_cost+dg3_cost+excess_penalty +
-                   deficient_penalty-sell_benefit+buy_cost) #/1e3
-        self.operation_cost = battery_cost+dg1_cost+dg2_cost+dg3_cost + \
-            buy_cost-sell_benefit+excess_penalty+deficient_penalty
-        self.unbalance = unbalance
-        self.real_unbalance = self.shedding+self.excess
-        final_step_outputs = [self.dg1.current_output, self.dg2.current_output,
-                              self.dg3.current_output, self.battery.current_capacity]
+        # the observation returned by the last reset or step
+        current_obs = self.state
+        self.action[:] = action
+        # battery, DGs, grid exchange and penalties in ess_kernel.step_kernel
+        reward = step_kernel(self.action, self.soc, self.dg_output, self.energy_change, self.battery_params,
+                             self.dg_params, self.grid_params, self.hour_data, self.hour_of_year+self.current_time,
+                             self.diagnostics)
         self.current_time += 1
-        finish = (self.current_time == self.episode_length)
+        self.episode_step += 1
+        finish = (self.episode_step == self.episode_length)
+        if self.if_continuous and not finish and self.current_time == 24:
+            self._next_day()
         if finish:
-            self.final_step_outputs = final_step_outputs
+            self.final_step_outputs = self.dg_output.tolist()+self.soc.tolist()
+        if finish and self.if_auto_reset:
             self.current_time = 0
-            # self.day+=1
-            # if self.day>Constant.MONTHS_LEN[self.month-1]:
-            #     self.day=1
-            #     self.month+=1
-            # if self.month>12:
-            #     self.month=1
-            #     self.day=1
             next_obs = self.reset()
-
         else:
             next_obs = self._build_state()
         return current_obs, next_obs, float(reward), finish
 
+    def _next_day(self):
+        '''calendar rollover of the continuous mode, 31.12 is followed by 1.1'''
+        self.current_time = 0
+        self.day += 1
+        self.hour_of_year += 24
+        if self.day > Constant.MONTHS_LEN[self.month-1]:
+            self.day = 1
+            self.month = self.month % 12+1
+            if self.month == 1:
+                self.hour_of_year = 0
+        self._write_calendar()
+
     def render(self, current_obs, next_obs, reward, finish):
         print('day={},hour={:2d}, state={}, next_state={}, reward={:.4f}, terminal={}\n'.format(
             self.day, self.current_time, current_obs, next_obs, reward, finish))
@@ -324,6 +405,184 @@ class ESSEnv(gym.Env):
         for i in range(0, electricity.shape[0], 60):
             element = electricity[i:i+60]
             self.data_manager.add_electricity_element(sum(element)*300)
+        self.data_hours = min(len(self.data_manager.PV_Generation), len(self.data_manager.Prices),
+                              len(self.data_manager.Electricity_Consumption))
+        # arrays of the same data for the kernels and BatchESSEnv
+        self.pv_data = np.asarray(self.data_manager.PV_Generation)
+        self.price_data = np.asarray(self.data_manager.Prices)
+        self.electricity_data = np.asarray(self.data_manager.Electricity_Consumption)
+        hours = self.data_hours
+        self.netload_data = self.electricity_data[:hours]-self.pv_data[:hours]
+        # (price, netload) of every hour of the year and of the hour after it, for the observations. The data of
+        # 31.12 lacks its last hour, missing hours repeat the last one
+        year_hours = sum(Constant.MONTHS_LEN)*24+1
+        hour_data = np.stack([self.price_data[:hours], self.netload_data], axis=1)[:year_hours]
+        self.hour_data = np.pad(hour_data, ((0, year_hours-len(hour_data)), (0, 0)), mode='edge')
+
+
+
+class MicrogridEnv(ESSEnv):
+    '''ESSEnv with any number of batteries and DGs, battery_parameters is a list of dicts and dg_parameters a dict of
+    gen_i dicts like Parameters.py
+
+    the state is time, price, the soc of every battery, netload, the output of every DG, month and day, the action
+    is one value per battery followed by one per DG. With one battery and three DGs both are the ones of ESSEnv.
+    '''
+
+    def _init_units(self):
+        if isinstance(self.battery_parameters, dict):
+            self.battery_parameters = [self.battery_parameters]
+        self.num_batteries = len(self.battery_parameters)
+        self.num_dgs = len(self.dg_parameters)
+        self.batteries = BatteryArray(self.battery_parameters)
+        self.dgs = DGArray(list(self.dg_parameters.values()))
+        # ess_kernel steps the unit arrays in place
+        self.soc = self.batteries.current_capacity
+        self.energy_change = self.batteries.energy_change
+        self.dg_output = self.dgs.current_output
+        self.battery_params = battery_param_array(self.battery_parameters)
+        self.dg_params = dg_param_array(list(self.dg_parameters.values()))
+
+    def _reset_units(self, initial_soc):
+        '''initial_soc is one value for all batteries or one per battery'''
+        self.batteries.reset(initial_soc, self.rng)
+        self.dgs.reset()
+
+
+class BatchESSEnv():
+    '''num_envs copies of ESSEnv stepped together, every component is an array with one entry per env
+
+    not an ESSEnv: reset takes arrays and step returns (current_obs, next_obs, rewards, operation_costs, unbalances,
+    finish) of all envs, next_obs is None after the last step. The data, units and settings come from a MicrogridEnv
+    with the battery and the dg_parameters of kwargs, so any number of DGs works like in MicrogridEnv.
+    '''
+
+    def __init__(self, num_envs, **kwargs):
+        battery = kwargs.pop('battery_parameters', battery_parameters)
+        self.env = MicrogridEnv(battery_parameters=[battery], **kwargs)
+        self.num_envs = num_envs
+        # what the callers and optimization_base_result read from an ESSEnv
+        self.data_manager = self.env.data_manager
+        self.hour_data = self.env.hour_data
+        self.grid = self.env.grid
+        self.battery_parameters = battery
+        self.dg_parameters = self.env.dg_parameters
+        self.num_dgs = self.env.num_dgs
+        self.action_space = self.env.action_space
+        self.state_space = self.env.state_space
+        self.episode_length = self.env.episode_length
+        self.if_continuous = self.env.if_continuous
+        self.scenario_sampler = self.env.scenario_sampler
+        self.rng = self.env.rng
+        self.TRAIN = True
+        self.penalty_coefficient = self.env.penalty_coefficient
+        self.sell_coefficient = self.env.sell_coefficient
+
+        self.month_start = np.array(Constant.MONTHS_START)
+        # month and day of every day of the year, for the rollover of the continuous mode
+        self.month_of_day = np.repeat(np.arange(1, 13), Constant.MONTHS_LEN)
+        self.day_of_month = np.concatenate([np.arange(1, days+1) for days in Constant.MONTHS_LEN])
+        self.set_parameters([self.battery_parameters], [self.dg_parameters])
+        # observations of all envs in the two buffers of ESSEnv, month and day written only when they changed
+        self.if_obs_view = self.env.if_obs_view
+        self.obs_buffers = np.zeros((2, num_envs)+self.state_space.shape, dtype=np.float32)
+        self.obs_slot = 0
+        self.calendar_version = 0
+        self.obs_calendar = [-1, -1]
+
+    def set_parameters(self, battery_parameters, dg_parameters):
+        '''lists of battery_parameters and dg_parameters, one per env or a single one shared by all envs'''
+        if any(len(dgs) != self.num_dgs for dgs in dg_parameters):
+            raise ValueError(f'every env needs the {self.num_dgs} DGs of the dg_parameters it was built with')
+        # the battery_params and dg_params matrices of ess_kernel for every env, generators in the order of dg_parameters
+        self.battery_params = np.stack([battery_param_array([battery]) for battery in battery_parameters])
+        self.dg_params = np.stack([dg_param_array(list(dgs.values())) for dgs in dg_parameters])
+
+    def reset(self, day=None, month=None, initial_soc=None):
+        '''day, month and initial_soc are arrays of num_envs values, missing ones are drawn like ESSEnv.reset'''
+        if self.scenario_sampler is not None and day is None and month is None and initial_soc is None:
+            month, day, initial_soc = self.scenario_sampler.take(self.num_envs)
+        if month is not None:
+            self.num_envs = len(month)
+        self.month = self.rng.integers(1, 13, self.num_envs) if month is None else np.asarray(month)
+        if day is None:
+            day = self.rng.integers(3, np.array(Constant.MONTHS_LEN)[self.month-1]-1)
+        # copies, both are updated in place by _next_day
+        self.day = np.array(day, dtype=int)
+        self.month = np.array(self.month, dtype=int)
+        self.day_of_year = self.month_start[self.month-1]+self.day-1
+        soc = self.rng.uniform(0.2, 0.8, self.num_envs) if initial_soc is None else initial_soc
+        # the unit state of batch_step_kernel, one row per env
+        self.soc = np.array(soc, dtype=float).reshape(self.num_envs, 1)
+        self.energy_change = np.zeros((self.num_envs, 1))
+        self.dg_output = np.zeros((self.num_envs, self.num_dgs))
+        self.action = np.zeros((self.num_envs, 1+self.num_dgs))
+        self.rewards = np.zeros(self.num_envs)
+        self.diagnostics = np.zeros((self.num_envs, 4))  # operation_cost, unbalance, excess, shedding
+        # a single shared parameter matrix is broadcast to all envs
+        self.env_battery_params = np.broadcast_to(self.battery_params, (self.num_envs,)+self.battery_params.shape[1:])
+        self.env_dg_params = np.broadcast_to(self.dg_params, (self.num_envs,)+self.dg_params.shape[1:])
+        self.grid_params = np.array([self.grid.exchange_ability, self.penalty_coefficient, self.sell_coefficient], dtype=float)
+        self.current_time = 0
+        self.episode_step = 0
+        if self.obs_buffers.shape[1] != self.num_envs:
+            self.obs_buffers = np.zeros((2, self.num_envs)+self.state_space.shape, dtype=np.float32)
+        self._write_calendar()
+        return self._build_state()
+
+    def _write_calendar(self):
+        self.calendar_version += 1
+
+    def _build_state(self):
+        obs = self.obs_buffers[self.obs_slot]
+        if self.obs_calendar[self.obs_slot] != self.calendar_version:
+            obs[:, -2] = self.month
+            obs[:, -1] = self.day
+            self.obs_calendar[self.obs_slot] = self.calendar_version
+        features = self.hour_data[self.day_of_year*24+self.current_time]
+        obs[:, 0] = self.current_time
+        obs[:, 1] = features[:, 0]
+        obs[:, 2] = self.soc[:, 0]
+        obs[:, 3] = features[:, 1]
+        obs[:, 4:4+self.num_dgs] = self.dg_output
+        if self.if_obs_view:
+            self.obs_slot ^= 1
+        else:
+            obs = obs.copy()
+        self.state = obs
+        return obs
+
+    # the diagnostics of the last step, one value per env
+    excess = property(lambda self: self.diagnostics[:, 2].copy())
+    shedding = property(lambda self: self.diagnostics[:, 3].copy())
+    real_unbalance = property(lambda self: self.diagnostics[:, 2]+self.diagnostics[:, 3])
+
+    def step(self, action):
+        '''action has shape (num_envs, 1+num_dgs), returns arrays of rewards, operation costs and unbalances'''
+        current_obs = self.state
+        self.action[:] = action
+        # the physics of ESSEnv.step, ess_kernel.step_kernel for every env
+        batch_step_kernel(self.action, self.soc, self.dg_output, self.energy_change, self.env_battery_params,
+                          self.env_dg_params, self.grid_params, self.hour_data, self.day_of_year*24+self.current_time,
+                          self.diagnostics, self.rewards)
+        rewards, operation_cost, unbalance = self.rewards.copy(), self.diagnostics[:, 0].copy(), self.diagnostics[:, 1].copy()
+
+        self.current_time += 1
+        self.episode_step += 1
+        finish = (self.episode_step == self.episode_length)
+        if self.if_continuous and not finish and self.current_time == 24:
+            self._next_day()
+        next_obs = None if finish else self._build_state()
+        return current_obs, next_obs, rewards, operation_cost, unbalance, finish
+
+    def _next_day(self):
+        '''calendar rollover of all envs, in place on the existing arrays'''
+        self.current_time = 0
+        self.day_of_year += 1
+        np.remainder(self.day_of_year, len(self.month_of_day), out=self.day_of_year)
+        np.take(self.month_of_day, self.day_of_year, out=self.month)
+        np.take(self.day_of_month, self.day_of_year, out=self.day)
+        self._write_calendar()
 
 
 if __name__ == '__main__':
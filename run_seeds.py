@@ -0,0 +1,167 @@
+'''train all seeds of one agent at the same time, one worker process per seed'''
+import os
+import pickle
+import argparse
+import concurrent.futures
+import multiprocessing as mp
+import torch
+import numpy as np
+
+from tools import Arguments, get_episode_return, ReplayBuffer, get_ess_codecs
+from agent import AgentDDPG, AgentTD3, AgentSAC, AgentPPO
+from random_generator_battery import ESSEnv
+from scenario_sampler import ScenarioSampler
+from profiling import profiler
+
+AGENTS = {'DDPG': AgentDDPG, 'TD3': AgentTD3, 'SAC': AgentSAC, 'PPO': AgentPPO}
+
+
+def update_off_policy_buffer(buffer, _trajectory, gamma):
+    ten_state = torch.as_tensor(np.array([item[0] for item in _trajectory]), dtype=torch.float32)
+    ary_other = torch.as_tensor([item[1] for item in _trajectory], dtype=torch.float32)
+    ary_other[:, 1] = (1.0 - ary_other[:, 1]) * gamma  # ten_mask = (1.0 - ary_done) * gamma
+    if buffer.if_store_next_state:
+        ten_next_state = torch.as_tensor(np.array([item[2] for item in _trajectory]), dtype=torch.float32)
+        buffer.extend_buffer(ten_state, ary_other, ten_next_state)
+    else:
+        buffer.extend_buffer(ten_state, ary_other)
+
+
+def update_on_policy_buffer(buffer, _trajectory, gamma):
+    _trajectory = list(map(list, zip(*_trajectory)))  # 2D-list transpose
+    ten_state = torch.as_tensor(np.array(_trajectory[0]), dtype=torch.float32)
+    ten_reward = torch.as_tensor(_trajectory[1], dtype=torch.float32)
+    ten_mask = (1.0 - torch.as_tensor(_trajectory[2], dtype=torch.float32)) * gamma
+    ten_action = torch.as_tensor(np.array(_trajectory[3]), dtype=torch.float32)
+    ten_noise = torch.as_tensor(np.array(_trajectory[4]), dtype=torch.float32)
+    buffer[:] = (ten_state, ten_action, ten_noise, ten_reward, ten_mask)
+
+
+def train_one_seed(agent_name, seed, num_episode, visible_gpu, num_threads, if_store_next_state=False):
+    '''train one seed in the same way as DDPG.py / TD3.py / SAC.py / PPO.py and save into {agent_name}/seed_{seed}'''
+    args = Arguments()
+    args.random_seed = seed
+    args.visible_gpu = visible_gpu
+    args.num_threads = num_threads
+    args.num_episode = args.num_episode if num_episode is None else num_episode
+    args.if_store_next_state = if_store_next_state
+    if agent_name == 'PPO':  # on-policy settings of PPO.py
+        args.learning_rate = 2e-4
+        args.repeat_times = 2 ** 3
+        args.target_step = 4096
+        args.max_memo = args.target_step
+    # independent random streams of the env, the replay buffer and the exploration noise
+    env_seed, buffer_seed, agent_seed = args.seed_sequences(3)
+    args.agent = AGENTS[agent_name]()
+    args.agent.critic_ensemble_num = args.critic_ensemble_num
+    args.agent.seed = agent_seed
+    args.env = ESSEnv(seed=env_seed, scenario_sampler=ScenarioSampler(seed) if args.if_scenario_sampler else None)
+    args.cwd = f'./{args.agent.__class__.__name__}/seed_{seed}'
+    args.init_before_training(if_main=True)
+    if args.if_profile:
+        profiler.enable(trace_path=f'{args.cwd}/trace.json' if args.if_profile_trace else None)
+
+    agent = args.agent
+    env = args.env
+    state_dim, action_dim = env.state_space.shape[0], env.action_space.shape[0]
+    agent.init(args.net_dim, state_dim, action_dim, args.learning_rate, args.if_per_or_gae)
+    agent.state = env.reset()
+
+    reward_record = {'episode': [], 'steps': [], 'mean_episode_reward': [], 'unbalance': []}
+    loss_record = {'episode': [], 'steps': [], 'critic_loss': [], 'actor_loss': [], 'entropy_loss': []}
+    profile_record = []  # profiler.summary() of every episode when args.if_profile
+    if agent_name == 'PPO':
+        buffer = list()
+    else:
+        buffer = ReplayBuffer(max_len=args.max_memo, state_dim=state_dim, action_dim=action_dim,
+                              if_store_next_state=args.if_store_next_state, seed=buffer_seed,
+                              codecs=get_ess_codecs(action_dim, args.gamma) if args.if_compact_buffer else None)
+        with torch.no_grad():
+            while buffer.now_len < 10000:
+                update_off_policy_buffer(buffer, agent.explore_env(env, args.target_step), args.gamma)
+                buffer.update_now_len()
+
+    for i_episode in range(args.num_episode):
+        if agent_name == 'PPO':
+            with torch.no_grad():
+                update_on_policy_buffer(buffer, agent.explore_env(env, args.target_step), args.gamma)
+        losses = agent.update_net(buffer, args.batch_size, args.repeat_times, args.soft_update_tau)
+        loss_record['episode'].append(i_episode)
+        loss_record['critic_loss'].append(losses[0])
+        loss_record['actor_loss'].append(losses[1])
+        if len(losses) > 2:
+            loss_record['entropy_loss'].append(losses[2])
+        with torch.no_grad():
+            episode_reward, episode_unbalance = get_episode_return(env, agent.act, agent.device)
+        reward_record['episode'].append(i_episode)
+        reward_record['mean_episode_reward'].append(episode_reward)
+        reward_record['unbalance'].append(episode_unbalance)
+        print(f'seed {seed}, curren epsiode is {i_episode}, reward:{episode_reward},unbalance:{episode_unbalance}')
+        if args.if_profile:
+            profile_record.append(profiler.summary())
+            print(f'seed {seed}, {profiler.format(profile_record[-1])}')
+        if agent_name != 'PPO' and i_episode % 10 == 0:
+            with torch.no_grad():
+                update_off_policy_buffer(buffer, agent.explore_env(env, args.target_step), args.gamma)
+
+    with open(f'{args.cwd}/loss_data.pkl', 'wb') as tf:
+        pickle.dump(loss_record, tf)
+    with open(f'{args.cwd}/reward_data.pkl', 'wb') as tf:
+        pickle.dump(reward_record, tf)
+    if args.if_profile:
+        with open(f'{args.cwd}/profile_data.pkl', 'wb') as tf:
+            pickle.dump(profile_record, tf)
+        if args.if_profile_trace:
+            profiler.export_chrome_trace()
+    if args.save_network:
+        torch.save(agent.act.state_dict(), f'{args.cwd}/actor.pth')
+    return seed, reward_record, loss_record
+
+
+def merge_records(records):
+    '''concatenate the per-seed records in seed order, the same layout the sequential seed loop produces'''
+    merged = {'seed': []}
+    for seed, record in records:
+        length = max(len(value) for value in record.values())
+        merged['seed'].extend([seed] * length)
+        for key, value in record.items():
+            merged.setdefault(key, []).extend(value)
+    return merged
+
+
+def run_seeds(agent_name, seeds, num_episode=None, num_workers=None, if_store_next_state=False):
+    args = Arguments()
+    num_workers = len(seeds) if num_workers is None else num_workers
+    gpus = str(args.visible_gpu).split(',')
+    num_threads = max(1, (os.cpu_count() or 1) // num_workers)  # avoid oversubscription between workers
+
+    results = {}
+    # spawn, so that no CUDA or OpenMP state is inherited from the parent process
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context('spawn')) as executor:
+        futures = [executor.submit(train_one_seed, agent_name, seed, num_episode, gpus[i % len(gpus)], num_threads,
+                                   if_store_next_state) for i, seed in enumerate(seeds)]
+        for future in concurrent.futures.as_completed(futures):
+            seed, reward_record, loss_record = future.result()
+            results[seed] = (reward_record, loss_record)
+
+    reward_record = merge_records([(seed, results[seed][0]) for seed in seeds])
+    loss_record = merge_records([(seed, results[seed][1]) for seed in seeds])
+    cwd = f'./{AGENTS[agent_name]().__class__.__name__}'
+    with open(f'{cwd}/loss_data.pkl', 'wb') as tf:
+        pickle.dump(loss_record, tf)
+    with open(f'{cwd}/reward_data.pkl', 'wb') as tf:
+        pickle.dump(reward_record, tf)
+    print(f'training data of seeds {seeds} have been merged and saved in {cwd}')
+    return reward_record, loss_record
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--agent', type=str, default='TD3', choices=list(AGENTS))
+    parser.add_argument('--seeds', type=int, nargs='+', default=[1234, 2234, 3234, 4234, 5234])
+    parser.add_argument('--num_episode', type=int, default=None)
+    parser.add_argument('--num_workers', type=int, default=None)
+    parser.add_argument('--store_next_state', action='store_true', help='ReplayBuffer(if_store_next_state=True)')
+    args = parser.parse_args()
+
+    run_seeds(args.agent, args.seeds, args.num_episode, args.num_workers, args.store_next_state)
@@ -0,0 +1,63 @@
+'''a seeded table of (month, day, initial_soc) scenarios, stratified over every day and soc bin, shared by training,
+the pyomo oracle and evaluation'''
+import numpy as np
+
+from random_generator_battery import Constant
+
+
+class ScenarioSampler:
+    '''every (month, day, soc) on the 0.01 soc grid once, ordered in rounds
+
+    a round holds one soc of every (month, day, soc bin) stratum in shuffled order, so any prefix of the table covers
+    the strata evenly and no scenario repeats until the table wraps around. Days run from first_day to the third last
+    of each month like the random days of generate_solutions.
+    '''
+
+    def __init__(self, seed=0, soc_bins=6, soc_range=(0.2, 0.8), first_day=1):
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        month = np.concatenate([np.full(days - first_day - 1, m + 1) for m, days in enumerate(Constant.MONTHS_LEN)])
+        day = np.concatenate([np.arange(first_day, days - 1) for days in Constant.MONTHS_LEN])
+        # rounded to 2 decimals like the initial socs of eval_solutions.pkl, binned in integer hundredths
+        cents = np.arange(round(soc_range[0] * 100), round(soc_range[1] * 100) + 1)
+        socs = cents / 100
+        soc_bin = (cents - cents[0]) * soc_bins // len(cents)
+
+        # the round of a scenario is its rank among the socs of its stratum in a random order
+        keys = rng.random((len(day), len(socs)))
+        rounds = np.empty((len(day), len(socs)), dtype=int)
+        for b in range(soc_bins):
+            columns = np.flatnonzero(soc_bin == b)
+            rounds[:, columns] = keys[:, columns].argsort(axis=1).argsort(axis=1)
+        order = np.lexsort((rng.random(rounds.size), rounds.ravel()))
+        self.month = np.repeat(month, len(socs))[order]
+        self.day = np.repeat(day, len(socs))[order]
+        self.initial_soc = np.tile(socs, len(day))[order]
+        self.soc_bin = np.tile(soc_bin, len(day))[order]
+        self.strata = len(day) * soc_bins  # the scenarios of one round
+        self.cursor = 0
+
+    def __len__(self):
+        return len(self.month)
+
+    def scenarios(self, number=None, worker_id=0, num_workers=1, start=0):
+        '''month, day and initial_soc arrays of the scenarios start..start+number of the table, worker_id gets every
+        num_workers-th of them, so that the shards of parallel workers do not overlap and are stratified each'''
+        number = len(self) - start if number is None else number
+        if start + number > len(self):
+            raise ValueError(f'{start + number} scenarios asked, the table has {len(self)} different ones')
+        index = np.arange(start + worker_id, start + number, num_workers)
+        return self.month[index], self.day[index], self.initial_soc[index]
+
+    def take(self, number):
+        '''the next number scenarios of the table, wrapping around at its end, for the random resets of training'''
+        index = (self.cursor + np.arange(number)) % len(self)
+        self.cursor = (self.cursor + number) % len(self)
+        return self.month[index], self.day[index], self.initial_soc[index]
+
+    def __next__(self):
+        month, day, initial_soc = self.take(1)
+        return int(month[0]), int(day[0]), float(initial_soc[0])
+
+    def __iter__(self):
+        return self
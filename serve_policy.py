@@ -0,0 +1,216 @@
+'''serve a trained actor.pth or model_ratio.pt over HTTP, concurrent requests are micro-batched into one forward pass
+
+POST /act      {"state": [9 floats]} for an RL actor, for DT the day so far in raw env states:
+               {"states": [[9 floats], ...], "actions": [[4 floats], ...], "returns_to_go": [...], "timesteps": [...]}
+               -> {"action": [4 floats]}
+GET  /metrics  request count, batch sizes and p50/p99 latency in ms
+'''
+import json
+import time
+import queue
+import argparse
+import threading
+import collections
+import concurrent.futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import torch
+
+from evaluate_year import ACTORS, load_policy, load_state_stats
+
+state_dim = 9
+act_dim = 4
+
+
+class LatencyStats:
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=window)  # ms of the latest requests
+        self.batch_sizes = collections.deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+
+    def add_request(self, latency_ms, ok=True):
+        with self.lock:
+            self.requests += 1
+            self.errors += not ok
+            self.latencies.append(latency_ms)
+
+    def add_batch(self, batch_size):
+        with self.lock:
+            self.batch_sizes.append(batch_size)
+
+    def report(self):
+        with self.lock:
+            latencies = np.array(self.latencies)
+            batch_sizes = np.array(self.batch_sizes)
+            report = {'requests': self.requests, 'errors': self.errors, 'batches': len(batch_sizes)}
+        if len(latencies):
+            report['latency_ms_p50'], report['latency_ms_p99'] = np.percentile(latencies, [50, 99]).tolist()
+        if len(batch_sizes):
+            report['batch_size_mean'] = float(batch_sizes.mean())
+        return report
+
+
+class MicroBatcher:
+    '''one worker thread runs forward on up to max_batch_size queued requests, waiting at most max_wait_ms for them'''
+
+    def __init__(self, forward, max_batch_size=64, max_wait_ms=1.0, stats=None):
+        self.forward = forward
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1e3
+        self.stats = stats
+        self.queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, item):
+        future = concurrent.futures.Future()
+        self.queue.put((item, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                outputs = self.forward([item for item, _ in batch])
+                for (_, future), output in zip(batch, outputs):
+                    future.set_result(output)
+            except Exception as error:  # fail the requests of this batch, not the server
+                for _, future in batch:
+                    future.set_exception(error)
+            if self.stats is not None:
+                self.stats.add_batch(len(batch))
+
+
+class ActorPolicy:
+    def __init__(self, model):
+        self.model = model
+
+    def prepare(self, item):
+        '''runs in the request thread, so that a malformed request fails alone'''
+        return torch.as_tensor(item['state'], dtype=torch.float32).reshape(state_dim)
+
+    def forward(self, prepared):
+        with torch.no_grad():
+            return self.model(torch.stack(prepared)).tolist()
+
+
+class DTPolicy:
+    def __init__(self, model, state_mean, state_std):
+        self.model = model
+        self.max_length = model.max_length
+        self.state_mean = state_mean  # the input normalization of DT.py training
+        self.state_std = state_std
+
+    def prepare(self, item):
+        '''the left padded window of DecisionTransformer.get_action, the latest action is the zero padding'''
+        max_length = self.max_length
+        item_states = torch.as_tensor(item['states'], dtype=torch.float32).reshape(-1, state_dim)
+        item_states = (item_states - self.state_mean) / self.state_std  # the padding stays zero
+        item_actions = torch.zeros((len(item_states), act_dim))
+        past_actions = torch.as_tensor(item.get('actions', []), dtype=torch.float32).reshape(-1, act_dim)
+        past_actions = past_actions[:len(item_states) - 1]
+        item_actions[:len(past_actions)] = past_actions
+        item_returns = torch.as_tensor(item['returns_to_go'], dtype=torch.float32).reshape(-1)
+        item_timesteps = torch.as_tensor(item.get('timesteps', range(len(item_states))), dtype=torch.long).reshape(-1)
+        length = min(len(item_states), max_length)
+
+        states = torch.zeros((max_length, state_dim))
+        actions = torch.zeros((max_length, act_dim))
+        returns_to_go = torch.zeros((max_length, 1))
+        timesteps = torch.zeros(max_length, dtype=torch.long)
+        attention_mask = torch.zeros(max_length, dtype=torch.long)
+        states[max_length - length:] = item_states[-length:]
+        actions[max_length - length:] = item_actions[-length:]
+        returns_to_go[max_length - length:, 0] = item_returns[-length:]
+        timesteps[max_length - length:] = item_timesteps[-length:]
+        attention_mask[max_length - length:] = 1
+        return states, actions, returns_to_go, timesteps, attention_mask
+
+    def forward(self, prepared):
+        states, actions, returns_to_go, timesteps, attention_mask = [torch.stack(x) for x in zip(*prepared)]
+        with torch.no_grad():
+            action_preds = self.model(states, actions, None, returns_to_go, timesteps, attention_mask=attention_mask)[1]
+        return action_preds[:, -1].tolist()
+
+
+def make_handler(policy, batcher, stats):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, body):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self._reply(200, stats.report())
+            elif self.path == '/health':
+                self._reply(200, {'status': 'ok'})
+            else:
+                self._reply(404, {'error': f'unknown path {self.path}'})
+
+        def do_POST(self):
+            if self.path != '/act':
+                self._reply(404, {'error': f'unknown path {self.path}'})
+                return
+            start = time.perf_counter()
+            try:
+                item = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                action = batcher.submit(policy.prepare(item))
+            except Exception as error:
+                stats.add_request((time.perf_counter() - start) * 1e3, ok=False)
+                self._reply(400, {'error': repr(error)})
+                return
+            stats.add_request((time.perf_counter() - start) * 1e3)
+            self._reply(200, {'action': action})
+
+        def log_message(self, format, *args):  # no line per request on stderr
+            pass
+    return Handler
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # the default backlog of 5 resets connections under concurrent clients
+
+
+def build_server(model_path, agent_name, host='127.0.0.1', port=8000, max_batch_size=64, max_wait_ms=1.0):
+    model = load_policy(model_path, agent_name, torch.device('cpu'))
+    stats = LatencyStats()
+    if agent_name == 'DT':
+        policy = DTPolicy(model, *load_state_stats(model_path, torch.device('cpu')))
+    else:
+        policy = ActorPolicy(model)
+    batcher = MicroBatcher(policy.forward, max_batch_size, max_wait_ms, stats)
+    server = Server((host, port), make_handler(policy, batcher, stats))
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', type=str, default='model_ratio.pt', help='actor.pth of an RL agent or model_ratio.pt of DT.py')
+    parser.add_argument('--agent', type=str, default='DT', choices=['DT'] + list(ACTORS))
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max_batch_size', type=int, default=64)
+    parser.add_argument('--max_wait_ms', type=float, default=1.0, help='how long a request may wait for others to batch with')
+    parser.add_argument('--num_threads', type=int, default=1, help='torch threads of the forward pass')
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.num_threads)
+    server = build_server(args.model, args.agent, args.host, args.port, args.max_batch_size, args.max_wait_ms)
+    print(f'serving {args.agent} policy {args.model} on http://{args.host}:{args.port}/act')
+    server.serve_forever()
@@ -0,0 +1,42 @@
+'''a synthetic year of data/PV.csv, data/Prices.csv and data/H4.csv, so that the env tests run without the dataset'''
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_year(data_dir, seed=0):
+    '''the files in the format of the real data: ';' separated with decimal commas, PV and prices per hour, the
+    household consumption per minute. Loads reach beyond the DGs, the battery and the grid together, so that both
+    excess and shedding occur'''
+    rng = np.random.default_rng(seed)
+    hours = 365*24
+    hour = np.arange(hours) % 24
+    pv = np.clip(np.sin((hour-6)/12*np.pi), 0, None)*rng.uniform(0.5, 2, hours)
+    price = 30+25*np.sin((hour-10)/24*2*np.pi)+rng.normal(0, 8, hours)
+    load = rng.uniform(0, 1500, hours)*(0.5+0.5*np.sin((hour-4)/24*np.pi))
+    # ESSEnv sums 60 minutes and scales them by 300
+    power = np.repeat(load/(60*300), 60)*rng.uniform(0.8, 1.2, hours*60)
+
+    time = pd.date_range('2016-01-01', periods=hours, freq='h').strftime('%d.%m.%y %H:%M')
+    os.makedirs(data_dir, exist_ok=True)
+    write = lambda frame, name: frame.to_csv(os.path.join(data_dir, name), sep=';', decimal=',', index=False,
+                                             float_format='%.6f')
+    write(pd.DataFrame({'Time': time, 'P_PV_': pv}), 'PV.csv')
+    write(pd.DataFrame({'Time': time, 'Price': price}), 'Prices.csv')
+    write(pd.DataFrame({'Power': power}), 'H4.csv')
+
+
+@pytest.fixture(scope='session', autouse=True)
+def synthetic_data(tmp_path_factory):
+    '''runs every test in a directory whose data folder holds the synthetic year'''
+    root = tmp_path_factory.mktemp('synthetic')
+    write_year(str(root/'data'))
+    cwd = os.getcwd()
+    os.chdir(root)
+    yield root
+    os.chdir(cwd)
@@ -0,0 +1,56 @@
+'''the per-day totals of backtest must be the ones of single ESSEnv rollouts'''
+import copy
+
+import numpy as np
+import pytest
+
+from Parameters import battery_parameters, dg_parameters
+from random_generator_battery import ESSEnv, Constant
+from backtest import backtest
+
+
+def policy(obs):
+    '''deterministic actions that charge and discharge and ramp the DGs up and down over the day'''
+    obs = np.asarray(obs, dtype=np.float64)
+    phase = obs[:, [0]]/24*2*np.pi+np.arange(4)
+    return np.sin(phase)*np.tanh(obs[:, [3]]/300)
+
+
+def single_env_days(battery, dgs, days, initial_soc, if_continuous=False):
+    '''cost, real_unbalance and shedding of every hour of ESSEnv rollouts, (days, 24)'''
+    env = ESSEnv(battery_parameters=battery, dg_parameters=dgs, if_continuous=if_continuous,
+                 episode_length=24*len(days) if if_continuous else 24)
+    totals = np.zeros((3, len(days), 24))
+    for i, (month, day) in enumerate(days):
+        if i == 0 or not if_continuous:
+            state = env.reset(day=day, month=month, initial_soc=initial_soc)
+        for hour in range(24):
+            _, state, _, _ = env.step(np.asarray(policy(state[None])[0], dtype=np.float32))  # like backtest
+            totals[:, i, hour] = env.operation_cost, env.real_unbalance, env.shedding
+    return totals
+
+
+def test_daily_totals_match_single_env():
+    dgs = copy.deepcopy(dg_parameters)
+    dgs['gen_3']['power_output_max'] *= 0.5
+    battery_grid = [battery_parameters, dict(battery_parameters, capacity=250)]
+    results = backtest(policy, battery_grid, [dg_parameters, dgs], initial_soc=0.4)
+    assert results['cost'].shape == (4, 365)
+    assert (results['unbalance'] >= 0).all() and (results['unbalance'] > 0).any()
+
+    days = [(1, 1), (3, 14), (7, 31), (12, 31)]
+    columns = [Constant.MONTHS_START[month-1]+day-1 for month, day in days]
+    for c, (battery, dg) in enumerate([(b, d) for b in battery_grid for d in [dg_parameters, dgs]]):
+        cost, unbalance, shedding = single_env_days(battery, dg, days, 0.4).sum(axis=2)
+        np.testing.assert_allclose(results['cost'][c, columns], cost, rtol=1e-9)
+        np.testing.assert_allclose(results['unbalance'][c, columns], unbalance, rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(results['shedding'][c, columns], shedding, rtol=1e-9, atol=1e-9)
+
+
+def test_continuous_year_matches_single_env():
+    results = backtest(policy, [battery_parameters], [dg_parameters], initial_soc=0.4, if_continuous=True)
+    days = [(month+1, day+1) for month, length in enumerate(Constant.MONTHS_LEN) for day in range(length)]
+    cost, unbalance, shedding = single_env_days(battery_parameters, dg_parameters, days, 0.4, True).sum(axis=2)
+    np.testing.assert_allclose(results['cost'][0], cost, rtol=1e-9)
+    np.testing.assert_allclose(results['unbalance'][0], unbalance, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(results['shedding'][0], shedding, rtol=1e-9, atol=1e-9)
@@ -0,0 +1,108 @@
+'''step_kernel and batch_step_kernel against the Battery, DG and Grid classes with the step of the original ESSEnv'''
+import numpy as np
+import pytest
+
+from ess_kernel import step_kernel, batch_step_kernel, battery_param_array, dg_param_array
+from random_generator_battery import Battery, DG, Grid
+from Parameters import battery_parameters, dg_parameters
+
+penalty_coefficient, sell_coefficient = 50, 0.5
+
+
+def reference_step(batteries, dgs, grid, action, price, netload):
+    '''the physics and reward of ESSEnv.step before the kernel, for any number of units'''
+    for battery, battery_action in zip(batteries, action):
+        battery.step(battery_action)
+    for dg, dg_action in zip(dgs, action[len(batteries):]):
+        dg.step(dg_action)
+    unbalance = sum(dg.current_output for dg in dgs)-sum(battery.energy_change for battery in batteries)-netload
+    excess = shedding = 0
+    sell_benefit = buy_cost = 0
+    if unbalance >= 0:
+        sell_benefit = grid._get_cost(price, min(unbalance, grid.exchange_ability))*sell_coefficient
+        excess = max(unbalance-grid.exchange_ability, 0)
+    else:
+        buy_cost = grid._get_cost(price, min(-unbalance, grid.exchange_ability))
+        shedding = max(-unbalance-grid.exchange_ability, 0)
+    operation_cost = sum(battery._get_cost(battery.energy_change) for battery in batteries) + \
+        sum(dg._get_cost(dg.current_output) for dg in dgs) + \
+        buy_cost-sell_benefit+(excess+shedding)*penalty_coefficient
+    return -operation_cost, (operation_cost, unbalance, excess, shedding)
+
+
+def make_units(rng, num_batteries, num_dgs):
+    batteries = []
+    for _ in range(num_batteries):  # a degradation cost, so that the battery term is checked too
+        battery = Battery(dict(battery_parameters, degradation=rng.uniform(0, 0.01), capacity=rng.uniform(300, 700)))
+        battery.reset(rng.uniform(0.2, 0.8))
+        batteries.append(battery)
+    dgs = [DG(list(dg_parameters.values())[g % len(dg_parameters)]) for g in range(num_dgs)]
+    for dg in dgs:
+        dg.current_output = rng.choice([0., rng.uniform(0, dg.power_output_max)])
+    return batteries, dgs
+
+
+def kernel_arrays(batteries, dgs):
+    battery_params = battery_param_array([{'capacity': battery.capacity, 'max_charge': battery.max_charge,
+                                           'min_soc': battery.min_soc, 'max_soc': battery.max_soc,
+                                           'degradation': battery.degradation} for battery in batteries])
+    dg_params = dg_param_array([{'a': dg.a_factor, 'b': dg.b_factor, 'c': dg.c_factor,
+                                 'power_output_max': dg.power_output_max, 'power_output_min': dg.power_output_min,
+                                 'ramping_up': dg.ramping_up} for dg in dgs])
+    soc = np.array([battery.current_capacity for battery in batteries])
+    dg_output = np.array([dg.current_output for dg in dgs], dtype=float)
+    return soc, dg_output, np.zeros(len(batteries)), battery_params, dg_params
+
+
+def random_hours(rng, hours=48):
+    # netloads far beyond the units and the grid on both sides, so that excess and shedding occur
+    return np.column_stack([rng.uniform(0, 120, hours), rng.uniform(-800, 1800, hours)])
+
+
+@pytest.mark.parametrize('num_batteries, num_dgs', [(1, 3), (2, 5)])
+@pytest.mark.parametrize('kernel', [step_kernel, getattr(step_kernel, 'py_func', step_kernel)])  # numba, plain Python
+def test_step_kernel_matches_reference(kernel, num_batteries, num_dgs):
+    rng = np.random.default_rng(num_batteries)
+    grid = Grid()
+    grid_params = np.array([grid.exchange_ability, penalty_coefficient, sell_coefficient], dtype=float)
+    batteries, dgs = make_units(rng, num_batteries, num_dgs)
+    soc, dg_output, energy_change, battery_params, dg_params = kernel_arrays(batteries, dgs)
+    hour_data = random_hours(rng)
+    diagnostics = np.zeros(4)
+    seen = set()
+    for index in range(len(hour_data)):
+        action = rng.uniform(-1, 1, num_batteries + num_dgs)
+        reward = kernel(action, soc, dg_output, energy_change, battery_params, dg_params, grid_params, hour_data,
+                        index, diagnostics)
+        ref_reward, ref_diagnostics = reference_step(batteries, dgs, grid, action, *hour_data[index])
+        np.testing.assert_allclose(reward, ref_reward, rtol=1e-12)
+        np.testing.assert_allclose(diagnostics, ref_diagnostics, rtol=1e-12, atol=1e-9)
+        np.testing.assert_allclose(soc, [battery.current_capacity for battery in batteries], rtol=1e-12)
+        np.testing.assert_allclose(energy_change, [battery.energy_change for battery in batteries], atol=1e-9)
+        np.testing.assert_allclose(dg_output, [dg.current_output for dg in dgs], rtol=1e-12)
+        seen.add('excess' if diagnostics[2] > 0 else 'shedding' if diagnostics[3] > 0 else 'grid')
+    assert seen == {'excess', 'shedding', 'grid'}
+
+
+def test_batch_step_kernel_matches_step_kernel():
+    rng = np.random.default_rng(0)
+    num_envs, num_dgs = 6, 3
+    grid_params = np.array([Grid().exchange_ability, penalty_coefficient, sell_coefficient], dtype=float)
+    units = [kernel_arrays(*make_units(rng, 1, num_dgs)) for _ in range(num_envs)]
+    soc, dg_output, energy_change, battery_params, dg_params = (np.stack(arrays) for arrays in zip(*units))
+    hour_data = random_hours(rng)
+    diagnostics, rewards = np.zeros((num_envs, 4)), np.zeros(num_envs)
+    for step in range(24):
+        action = rng.uniform(-1, 1, (num_envs, 1 + num_dgs))
+        index = (np.arange(num_envs) * 5 + step) % len(hour_data)  # every env at its own hour
+        batch_step_kernel(action, soc, dg_output, energy_change, battery_params, dg_params, grid_params, hour_data,
+                          index, diagnostics, rewards)
+        for e, (env_soc, env_dg_output, env_energy_change, env_battery_params, env_dg_params) in enumerate(units):
+            env_diagnostics = np.zeros(4)
+            reward = step_kernel(action[e], env_soc, env_dg_output, env_energy_change, env_battery_params,
+                                 env_dg_params, grid_params, hour_data, index[e], env_diagnostics)
+            assert rewards[e] == reward
+            np.testing.assert_array_equal(diagnostics[e], env_diagnostics)
+            np.testing.assert_array_equal(soc[e], env_soc)
+            np.testing.assert_array_equal(dg_output[e], env_dg_output)
+            np.testing.assert_array_equal(energy_change[e], env_energy_change)
@@ -0,0 +1,62 @@
+'''a two head CriticEnsemble with the weights of a CriticTwin must give the CriticTwin values, loss and gradients'''
+import torch
+
+from net import CriticTwin, CriticEnsemble
+
+mid_dim, state_dim, action_dim, batch_size = 32, 9, 4, 64
+
+
+def twin_and_ensemble():
+    torch.manual_seed(0)
+    twin = CriticTwin(mid_dim, state_dim, action_dim)
+    ensemble = CriticEnsemble(mid_dim, state_dim, action_dim, num_heads=2)
+    ensemble.net_sa.load_state_dict(twin.net_sa.state_dict())
+    heads = [twin.net_q1, twin.net_q2]
+    with torch.no_grad():
+        ensemble.head_w1.copy_(torch.stack([head[0].weight.t() for head in heads]))
+        ensemble.head_b1.copy_(torch.stack([head[0].bias[None] for head in heads]))
+        ensemble.head_w2.copy_(torch.stack([head[2].weight.t() for head in heads]))
+        ensemble.head_b2.copy_(torch.stack([head[2].bias[None] for head in heads]))
+    return twin, ensemble
+
+
+def batch():
+    generator = torch.Generator().manual_seed(1)
+    state = torch.randn((batch_size, state_dim), generator=generator)
+    action = torch.rand((batch_size, action_dim), generator=generator) * 2 - 1
+    q_label = torch.randn((batch_size, 1), generator=generator)
+    return state, action, q_label
+
+
+def test_q_values_match():
+    twin, ensemble = twin_and_ensemble()
+    state, action, _ = batch()
+    with torch.no_grad():
+        q1, q2 = twin.get_q1_q2(state, action)
+        torch.testing.assert_close(ensemble.get_q_values(state, action), torch.stack((q1, q2)))
+        torch.testing.assert_close(ensemble.get_q1_q2(state, action), (q1, q2))
+        torch.testing.assert_close(ensemble.get_q_min(state, action), twin.get_q_min(state, action))
+
+
+def test_critic_loss_and_gradients_match():
+    twin, ensemble = twin_and_ensemble()
+    state, action, q_label = batch()
+    criterion = torch.nn.SmoothL1Loss()
+
+    # the loss of the agents before CriticEnsemble, one term per head
+    q1, q2 = twin.get_q1_q2(state, action)
+    twin_loss = criterion(q1, q_label) + criterion(q2, q_label)
+    twin_loss.backward()
+    # the loss of the agents now, all heads in one call
+    q_values = ensemble.get_q_values(state, action)
+    ensemble_loss = criterion(q_values, q_label.expand_as(q_values)) * q_values.shape[0]
+    ensemble_loss.backward()
+
+    torch.testing.assert_close(ensemble_loss, twin_loss)
+    for param, twin_param in zip(ensemble.net_sa.parameters(), twin.net_sa.parameters()):
+        torch.testing.assert_close(param.grad, twin_param.grad)
+    heads = [twin.net_q1, twin.net_q2]
+    torch.testing.assert_close(ensemble.head_w1.grad, torch.stack([head[0].weight.grad.t() for head in heads]))
+    torch.testing.assert_close(ensemble.head_b1.grad, torch.stack([head[0].bias.grad[None] for head in heads]))
+    torch.testing.assert_close(ensemble.head_w2.grad, torch.stack([head[2].weight.grad.t() for head in heads]))
+    torch.testing.assert_close(ensemble.head_b2.grad, torch.stack([head[2].bias.grad[None] for head in heads]))
@@ -0,0 +1,65 @@
+'''if_obs_view must return the same observations as the default copies'''
+import numpy as np
+import pytest
+
+from random_generator_battery import ESSEnv, BatchESSEnv
+
+
+def rollout(env, actions, **reset_kwargs):
+    '''copies of current_obs and next_obs as step returned them'''
+    env.reset(**reset_kwargs)
+    steps = []
+    for action in actions:
+        current_obs, next_obs, *_ = env.step(action)
+        steps.append((current_obs.copy(), None if next_obs is None else next_obs.copy()))
+    return steps
+
+
+def assert_same(steps, reference):
+    for (current_obs, next_obs), (ref_current, ref_next) in zip(steps, reference):
+        np.testing.assert_array_equal(current_obs, ref_current)
+        if ref_next is None:
+            assert next_obs is None
+        else:
+            np.testing.assert_array_equal(next_obs, ref_next)
+
+
+@pytest.mark.parametrize('kwargs, reset_kwargs', [
+    ({}, {}),  # auto reset to a random day after every 24 hours
+    ({'if_continuous': True, 'episode_length': 72}, {'day': 30, 'month': 3, 'initial_soc': 0.5}),
+    ({'if_continuous': True, 'episode_length': 48}, {'day': 31, 'month': 12, 'initial_soc': 0.5}),
+])
+def test_view_matches_copy(kwargs, reset_kwargs):
+    actions = np.random.default_rng(0).uniform(-1, 1, (100, 4)).astype(np.float32)
+    reference = rollout(ESSEnv(seed=1, **kwargs), actions, **reset_kwargs)
+    assert_same(rollout(ESSEnv(seed=1, if_obs_view=True, **kwargs), actions, **reset_kwargs), reference)
+
+
+def test_current_obs_kept_across_auto_reset():
+    env = ESSEnv(seed=1, if_obs_view=True)
+    env.reset(day=10, month=3, initial_soc=0.5)
+    for _ in range(23):
+        env.step(np.zeros(4, dtype=np.float32))
+    current_obs, next_obs, _, finish = env.step(np.zeros(4, dtype=np.float32))
+    assert finish
+    np.testing.assert_array_equal(current_obs[[0, 7, 8]], [23, 3, 10])
+    np.testing.assert_array_equal(next_obs[[0, 7, 8]], [0, env.month, env.day])
+
+
+def test_current_obs_kept_across_midnight():
+    env = ESSEnv(if_obs_view=True, if_continuous=True, episode_length=48)
+    env.reset(day=31, month=3, initial_soc=0.5)
+    for _ in range(23):
+        env.step(np.zeros(4, dtype=np.float32))
+    current_obs, next_obs, _, _ = env.step(np.zeros(4, dtype=np.float32))
+    np.testing.assert_array_equal(current_obs[[0, 7, 8]], [23, 3, 31])
+    np.testing.assert_array_equal(next_obs[[0, 7, 8]], [0, 4, 1])
+
+
+def test_batch_view_matches_copy():
+    num_envs = 3
+    actions = np.random.default_rng(0).uniform(-1, 1, (48, num_envs, 4)).astype(np.float32)
+    reset_kwargs = {'day': np.array([31, 30, 1]), 'month': np.array([3, 12, 1]), 'initial_soc': np.full(num_envs, 0.5)}
+    kwargs = {'if_continuous': True, 'episode_length': 48}
+    reference = rollout(BatchESSEnv(num_envs, **kwargs), actions, **reset_kwargs)
+    assert_same(rollout(BatchESSEnv(num_envs, if_obs_view=True, **kwargs), actions, **reset_kwargs), reference)
@@ -0,0 +1,94 @@
+'''ReplayBuffer transitions across the ring wrap, and the round trip of the compact codecs'''
+import numpy as np
+import pytest
+import torch
+
+from tools import ReplayBuffer, get_ess_codecs
+
+state_dim = 3
+action_dim = 2
+
+
+def transitions(start, size):
+    '''the state of step t holds t in every column, next_state is the state of step t+1'''
+    steps = np.arange(start, start + size, dtype=np.float32)
+    state = np.repeat(steps[:, None], state_dim, axis=1)
+    other = np.concatenate([steps[:, None], np.ones((size, 1)), np.repeat(steps[:, None], action_dim, axis=1)], axis=1)
+    return torch.as_tensor(state), torch.as_tensor(other, dtype=torch.float32), torch.as_tensor(state + 1)
+
+
+def filled_buffer(if_store_next_state, max_len=8, chunks=(5, 5, 3)):
+    buffer = ReplayBuffer(max_len, state_dim, action_dim, gpu_id=-1, if_store_next_state=if_store_next_state, seed=0)
+    start = 0
+    for size in chunks:  # the second chunk straddles the end of the ring
+        state, other, next_state = transitions(start, size)
+        buffer.extend_buffer(state, other, next_state if if_store_next_state else None)
+        buffer.update_now_len()
+        start += size
+    return buffer, start
+
+
+@pytest.mark.parametrize('if_store_next_state', [False, True])
+def test_ring_wrap_keeps_successors(if_store_next_state):
+    buffer, num_steps = filled_buffer(if_store_next_state)
+    assert buffer.if_full and buffer.now_len == buffer.max_len
+    reward, mask, action, state, next_state = buffer.sample_batch(4096)
+    steps = state[:, 0]
+    # every sampled state is one of the latest max_len steps and its row holds its own reward and action
+    assert steps.min() >= num_steps - buffer.max_len and steps.max() <= num_steps - 1
+    np.testing.assert_array_equal(reward[:, 0], steps)
+    np.testing.assert_array_equal(action, steps[:, None].expand(-1, action_dim))
+    np.testing.assert_array_equal(next_state, state + 1)
+    if not if_store_next_state:  # the successor of the newest step is not in the buffer yet
+        assert steps.max() < num_steps - 1
+        assert set(steps.tolist()) == set(range(num_steps - buffer.max_len, num_steps - 1))
+
+
+def test_before_wrap():
+    buffer, num_steps = filled_buffer(False, max_len=16, chunks=(5, 4))
+    assert not buffer.if_full
+    _, _, _, state, next_state = buffer.sample_batch(1024)
+    np.testing.assert_array_equal(next_state, state + 1)
+    assert set(state[:, 0].tolist()) == set(range(num_steps - 1))
+
+
+def ess_transitions(rng, size, gamma):
+    '''ESSEnv states: time, price, soc, netload, dg1-3, month, day, the reward is unique and identifies a row'''
+    def states():
+        return np.column_stack([rng.integers(0, 24, size), rng.uniform(0, 120, size), rng.uniform(0.2, 0.8, size),
+                                rng.uniform(-500, 1500, size), rng.uniform(0, 500, (size, 3)),
+                                rng.integers(1, 13, size), rng.integers(1, 32, size)]).astype(np.float32)
+    other = np.column_stack([-rng.permutation(size) - rng.uniform(0, 0.5, size), gamma * rng.integers(0, 2, size),
+                             rng.uniform(-1, 1, (size, 4))]).astype(np.float32)
+    return states(), other, states()
+
+
+def test_codec_round_trip():
+    gamma = 0.995
+    rng = np.random.default_rng(0)
+    buffer = ReplayBuffer(64, 9, 4, gpu_id=-1, codecs=get_ess_codecs(4, gamma), seed=0)
+    rows = []
+    for size in (40, 40, 30):  # wraps around the ring twice
+        state, other, next_state = ess_transitions(rng, size, gamma)
+        buffer.extend_buffer(state, other, next_state)
+        buffer.update_now_len()
+        rows.append(np.concatenate([other, state, next_state], axis=1))
+    expected = np.concatenate(rows)[-64:]
+
+    reward, mask, action, state, next_state = buffer.sample_batch(4096)
+    decoded = torch.cat([reward, mask, action, state, next_state], dim=1).numpy()
+    rows = {value: i for i, value in enumerate(expected[:, 0].tolist())}
+    assert set(decoded[:, 0].tolist()) == set(rows)  # float32 columns are exact, every stored row is sampled
+    expected = expected[[rows[value] for value in decoded[:, 0].tolist()]]
+
+    other_dim = 6
+    for offset in (other_dim, other_dim + 9):  # state and next_state
+        np.testing.assert_array_equal(decoded[:, offset + 3], expected[:, offset + 3])  # netload float32
+        for col in (0, 7, 8):  # time, month and day uint8
+            np.testing.assert_array_equal(decoded[:, offset + col], expected[:, offset + col])
+        for col in (1, 2):  # price and soc float16
+            np.testing.assert_allclose(decoded[:, offset + col], expected[:, offset + col], rtol=2 ** -11)
+        # dg outputs int16 at 0.02 kw
+        np.testing.assert_allclose(decoded[:, offset + 4:offset + 7], expected[:, offset + 4:offset + 7], atol=0.01 + 1e-4)
+    np.testing.assert_allclose(decoded[:, 1], expected[:, 1], rtol=1e-6)  # mask is 0 or gamma
+    np.testing.assert_allclose(decoded[:, 2:other_dim], expected[:, 2:other_dim], atol=2 ** -11)  # actions float16
@@ -0,0 +1,59 @@
+'''ScenarioSampler shards must not overlap and every prefix of the table must be stratified'''
+import numpy as np
+import pytest
+
+from scenario_sampler import ScenarioSampler
+
+
+def keys(month, day, initial_soc):
+    return list(zip(month.tolist(), day.tolist(), np.round(initial_soc * 100).astype(int).tolist()))
+
+
+@pytest.fixture(scope='module')
+def sampler():
+    return ScenarioSampler(seed=3)
+
+
+def test_table_has_no_repeats(sampler):
+    scenarios = keys(*sampler.scenarios())
+    assert len(set(scenarios)) == len(sampler)
+    assert sampler.initial_soc.min() == 0.2 and sampler.initial_soc.max() == 0.8
+
+
+@pytest.mark.parametrize('number, start, num_workers', [(1000, 0, 4), (5000, 1234, 3), (2047, 7, 8)])
+def test_shards_partition_the_scenarios(sampler, number, start, num_workers):
+    shards = [keys(*sampler.scenarios(number, worker_id, num_workers, start)) for worker_id in range(num_workers)]
+    union = [scenario for shard in shards for scenario in shard]
+    assert len(union) == len(set(union)) == number  # no scenario in two shards
+    assert set(union) == set(keys(*sampler.scenarios(number, start=start)))
+    assert max(map(len, shards)) - min(map(len, shards)) <= 1
+
+
+def test_rounds_are_stratified(sampler):
+    for r in range(3):  # every round holds each (month, day, soc bin) stratum once
+        index = np.arange(r * sampler.strata, (r + 1) * sampler.strata)
+        strata = set(zip(sampler.month[index].tolist(), sampler.day[index].tolist(), sampler.soc_bin[index].tolist()))
+        assert len(strata) == sampler.strata
+
+    num_workers = 4
+    for worker_id in range(num_workers):  # the shards of a round share the strata evenly between the soc bins
+        month, day, initial_soc = sampler.scenarios(sampler.strata, worker_id, num_workers)
+        soc_bin = sampler.soc_bin[worker_id:sampler.strata:num_workers]
+        assert len(set(zip(month.tolist(), day.tolist(), soc_bin.tolist()))) == len(month)
+        counts = np.bincount(soc_bin, minlength=6)
+        np.testing.assert_allclose(counts, len(month) / 6, rtol=0.3)
+        assert len(set(month.tolist())) == 12
+
+
+def test_same_seed_same_table():
+    first, second = ScenarioSampler(seed=5), ScenarioSampler(seed=5)
+    assert keys(*first.scenarios(500)) == keys(*second.scenarios(500))
+    assert keys(*first.scenarios(500)) != keys(*ScenarioSampler(seed=6).scenarios(500))
+
+
+def test_take_wraps_around():
+    sampler = ScenarioSampler(seed=3)
+    sampler.take(len(sampler) - 2)
+    month, day, initial_soc = sampler.take(4)
+    assert keys(month, day, initial_soc) == keys(*sampler.scenarios(2, start=len(sampler) - 2)) + keys(*sampler.scenarios(2))
+    assert sampler.cursor == 2
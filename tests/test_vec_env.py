@@ -0,0 +1,56 @@
+'''AsyncVectorESSEnv must step its envs like ESSEnv copies stepped one after the other'''
+import numpy as np
+import pytest
+
+pytest.importorskip('gymnasium')
+
+from random_generator_battery import ESSEnv
+from vec_env import AsyncVectorESSEnv, DIAGNOSTICS
+
+num_envs = 5
+num_steps = 60  # the episodes end after 24 hours, so the envs reset to random days twice
+
+
+def sequential_rollout(actions, seed, options):
+    '''the same envs in this process, seeded like the workers seed them'''
+    envs = [ESSEnv(if_auto_reset=False, seed=seed) for seed in np.random.SeedSequence(seed).spawn(num_envs)]
+    obs = np.stack([env.reset(*(values[i] for values in options)) for i, env in enumerate(envs)])
+    steps = []
+    for action in actions:
+        step_obs, final_obs = np.zeros_like(obs), np.zeros_like(obs)
+        rewards, terminated = np.zeros(num_envs), np.zeros(num_envs, dtype=bool)
+        diagnostics = np.zeros((num_envs, len(DIAGNOSTICS)))
+        for i, env in enumerate(envs):
+            _, next_obs, rewards[i], terminated[i] = env.step(action[i])
+            diagnostics[i] = [getattr(env, key) for key in DIAGNOSTICS]
+            if terminated[i]:
+                final_obs[i] = next_obs
+                next_obs = env.reset()
+            step_obs[i] = next_obs
+        steps.append((step_obs, rewards, terminated, final_obs, diagnostics))
+    return obs, steps
+
+
+def vector_rollout(actions, seed, options, num_workers):
+    with AsyncVectorESSEnv(num_envs, num_workers=num_workers, seed=seed) as env:
+        obs, _ = env.reset(options=dict(zip(['day', 'month', 'initial_soc'], options)))
+        steps = []
+        for action in actions:
+            step_obs, rewards, terminated, truncated, infos = env.step(action)
+            assert not truncated.any()
+            diagnostics = np.stack([infos[key] for key in DIAGNOSTICS], axis=1)
+            steps.append((step_obs, rewards, terminated, infos['final_observation'] * terminated[:, None], diagnostics))
+    return obs, steps
+
+
+def test_vector_matches_sequential():
+    actions = np.random.default_rng(0).uniform(-1, 1, (num_steps, num_envs, 4)).astype(np.float32)
+    options = (np.array([1, 14, 20, 28, 5]), np.array([1, 3, 6, 12, 9]), np.array([0.2, 0.35, 0.5, 0.65, 0.8]))
+    obs, reference = sequential_rollout(actions, 7, options)
+    for num_workers in (1, 3):  # the episodes do not depend on how the envs are split between the workers
+        vector_obs, steps = vector_rollout(actions, 7, options, num_workers)
+        np.testing.assert_array_equal(vector_obs, obs)
+        for step, ref_step in zip(steps, reference):
+            for value, ref_value in zip(step, ref_step):
+                np.testing.assert_array_equal(value, ref_value)
+    assert sum(step[2].sum() for step in reference) == 2 * num_envs
@@ -12,6 +12,7 @@ from gurobipy import GRB
 from gurobipy import *
 import argparse
 from decision_transformer.models.decision_transformer import DecisionTransformer
+from profiling import profiler
 
 
 def optimization_base_result(env, month, day, initial_soc):
@@ -43,10 +44,13 @@ def optimization_base_result(env, month, day, initial_soc):
         return p_max, p_min, ramping_up, ramping_down, a_para, b_para, c_para
     p_max, p_min, ramping_up, ramping_down, a_para, b_para, c_para = get_dg_info(
         parameters=DG_parameters)
+    # a list with one dict per battery for MicrogridEnv, a single dict for ESSEnv
     battery_parameters = env.battery_parameters
+    if isinstance(battery_parameters, dict):
+        battery_parameters = [battery_parameters]
     NUM_GEN = len(DG_parameters.keys())
-    battery_capacity = env.battery.capacity
-    battery_efficiency = env.battery.efficiency
+    NUM_BATTERY = len(battery_parameters)
+    initial_soc = np.broadcast_to(initial_soc, NUM_BATTERY)
 
     m = gp.Model("UC")
     m.Params.LogToConsole = 0
@@ -55,18 +59,27 @@ def optimization_base_result(env, month, day, initial_soc):
     on_off = m.addVars(NUM_GEN, period, vtype=GRB.BINARY, name='on_off')
     gen_output = m.addVars(
         NUM_GEN, period, vtype=GRB.CONTINUOUS, name='output')
-    battery_energy_change = m.addVars(period, vtype=GRB.CONTINUOUS, lb=-env.battery.max_charge,
-                                      ub=env.battery.max_charge, name='battery_action')  # directly set constrains for charge/discharge
+    battery_energy_change = m.addVars(NUM_BATTERY, period, vtype=GRB.CONTINUOUS, lb=-GRB.INFINITY,
+                                      name='battery_action')
+    # directly set constrains for charge/discharge
+    m.addConstrs((battery_energy_change[b, t] <= battery_parameters[b]['max_charge']
+                 for b in range(NUM_BATTERY) for t in range(period)), 'charge_max')
+    m.addConstrs((battery_energy_change[b, t] >= -battery_parameters[b]['max_charge']
+                 for b in range(NUM_BATTERY) for t in range(period)), 'discharge_max')
     # set constrains for exchange between external grid and distributed energy system
     grid_energy_import = m.addVars(
         period, vtype=GRB.CONTINUOUS, lb=0, ub=env.grid.exchange_ability, name='import')
     grid_energy_export = m.addVars(
         period, vtype=GRB.CONTINUOUS, lb=0, ub=env.grid.exchange_ability, name='export')
-    soc = m.addVars(period, vtype=GRB.CONTINUOUS, lb=0.2, ub=0.8, name='SOC')
+    soc = m.addVars(NUM_BATTERY, period, vtype=GRB.CONTINUOUS, lb=0, name='SOC')
+    m.addConstrs((soc[b, t] <= battery_parameters[b]['max_soc']
+                 for b in range(NUM_BATTERY) for t in range(period)), 'soc_max')
+    m.addConstrs((soc[b, t] >= battery_parameters[b]['min_soc']
+                 for b in range(NUM_BATTERY) for t in range(period)), 'soc_min')
 
     # 1. add balance constrain
     m.addConstrs(((sum(gen_output[g, t] for g in range(NUM_GEN))+pv[t]+grid_energy_import[t] >= load[t] +
-                 battery_energy_change[t]+grid_energy_export[t]) for t in range(period)), name='powerbalance')
+                 sum(battery_energy_change[b, t] for b in range(NUM_BATTERY))+grid_energy_export[t]) for t in range(period)), name='powerbalance')
     # 2. add constrain for p max pmin
     m.addConstrs((gen_output[g, t] <= on_off[g, t]*p_max[g]
                  for g in range(NUM_GEN) for t in range(period)), 'output_max')
@@ -78,10 +91,12 @@ def optimization_base_result(env, month, day, initial_soc):
     m.addConstrs((gen_output[g, t]-gen_output[g, t+1] <= ramping_down[g]
                  for g in range(NUM_GEN) for t in range(period-1)), 'ramping_down')
     # 4. add constrains for SOC
-    m.addConstr(battery_capacity*soc[0] == battery_capacity*initial_soc+(
-        battery_energy_change[0]*battery_efficiency), name='soc0')
-    m.addConstrs((battery_capacity*soc[t] == battery_capacity*soc[t-1]+(
-        battery_energy_change[t]*battery_efficiency)for t in range(1, period)), name='soc update')
+    battery_capacity = [battery['capacity'] for battery in battery_parameters]
+    battery_efficiency = [battery['efficiency'] for battery in battery_parameters]
+    m.addConstrs((battery_capacity[b]*soc[b, 0] == battery_capacity[b]*initial_soc[b]+(
+        battery_energy_change[b, 0]*battery_efficiency[b]) for b in range(NUM_BATTERY)), name='soc0')
+    m.addConstrs((battery_capacity[b]*soc[b, t] == battery_capacity[b]*soc[b, t-1]+(
+        battery_energy_change[b, t]*battery_efficiency[b]) for b in range(NUM_BATTERY) for t in range(1, period)), name='soc update')
 
     # set cost function
     # 1 cost of generator
@@ -94,8 +109,14 @@ def optimization_base_result(env, month, day, initial_soc):
 
     m.setObjective((cost_gen+cost_grid_import-cost_grid_export), GRB.MINIMIZE)
     m.optimize()
-    output_record = {'pv': [], 'price': [], 'load': [], 'netload': [], 'soc': [], 'battery_energy_change': [
-    ], 'grid_import': [], 'grid_export': [], 'gen1': [], 'gen2': [], 'gen3': [], 'step_cost': []}
+    # soc and battery_energy_change of a single battery keep their names, several batteries are numbered
+    battery_names = [''] if NUM_BATTERY == 1 else [str(b+1) for b in range(NUM_BATTERY)]
+    output_record = {'pv': [], 'price': [], 'load': [], 'netload': []}
+    output_record.update({f'soc{name}': [] for name in battery_names})
+    output_record.update({f'battery_energy_change{name}': [] for name in battery_names})
+    output_record.update({'grid_import': [], 'grid_export': []})
+    output_record.update({f'gen{g+1}': [] for g in range(NUM_GEN)})
+    output_record['step_cost'] = []
     for t in range(period):
         gen_cost = sum((on_off[g, t].x*(a_para[g]*gen_output[g, t].x*gen_output[g,
                        t].x+b_para[g]*gen_output[g, t].x+c_para[g])) for g in range(NUM_GEN))
@@ -106,14 +127,14 @@ def optimization_base_result(env, month, day, initial_soc):
         output_record['price'].append(price[t])
         output_record['load'].append(load[t])
         output_record['netload'].append(load[t]-pv[t])
-        output_record['soc'].append(soc[t].x)
-        output_record['battery_energy_change'].append(
-            battery_energy_change[t].x)
+        for b, name in enumerate(battery_names):
+            output_record[f'soc{name}'].append(soc[b, t].x)
+            output_record[f'battery_energy_change{name}'].append(
+                battery_energy_change[b, t].x)
         output_record['grid_import'].append(grid_energy_import[t].x)
         output_record['grid_export'].append(grid_energy_export[t].x)
-        output_record['gen1'].append(gen_output[0, t].x)
-        output_record['gen2'].append(gen_output[1, t].x)
-        output_record['gen3'].append(gen_output[2, t].x)
+        for g in range(NUM_GEN):
+            output_record[f'gen{g+1}'].append(gen_output[g, t].x)
         output_record['step_cost'].append(
             gen_cost+grid_import_cost-grid_export_cost)
 
@@ -152,6 +173,16 @@ class Arguments:
         self.repeat_times = 2 ** 5  # repeatedly update network to keep critic's loss small
         self.target_step = 24  # collect target_step experiences , then update network, 1024
         self.max_memo = 500000  # capacity of replay buffer
+        # store next_state in the replay buffer instead of reading it from the following slot, a faster single
+        # gather for 96 instead of 60 bytes per transition, opt-in per script
+        self.if_store_next_state = False
+        # uint8/float16 codecs from get_ess_codecs, about half the memory per transition
+        self.if_compact_buffer = False
+        # >0: replace the critic by a CriticEnsemble with this many Q heads (REDQ-style)
+        self.critic_ensemble_num = 0
+        # time env step, actor forward, buffer, updates and evaluation with profiling.profiler
+        self.if_profile = False
+        self.if_profile_trace = False  # also save a Chrome trace of the timed sections in cwd
         # PER for off-policy sparse reward: Prioritized Experience Replay.
         self.if_per_or_gae = False
 
@@ -159,6 +190,8 @@ class Arguments:
         # self.eval_gap = 2 ** 6  # evaluate the agent per eval_gap seconds
         # self.eval_times = 2  # number of times that get episode return in first
         self.random_seed = 0  # initialize random seed in self.init_before_training()
+        # draw the training days and initial socs from a ScenarioSampler(random_seed) instead of np.random
+        self.if_scenario_sampler = False
         # self.random_seed_list = [1234, 2234, 3234, 4234, 5234]
         self.random_seed_list = [5234]
         '''Arguments for save and plot issues'''
@@ -169,6 +202,10 @@ class Arguments:
         self.compare_with_pyomo = True
         self.plot_on = True
 
+    def seed_sequences(self, number):
+        '''number independent seeds spawned from random_seed, e.g. for the env, the replay buffer and the agent'''
+        return np.random.SeedSequence(self.random_seed).spawn(number)
+
     def init_before_training(self, if_main):
         if self.cwd is None:
             agent_name = self.agent.__class__.__name__
@@ -184,8 +221,8 @@ class Arguments:
                 print(f"| Remove cwd: {self.cwd}")
             os.makedirs(self.cwd, exist_ok=True)
 
-        # np.random.seed(self.random_seed)
-        # torch.manual_seed(self.random_seed)
+        np.random.seed(self.random_seed)
+        torch.manual_seed(self.random_seed)
         torch.set_num_threads(self.num_threads)
         torch.set_default_dtype(torch.float32)
 
@@ -353,6 +390,7 @@ def test_one_episode_DT(env, device, model_init=None, month=None, day=None, init
         record_action.append(real_action)
         record_reward.append(reward)
         record_output.append(env.current_output)
+        record_cost.append(env.operation_cost)
         record_unbalance.append(env.unbalance)
         state = next_state
 
@@ -366,27 +404,89 @@ def test_one_episode_DT(env, device, model_init=None, month=None, day=None, init
     return record
 
 
+def test_episodes_DT_batch(env, get_actions, month, day, initial_soc, device, simple_model=False, state_mean=None,
+                           state_std=None, max_length=24, target_return=20000):
+    '''the rollout of test_one_episode_DT for all envs of a BatchESSEnv at once, one get_actions call per hour
+
+    get_actions(state) for a simple model, get_actions(states, actions, returns_to_go, timesteps, attention_mask) with
+    left padded windows of max_length for a decision transformer, in both cases it returns actions of shape (num_envs, 4)'''
+    state_dim = 9
+    act_dim = 4
+    env.TRAIN = False
+    state = env.reset(month=month, day=day, initial_soc=initial_soc)
+    num_envs, episode_length = state.shape[0], env.episode_length
+    state_mean = 0 if state_mean is None else state_mean
+    state_std = 1 if state_std is None else state_std
+
+    # the whole histories, the latest action is the zero padding as in test_one_episode_DT
+    states = torch.zeros((num_envs, episode_length, state_dim), device=device)
+    actions = torch.zeros((num_envs, episode_length, act_dim), device=device)
+    returns_to_go = torch.zeros((num_envs, episode_length, 1), device=device)
+    returns_to_go[:, 0] = target_return
+    timesteps = torch.arange(episode_length, device=device).expand(num_envs, episode_length)
+    # model inputs, positions in front of the window stay zero padding
+    window_states = torch.zeros((num_envs, max_length, state_dim), device=device)
+    window_actions = torch.zeros((num_envs, max_length, act_dim), device=device)
+    window_returns = torch.zeros((num_envs, max_length, 1), device=device)
+    window_timesteps = torch.zeros((num_envs, max_length), device=device, dtype=torch.long)
+    attention_mask = torch.zeros((num_envs, max_length), device=device, dtype=torch.long)
+
+    costs = np.empty((num_envs, episode_length))
+    unbalances = np.empty((num_envs, episode_length))
+    for i in range(episode_length):
+        states[:, i] = torch.as_tensor(state, device=device)
+        if simple_model:
+            a_tensor = get_actions(states[:, i])
+        else:
+            start = max(0, i+1-max_length)
+            pad = max_length-(i+1-start)
+            window_states[:, pad:] = (states[:, start:i+1]-state_mean)/state_std
+            window_actions[:, pad:] = actions[:, start:i+1]
+            window_returns[:, pad:] = returns_to_go[:, start:i+1]
+            window_timesteps[:, pad:] = timesteps[:, start:i+1]
+            attention_mask[:, pad:] = 1
+            a_tensor = get_actions(window_states, window_actions, window_returns, window_timesteps, attention_mask)
+        actions[:, i] = a_tensor
+
+        _, state, reward, costs[:, i], unbalances[:, i], _ = env.step(a_tensor.detach().cpu().numpy())
+        if i+1 < episode_length:
+            returns_to_go[:, i+1] = returns_to_go[:, i]-torch.as_tensor(reward, device=device, dtype=torch.float32)[:, None]
+    return {'cost': costs, 'unbalance': unbalances}
+
+
 def get_episode_return(env, act, device):
-    episode_return = 0.0  # sum of rewards in an episode
-    episode_unbalance = 0.0
-    state = env.reset()
-    for i in range(24):
-        s_tensor = torch.as_tensor((state,), device=device)
-        a_tensor = act(s_tensor)
-        # not need detach(), because with torch.no_grad() outside
-        action = a_tensor.detach().cpu().numpy()[0]
-        state, next_state, reward, done, = env.step(action)
-        state = next_state
-        episode_return += reward
-        episode_unbalance += env.real_unbalance
-        if done:
-            break
-    return episode_return, episode_unbalance
+    with profiler.section('evaluation'):
+        episode_return = 0.0  # sum of rewards in an episode
+        episode_unbalance = 0.0
+        state = env.reset()
+        for i in range(24):
+            s_tensor = torch.as_tensor((state,), device=device)
+            a_tensor = act(s_tensor)
+            # not need detach(), because with torch.no_grad() outside
+            action = a_tensor.detach().cpu().numpy()[0]
+            state, next_state, reward, done, = env.step(action)
+            state = next_state
+            episode_return += reward
+            episode_unbalance += env.real_unbalance
+            if done:
+                break
+        return episode_return, episode_unbalance
+
+
+def get_ess_codecs(action_dim, gamma):
+    '''per column (dtype, scale) codecs of (reward, mask, action, state) for the compact ReplayBuffer of ESSEnv'''
+    other_codecs = [('float32', 1.0),  # reward
+                    ('uint8', gamma)] + [('float16', 1.0)] * action_dim  # mask is 0 or gamma
+    # time_step, price, soc, net_load, dg1, dg2, dg3, month, day, dg outputs are kept at 0.02 kw resolution
+    state_codecs = [('uint8', 1.0), ('float16', 1.0), ('float16', 1.0), ('float32', 1.0),
+                    ('int16', 0.02), ('int16', 0.02), ('int16', 0.02), ('uint8', 1.0), ('uint8', 1.0)]
+    return other_codecs + state_codecs
 
 
 class ReplayBuffer:
-    def __init__(self, max_len, state_dim, action_dim, gpu_id=0):
+    def __init__(self, max_len, state_dim, action_dim, gpu_id=0, if_store_next_state=False, codecs=None, seed=None):
         self.now_len = 0
+        self.rng = np.random.default_rng(seed)  # the sampled indices, seed is an int or a np.random.SeedSequence
         self.next_idx = 0
         self.if_full = False
         self.max_len = max_len
@@ -394,8 +494,52 @@ class ReplayBuffer:
         self.action_dim = action_dim
         self.device = torch.device(f"cuda:{gpu_id}" if (
             torch.cuda.is_available() and (gpu_id >= 0)) else "cpu")
+        # store next_state explicitly, one row (reward, mask, action, state, next_state) per transition
+        self.if_store_next_state = if_store_next_state
+        # compact storage: (dtype, scale) per column of (reward, mask, action, state), see get_ess_codecs
+        self.codecs = codecs
 
         other_dim = 1 + 1 + self.action_dim
+        if self.codecs is not None:
+            if not isinstance(state_dim, int) or len(codecs) != other_dim + state_dim:
+                raise ValueError('codecs')
+            self.if_store_next_state = True  # next_state shares the state codecs
+            self.other_dim = other_dim
+            self.state_dim = state_dim
+            trans_codecs = list(codecs) + list(codecs[other_dim:])
+            # one packed byte row per transition, the columns grouped by dtype, wider dtypes first so that every
+            # group is aligned for .view(dtype), sample_batch gathers the rows once
+            self.buf_groups = []  # (cols, dtype, first byte, last byte)
+            row_bytes = 0
+            dtypes = sorted(dict.fromkeys(codec[0] for codec in trans_codecs), key=lambda d: -np.dtype(d).itemsize)
+            for dtype in dtypes:
+                cols = [i for i, codec in enumerate(trans_codecs) if codec[0] == dtype]
+                size = len(cols) * np.dtype(dtype).itemsize
+                self.buf_groups.append((torch.tensor(cols, device=self.device), getattr(torch, dtype),
+                                        row_bytes, row_bytes + size))
+                row_bytes += size
+            itemsize = np.dtype(dtypes[0]).itemsize
+            row_bytes = -(-row_bytes // itemsize) * itemsize  # rows stay aligned to the widest dtype
+            self.buf_trans = torch.empty((max_len, row_bytes), dtype=torch.uint8, device=self.device)
+            self.col_packed = torch.cat([cols for cols, _, _, _ in self.buf_groups])
+            # the scale of every column in packed order, all columns are dequantized by one multiply
+            self.scale = torch.tensor([trans_codecs[i][1] for i in self.col_packed.tolist()],
+                                      dtype=torch.float32, device=self.device)
+            # put the packed columns back into (reward, mask, action, state, next_state) order
+            self.col_order = torch.argsort(self.col_packed)
+            return
+
+        if self.if_store_next_state:
+            if not isinstance(state_dim, int):
+                raise ValueError('state_dim')
+            # one contiguous row per transition, so sample_batch needs a single gather
+            self.buf_trans = torch.empty(
+                size=(max_len, other_dim + state_dim * 2), dtype=self.data_type, device=self.device)
+            self.buf_other = self.buf_trans[:, :other_dim]
+            self.buf_state = self.buf_trans[:, other_dim:other_dim + state_dim]
+            self.buf_next_state = self.buf_trans[:, other_dim + state_dim:]
+            return
+
         self.buf_other = torch.empty(
             size=(max_len, other_dim), dtype=self.data_type, device=self.device)
 
@@ -408,31 +552,106 @@ class ReplayBuffer:
         else:
             raise ValueError('state_dim')
 
-    def extend_buffer(self, state, other):  # CPU array to CPU array
+    def extend_buffer(self, state, other, next_state=None):  # CPU array to CPU array
+        with profiler.section('buffer_extend'):
+            self._extend_buffer(state, other, next_state)
+
+    def _extend_buffer(self, state, other, next_state=None):
+        if self.if_store_next_state and next_state is None:
+            raise ValueError('next_state is required when if_store_next_state=True')
         size = len(other)
         next_idx = self.next_idx + size
 
+        if self.codecs is not None:
+            trans = torch.cat((torch.as_tensor(other, dtype=torch.float32),
+                               torch.as_tensor(state, dtype=torch.float32),
+                               torch.as_tensor(next_state, dtype=torch.float32)), dim=1).to(self.device)
+            if next_idx > self.max_len:
+                self.encode_rows(self.next_idx, self.max_len, trans[:self.max_len - self.next_idx])
+                self.if_full = True
+
+                next_idx = next_idx - self.max_len
+                self.encode_rows(0, next_idx, trans[-next_idx:])
+            else:
+                self.encode_rows(self.next_idx, next_idx, trans)
+            self.next_idx = next_idx
+            return
+
         if next_idx > self.max_len:
             self.buf_state[self.next_idx:self.max_len] = state[:self.max_len - self.next_idx]
             self.buf_other[self.next_idx:self.max_len] = other[:self.max_len - self.next_idx]
+            if self.if_store_next_state:
+                self.buf_next_state[self.next_idx:self.max_len] = next_state[:self.max_len - self.next_idx]
             self.if_full = True
 
             next_idx = next_idx - self.max_len
             self.buf_state[0:next_idx] = state[-next_idx:]
             self.buf_other[0:next_idx] = other[-next_idx:]
+            if self.if_store_next_state:
+                self.buf_next_state[0:next_idx] = next_state[-next_idx:]
         else:
             self.buf_state[self.next_idx:next_idx] = state
             self.buf_other[self.next_idx:next_idx] = other
+            if self.if_store_next_state:
+                self.buf_next_state[self.next_idx:next_idx] = next_state
         self.next_idx = next_idx
 
+    def encode_rows(self, start, end, trans):
+        code = trans.index_select(1, self.col_packed) / self.scale  # packed column order
+        col = 0
+        for cols, dtype, first, last in self.buf_groups:
+            group = code[:, col:col + len(cols)]
+            col += len(cols)
+            if not dtype.is_floating_point:
+                group = group.round()
+            self.buf_trans[start:end, first:last] = group.to(dtype).contiguous().view(torch.uint8)
+
     def sample_batch(self, batch_size) -> tuple:
-        indices = rd.randint(self.now_len - 1, size=batch_size)
+        with profiler.section('buffer_sample'):
+            return self._sample_batch(batch_size)
+
+    def _sample_batch(self, batch_size) -> tuple:
+        if self.codecs is not None:
+            indices = torch.as_tensor(self.rng.integers(self.now_len, size=batch_size), device=self.device)
+            rows = self.buf_trans.index_select(0, indices)  # single gather of the packed rows
+            trans = torch.empty((batch_size, len(self.scale)), dtype=torch.float32, device=self.device)
+            col = 0
+            for cols, dtype, first, last in self.buf_groups:
+                trans[:, col:col + len(cols)] = rows[:, first:last].view(dtype)
+                col += len(cols)
+            trans = trans.mul_(self.scale).index_select(1, self.col_order)  # dequantize all columns at once
+            other_dim, state_dim = self.other_dim, self.state_dim
+            return (trans[:, 0:1],
+                    trans[:, 1:2],
+                    trans[:, 2:other_dim],
+                    trans[:, other_dim:other_dim + state_dim],
+                    trans[:, other_dim + state_dim:])
+
+        if self.if_store_next_state:
+            indices = self.rng.integers(self.now_len, size=batch_size)
+            trans = self.buf_trans[indices]  # single fused gather
+            other_dim = self.buf_other.shape[1]
+            state_dim = self.buf_state.shape[1]
+            return (trans[:, 0:1],
+                    trans[:, 1:2],
+                    trans[:, 2:other_dim],
+                    trans[:, other_dim:other_dim + state_dim],
+                    trans[:, other_dim + state_dim:])
+
+        if self.if_full:
+            # skip the newest transition, its successor slot has already been overwritten,
+            # and wrap indices + 1 around the ring
+            indices = (self.next_idx + self.rng.integers(self.now_len - 1, size=batch_size)) % self.max_len
+            next_indices = (indices + 1) % self.max_len
+        else:
+            indices = self.rng.integers(self.now_len - 1, size=batch_size)
+            next_indices = indices + 1
         r_m_a = self.buf_other[indices]
         return (r_m_a[:, 0:1],
                 r_m_a[:, 1:2],
                 r_m_a[:, 2:],
                 self.buf_state[indices],
-                self.buf_state[indices + 1])
+                self.buf_state[next_indices])
 
     def update_now_len(self):
         self.now_len = self.max_len if self.if_full else self.next_idx
@@ -0,0 +1,166 @@
+'''a gymnasium style adapter of ESSEnv and a vector env of ESSEnv copies in worker processes, whose observations,
+rewards and diagnostics are written to shared memory'''
+import multiprocessing as mp
+
+import numpy as np
+
+try:
+    import gymnasium as gym
+except ImportError:  # gym 0.26 has the same reset and step API
+    import gym
+
+from random_generator_battery import ESSEnv
+
+DIAGNOSTICS = ['operation_cost', 'unbalance', 'excess', 'shedding']
+
+
+def _check_env_kwargs(env_kwargs, owner, reserved):
+    '''the env arguments in reserved are set by owner, passing them as well would clash'''
+    clashes = [key for key in reserved if key in env_kwargs]
+    if clashes:
+        raise ValueError(f'{owner} sets {", ".join(clashes)} of the env itself, remove them from env_kwargs')
+
+
+class GymnasiumESSEnv(gym.Env):
+    '''reset(seed, options) -> (obs, info) and step(action) -> (obs, reward, terminated, truncated, info)
+
+    options can hold day, month and initial_soc of ESSEnv.reset, the end of the episode is terminated and returns the
+    observation after its last hour, info has the operation_cost, unbalance, excess and shedding of the step
+    '''
+    metadata = {'render_modes': []}
+
+    def __init__(self, env_class=ESSEnv, **env_kwargs):
+        _check_env_kwargs(env_kwargs, 'GymnasiumESSEnv', ['if_auto_reset'])  # the episodes end with terminated
+        self.env = env_class(if_auto_reset=False, **env_kwargs)
+        self.action_space = gym.spaces.Box(-1, 1, shape=self.env.action_space.shape, dtype=np.float32)
+        # month, day and the unit outputs are not scaled to [0, 1] like state_space claims
+        self.observation_space = gym.spaces.Box(-np.inf, np.inf, shape=self.env.state_space.shape, dtype=np.float32)
+
+    def reset(self, *, seed=None, options=None):
+        super().reset(seed=seed)
+        if seed is not None:
+            self.env.rng = self.np_random  # the random days and socs come from the generator seeded by gymnasium
+        options = options or {}
+        obs = self.env.reset(options.get('day'), options.get('month'), options.get('initial_soc'))
+        return obs, {}
+
+    def step(self, action):
+        _, next_obs, reward, finish = self.env.step(action)
+        info = {key: getattr(self.env, key) for key in DIAGNOSTICS}
+        return next_obs, reward, finish, False, info
+
+
+def _worker(pipe, env_ids, env_class, env_kwargs, seeds, buffers):
+    '''steps the envs env_ids in this process, reading actions from and writing results to the shared buffers'''
+    obs, final_obs, actions, rewards, terminated, diagnostics = (np.frombuffer(buffer, dtype=dtype).reshape(shape)
+                                                                 for buffer, dtype, shape in buffers)
+    # the observations are copied into the shared buffers right away, so the envs can return views
+    envs = [env_class(if_auto_reset=False, if_obs_view=True, seed=seed, **env_kwargs) for seed in seeds]
+    while True:
+        command, data = pipe.recv()
+        if command == 'step':
+            for i, env in zip(env_ids, envs):
+                _, next_obs, rewards[i], terminated[i] = env.step(actions[i])
+                diagnostics[i] = env.operation_cost, env.unbalance, env.excess, env.shedding
+                if terminated[i]:  # autoreset, the last observation of the episode is kept in final_obs
+                    final_obs[i] = next_obs
+                    next_obs = env.reset()
+                obs[i] = next_obs
+        elif command == 'reset':
+            for i, env in zip(env_ids, envs):
+                obs[i] = env.reset(*(None if values is None else values[i] for values in data))
+        elif command == 'close':
+            pipe.close()
+            return
+        pipe.send(None)
+
+
+class AsyncVectorESSEnv:
+    '''num_envs ESSEnv copies stepped in num_workers processes, with the gymnasium vector env API
+
+    an env that ends an episode is reset in the same step, its last observation is in infos['final_observation'].
+    Every env has its own random stream spawned from seed, so the episodes do not depend on num_workers.
+    '''
+
+    def __init__(self, num_envs, num_workers=None, env_class=ESSEnv, env_kwargs=None, seed=None, copy=True):
+        self.num_envs = num_envs
+        num_workers = min(num_envs, mp.cpu_count() if num_workers is None else num_workers)
+        self.copy = copy  # False: return views of the shared buffers, overwritten by the next step
+        env_kwargs = env_kwargs or {}
+        # the workers reset the envs themselves, copy the observations right away and seed every env from seed
+        _check_env_kwargs(env_kwargs, 'AsyncVectorESSEnv', ['if_auto_reset', 'if_obs_view', 'seed'])
+        env = env_class(**env_kwargs)
+        state_dim, action_dim = env.state_space.shape[0], env.action_space.shape[0]
+        self.single_observation_space = gym.spaces.Box(-np.inf, np.inf, shape=(state_dim,), dtype=np.float32)
+        self.single_action_space = gym.spaces.Box(-1, 1, shape=(action_dim,), dtype=np.float32)
+
+        ctx = mp.get_context('spawn')
+        specs = [(np.float32, (num_envs, state_dim)), (np.float32, (num_envs, state_dim)),
+                 (np.float32, (num_envs, action_dim)), (np.float64, (num_envs,)), (np.bool_, (num_envs,)),
+                 (np.float64, (num_envs, len(DIAGNOSTICS)))]
+        buffers = [(ctx.RawArray('b', int(np.prod(shape)) * np.dtype(dtype).itemsize), dtype, shape)
+                   for dtype, shape in specs]
+        self.obs, self.final_obs, self.actions, self.rewards, self.terminated, self.diagnostics = (
+            np.frombuffer(buffer, dtype=dtype).reshape(shape) for buffer, dtype, shape in buffers)
+
+        seeds = np.random.SeedSequence(seed).spawn(num_envs)
+        self.pipes, self.processes = [], []
+        for env_ids in np.array_split(np.arange(num_envs), num_workers):
+            parent_pipe, child_pipe = ctx.Pipe()
+            process = ctx.Process(target=_worker, daemon=True, args=(
+                child_pipe, env_ids, env_class, env_kwargs, [seeds[i] for i in env_ids], buffers))
+            process.start()
+            child_pipe.close()
+            self.pipes.append(parent_pipe)
+            self.processes.append(process)
+        self.closed = False
+
+    def _wait(self):
+        for pipe in self.pipes:
+            pipe.recv()
+
+    def _output(self, array):
+        return array.copy() if self.copy else array
+
+    def reset(self, *, seed=None, options=None):
+        '''options can hold arrays of num_envs days, months and initial socs'''
+        if seed is not None:
+            raise ValueError('seed the workers with AsyncVectorESSEnv(seed=...)')
+        options = options or {}
+        data = [options.get(key) for key in ['day', 'month', 'initial_soc']]
+        for pipe in self.pipes:
+            pipe.send(('reset', data))
+        self._wait()
+        return self._output(self.obs), {}
+
+    def step_async(self, actions):
+        self.actions[:] = actions
+        for pipe in self.pipes:
+            pipe.send(('step', None))
+
+    def step_wait(self):
+        self._wait()
+        infos = {key: self._output(self.diagnostics[:, i]) for i, key in enumerate(DIAGNOSTICS)}
+        infos['final_observation'] = self._output(self.final_obs)
+        infos['_final_observation'] = self._output(self.terminated)
+        return (self._output(self.obs), self._output(self.rewards), self._output(self.terminated),
+                np.zeros(self.num_envs, dtype=bool), infos)
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self.closed:
+            return
+        for pipe in self.pipes:
+            pipe.send(('close', None))
+        for process in self.processes:
+            process.join()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()